@@ -7,6 +7,7 @@ from tqdm import tqdm
 import concurrent.futures
 from typing import List, Dict, Tuple
 import math
+from dataset_manifest import build_manifest
 
 # Configure logging
 logging.basicConfig(
@@ -47,6 +48,9 @@ COLLECTIONS = {
     }
 }
 
+# Seed for the random generator, recorded in the dataset manifest
+RANDOM_SEED = 20250301
+
 # TPID configurations
 TPID_CONFIGS = [
     (1000011, 500000),
@@ -176,6 +180,8 @@ def generate_documents_batch(
         for event in events:
             document = {
                 "tracking_reference": tracking_number,
+                # Reversed so suffix searches are anchored index prefix scans
+                "tracking_reference_reversed": tracking_number[::-1],
                 "tpid": tpid,
                 "timestamp": event["event_datetime"],  # Each event becomes a separate document
                 "edifact_code": event["edifact_code"],
@@ -193,6 +199,9 @@ def process_tpid_batch(args):
     """Process a single batch for a TPID"""
     tracking_counter, batch_size, tpid, start_date, end_date, collection_name = args
     try:
+        # Seed per batch so forked workers do not repeat each other's sequences
+        random.seed(RANDOM_SEED + tracking_counter)
+        
         db = get_db_connection()
         collection = db[collection_name]
         
@@ -287,6 +296,7 @@ def process_collection(collection_name: str, config: Dict):
         logging.info("Creating indexes...")
         collection.create_index([("tpid", 1)])
         collection.create_index([("tracking_reference", 1)])
+        collection.create_index([("tracking_reference_reversed", 1)])
         collection.create_index([("edifact_code", 1)])
         collection.create_index([("timestamp", 1)])
         collection.create_index([("tpid", 1), ("timestamp", 1)])
@@ -348,6 +358,7 @@ def main():
         for collection_name, config in COLLECTIONS.items():
             logging.info(f"Processing collection: {collection_name}")
             process_collection(collection_name, config)
+            build_manifest(db, collection_name, seed=RANDOM_SEED, config=config)
             logging.info(f"Completed collection: {collection_name}")
             
     except Exception as e:
@@ -1,3 +1,4 @@
+import argparse
 import pymongo
 from pymongo import MongoClient
 from datetime import datetime, timedelta
@@ -7,6 +8,11 @@ from tqdm import tqdm
 import concurrent.futures
 from typing import List, Dict, Tuple
 import math
+from build_daily_rollup import build_collection_rollup
+from dataset_manifest import build_manifest
+from compact_schema import COMPACT_DATABASE, COMPACT_FIELDS, to_compact
+from clustered_layout import (CLUSTERED_DATABASES, CLUSTER_KEYS, DEFAULT_CLUSTER_KEY, REFERENCE_FIELDS,
+                              create_clustered_collection, to_clustered)
 
 # Configure logging
 logging.basicConfig(
@@ -47,6 +53,9 @@ COLLECTIONS = {
     }
 }
 
+# Seed for the random generator, recorded in the dataset manifest
+RANDOM_SEED = 20250301
+
 # TPID configurations
 TPID_CONFIGS = [
     (1000011, 500000),
@@ -109,6 +118,8 @@ def generate_documents_batch(
         
         document = {
             "tracking_reference": tracking_number,
+            # Reversed so suffix searches are anchored index prefix scans
+            "tracking_reference_reversed": tracking_number[::-1],
             "tpid": tpid,
             "edifact_code": edifact_code,
             "event_description": event_description,
@@ -117,18 +128,29 @@ def generate_documents_batch(
         documents.append(document)
     return documents
 
-def process_collection(collection_name: str, config: Dict):
+def process_collection(collection_name: str, config: Dict, target_db=None, compact: bool = False,
+                       cluster_key: str = None):
     try:
-        collection = db[collection_name]
+        collection = (db if target_db is None else target_db)[collection_name]
         
         # Drop collection if exists
         collection.drop()
         
+        # Clustered layouts store documents in _id order
+        if cluster_key:
+            create_clustered_collection(collection.database, collection_name)
+        
         # Create indexes
-        collection.create_index([("tpid", 1)])
-        collection.create_index([("edifact_code", 1)])
-        collection.create_index([("event_datetime", 1)])
-        collection.create_index([("tracking_reference", 1)])
+        for field in ("tpid", "edifact_code", "event_datetime", "tracking_reference"):
+            if compact:
+                field = COMPACT_FIELDS[field]
+            elif cluster_key and field == "tracking_reference":
+                if cluster_key == "reference":
+                    continue  # the clustered _id is the reference
+                field = REFERENCE_FIELDS[cluster_key]
+            collection.create_index([(field, 1)])
+        if not compact:
+            collection.create_index([("tracking_reference_reversed", 1)])
         
         # Calculate TPID distribution
         total_monthly_parcels = config['total_parcels']
@@ -153,6 +175,10 @@ def process_collection(collection_name: str, config: Dict):
                         config['start_date'],
                         config['end_date']
                     )
+                    if compact:
+                        documents = [to_compact(document) for document in documents]
+                    elif cluster_key:
+                        documents = [to_clustered(document, cluster_key) for document in documents]
                     collection.insert_many(documents)
                     tracking_counter += current_batch_size
                     pbar.update(current_batch_size)
@@ -177,6 +203,10 @@ def process_collection(collection_name: str, config: Dict):
                         config['start_date'],
                         config['end_date']
                     )
+                    if compact:
+                        documents = [to_compact(document) for document in documents]
+                    elif cluster_key:
+                        documents = [to_clustered(document, cluster_key) for document in documents]
                     collection.insert_many(documents)
                     tracking_counter += current_batch_size
                     pbar.update(current_batch_size)
@@ -185,19 +215,39 @@ def process_collection(collection_name: str, config: Dict):
         logging.error(f"Error processing collection {collection_name}: {str(e)}")
         raise
 
-def main():
+def main(schema: str = "standard", cluster_key: str = DEFAULT_CLUSTER_KEY):
     try:
+        compact = schema == "compact"
+        if schema != "clustered":
+            cluster_key = None
+        db_name = COMPACT_DATABASE if compact else CLUSTERED_DATABASES[cluster_key] if cluster_key \
+            else 'nzpost_summary'
+        target_db = client[db_name]
+        
         # Drop database if exists
-        client.drop_database('nzpost_summary')
+        client.drop_database(db_name)
+        
+        random.seed(RANDOM_SEED)
         
         # Process collections sequentially
         for collection_name, config in COLLECTIONS.items():
-            process_collection(collection_name, config)
+            process_collection(collection_name, config, target_db, compact, cluster_key)
+            # The rollup and manifest read the standard field names
+            if schema == "standard":
+                build_collection_rollup(target_db, collection_name)
+                build_manifest(target_db, collection_name, seed=RANDOM_SEED, config=config)
             
     except Exception as e:
         logging.error(f"Error in main: {str(e)}")
         raise
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Generate the nzpost_summary test data")
+    parser.add_argument("--schema", choices=["standard", "compact", "clustered"], default="standard",
+                        help="compact writes short field names and integer references to " + COMPACT_DATABASE +
+                             "; clustered writes collections clustered on the cluster key")
+    parser.add_argument("--cluster-key", choices=CLUSTER_KEYS, default=DEFAULT_CLUSTER_KEY,
+                        help="_id of the clustered layout: reference or {tpid, tracking_reference}")
+    args = parser.parse_args()
+    main(args.schema, args.cluster_key)
 
@@ -1,3 +1,4 @@
+import argparse
 import pymongo
 from pymongo import MongoClient
 from datetime import datetime, timedelta
@@ -7,6 +8,11 @@ from tqdm import tqdm
 import concurrent.futures
 from typing import List, Dict, Tuple
 import math
+from build_daily_rollup import build_collection_rollup
+from dataset_manifest import build_manifest
+from item_split import SPLIT_DATABASE, DETAILS_INDEXES, details_collection_name, split_document
+from clustered_layout import (CLUSTERED_ITEM_DATABASES, CLUSTER_KEYS, DEFAULT_CLUSTER_KEY, REFERENCE_FIELDS,
+                              create_clustered_collection, to_clustered)
 
 # Configure logging
 logging.basicConfig(
@@ -47,6 +53,9 @@ COLLECTIONS = {
     }
 }
 
+# Seed for the random generator, recorded in the dataset manifest
+RANDOM_SEED = 20250301
+
 # TPID configurations with merchant mappings
 TPID_CONFIGS = [
     (1000011, 500000, "OfficeMax New Zealand Ltd", "91804159"),
@@ -77,19 +86,19 @@ PRODUCT_CONFIGS = [
         "service_code": "CPOLP",
         "description": "Courier Parcel",
         "service_standard": "OVERNIGHT",
-        "sla_days": "1"
+        "sla_days": 1
     },
     {
         "service_code": "CPOLR",
         "description": "Rural Parcel",
         "service_standard": "2-DAY",
-        "sla_days": "2"
+        "sla_days": 2
     },
     {
         "service_code": "CPOLS",
         "description": "Saturday Delivery",
         "service_standard": "SATURDAY",
-        "sla_days": "1"
+        "sla_days": 1
     }
 ]
 
@@ -140,10 +149,12 @@ def generate_address():
         "dpid": str(random.randint(100000, 999999))
     }
 
-def generate_parcel_details(tracking_ref: str, merchant_name: str) -> Dict:
+def generate_parcel_details(tracking_ref: str, merchant_name: str, event_datetime: datetime) -> Dict:
     is_rural = random.random() < 0.2
     is_signature = random.random() < 0.3
     product = random.choice(PRODUCT_CONFIGS).copy()
+    # Lodged up to four days before the parcel's event; the EDD is lodgement plus the SLA
+    lodged_datetime = event_datetime - timedelta(hours=random.randint(0, 96))
     product.update({
         "is_signature_required": is_signature,
         "is_photo_required": random.random() < 0.4,
@@ -154,7 +165,7 @@ def generate_parcel_details(tracking_ref: str, merchant_name: str) -> Dict:
         "is_no_atl": random.random() < 0.05,
         "is_dangerous_goods": random.random() < 0.02,
         "is_xl": random.random() < 0.1,
-        "initial_edd": (datetime.now() + timedelta(days=int(product["sla_days"]))).isoformat()
+        "initial_edd": lodged_datetime + timedelta(days=product["sla_days"])
     })
 
     return {
@@ -203,28 +214,58 @@ def generate_documents_batch(
         
         document = {
             "tracking_reference": tracking_number,
+            # Reversed so suffix searches are anchored index prefix scans
+            "tracking_reference_reversed": tracking_number[::-1],
             "tpid": tpid,
             "edifact_code": edifact_code,
             "event_description": event_description,
             "event_datetime": event_datetime,
-            "parcel_details": generate_parcel_details(tracking_number, merchant_name)
+            "parcel_details": generate_parcel_details(tracking_number, merchant_name, event_datetime)
         }
         documents.append(document)
     return documents
 
-def process_collection(collection_name: str, config: Dict):
+def insert_documents(collection, details_collection, documents: List[Dict], cluster_key: str = None):
+    """Insert item documents, splitting off parcel_details when a details collection is given"""
+    if cluster_key:
+        documents = [to_clustered(document, cluster_key) for document in documents]
+    if details_collection is None:
+        collection.insert_many(documents)
+        return
+    events, details = zip(*(split_document(document) for document in documents))
+    collection.insert_many(list(events))
+    details_collection.insert_many(list(details))
+
+def process_collection(collection_name: str, config: Dict, target_db=None, split: bool = False,
+                       cluster_key: str = None):
     try:
-        collection = db[collection_name]
+        target_db = db if target_db is None else target_db
+        collection = target_db[collection_name]
+        details_collection = target_db[details_collection_name(collection_name)] if split else None
         
         # Drop collection if exists
         collection.drop()
         
+        # Clustered layouts store documents in _id order
+        if cluster_key:
+            create_clustered_collection(target_db, collection_name)
+        
         # Create indexes
         collection.create_index([("tpid", 1)])
         collection.create_index([("edifact_code", 1)])
-        collection.create_index([("tracking_reference", 1)])
-        collection.create_index([("parcel_details.custom_item_id", 1)])
-        collection.create_index([("parcel_details.product.service_code", 1)])
+        if not cluster_key:
+            collection.create_index([("tracking_reference", 1)])
+        elif cluster_key != "reference":  # the reference layout's clustered _id is the reference
+            collection.create_index([(REFERENCE_FIELDS[cluster_key], 1)])
+        collection.create_index([("tracking_reference_reversed", 1)])
+        if split:
+            # Details are keyed by tracking reference (_id)
+            details_collection.drop()
+            for index_name, key in DETAILS_INDEXES:
+                details_collection.create_index(key, name=index_name)
+        else:
+            collection.create_index([("parcel_details.custom_item_id", 1)])
+            collection.create_index([("parcel_details.product.service_code", 1)])
         
         # Calculate TPID distribution
         total_monthly_parcels = config['total_parcels']
@@ -250,7 +291,7 @@ def process_collection(collection_name: str, config: Dict):
                         config['start_date'],
                         config['end_date']
                     )
-                    collection.insert_many(documents)
+                    insert_documents(collection, details_collection, documents, cluster_key)
                     tracking_counter += current_batch_size
                     pbar.update(current_batch_size)
         
@@ -276,7 +317,7 @@ def process_collection(collection_name: str, config: Dict):
                         config['start_date'],
                         config['end_date']
                     )
-                    collection.insert_many(documents)
+                    insert_documents(collection, details_collection, documents, cluster_key)
                     tracking_counter += current_batch_size
                     pbar.update(current_batch_size)
     
@@ -284,19 +325,39 @@ def process_collection(collection_name: str, config: Dict):
         logging.error(f"Error processing collection {collection_name}: {str(e)}")
         raise
 
-def main():
+def main(layout: str = "nested", cluster_key: str = DEFAULT_CLUSTER_KEY):
     try:
+        split = layout == "split"
+        if layout != "clustered":
+            cluster_key = None
+        db_name = SPLIT_DATABASE if split else CLUSTERED_ITEM_DATABASES[cluster_key] if cluster_key \
+            else 'nzpost_summary_item'
+        target_db = client[db_name]
+        
         # Drop database if exists
-        client.drop_database('nzpost_summary_item')
+        client.drop_database(db_name)
+        
+        random.seed(RANDOM_SEED)
         
         # Process collections sequentially
         for collection_name, config in COLLECTIONS.items():
-            process_collection(collection_name, config)
+            process_collection(collection_name, config, target_db, split, cluster_key)
+            # The rollup and manifest read tracking_reference as a top-level field
+            if not cluster_key:
+                build_collection_rollup(target_db, collection_name)
+                build_manifest(target_db, collection_name, seed=RANDOM_SEED, config=config)
             
     except Exception as e:
         logging.error(f"Error in main: {str(e)}")
         raise
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Generate the nzpost_summary_item test data")
+    parser.add_argument("--layout", choices=["nested", "split", "clustered"], default="nested",
+                        help="split keeps slim events and writes parcel_details to <collection>_details in " +
+                             SPLIT_DATABASE + "; clustered writes collections clustered on the cluster key")
+    parser.add_argument("--cluster-key", choices=CLUSTER_KEYS, default=DEFAULT_CLUSTER_KEY,
+                        help="_id of the clustered layout: reference or {tpid, tracking_reference}")
+    args = parser.parse_args()
+    main(args.layout, args.cluster_key)
 
@@ -1,17 +1,37 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, simpledialog, filedialog
 from tkcalendar import DateEntry
 import pymongo
 from pymongo import MongoClient
 from datetime import datetime, timedelta
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+import queue
+import threading
 import time
 from typing import List, Dict, Optional
 from PIL import Image, ImageTk
 import json
 from bson import ObjectId
 import numpy as np
+from build_daily_rollup import (ROLLUP_DATABASES, ROLLUP_COLLECTION, ROLLUP_INDEX_NAME, is_rollup_fresh,
+                                rollup_match, rollup_count_pipeline, rollup_events_pipeline)
+from refresh_append_rollup import STATUS_COUNTS_COLLECTION, STATUS_COUNTS_INDEX_NAME, latest_rollup_match
+from mongo_query_engine import (count_distinct_parcels, choose_distinct_strategy, distinct_parcels_pipeline,
+                                LATEST_STRATEGIES, get_latest_strategy, latest_strategy_target, latest_strategy_hint,
+                                latest_status_count_pipeline, latest_status_summary_pipeline,
+                                benchmark_latest_strategies, HintSelector, usable_partial_indexes, fast_count,
+                                scatter_gather_count, ITEM_DATABASE, ITEM_FACETS, facet_match, has_facet_filters,
+                                facet_index_hint, benchmark_facets, parcel_pages, listing_fields,
+                                parcel_timelines, search_references, reference_search_match, TPID_GROUPS,
+                                parse_tpid_ranges, merge_tpid_ranges, tpid_ranges, format_tpid_ranges,
+                                tpid_filter, tpids_in_ranges, match_tpid_ranges, compute_status_matrix,
+                                matrix_status_count)
+from dataset_manifest import load_manifests, is_manifest_current, manifest_total, manifest_tpid_parcels
+from create_mongo_indexes import DATABASE_INDEXES, OPTIONAL_DATABASE_INDEXES
+from offline_snapshot import OfflineSnapshot
+from item_split import SPLIT_DATABASE, is_split_database, find_parcel, attach_details
+from parcel_export import export_parcels
 
 # MongoDB connection
 client = MongoClient('mongodb://localhost:27017/')
@@ -26,7 +46,7 @@ EDIFACT_CODES = {
     "Attempted Delivery": 600
 }
 
-# Collection configurations
+# Collection configurations (labels used when a collection has no dataset manifest)
 COLLECTIONS = {
     "1 week (3M) - 1st - 7th March": "summary_1_week",
     "2 weeks (6M) - 1st - 14th March": "summary_2_weeks",
@@ -34,10 +54,19 @@ COLLECTIONS = {
     "3 months (38.6M) - Jan-Mar": "summary_3_months"
 }
 
+# Default date range of each collection (used when there is no dataset manifest)
+COLLECTION_DATE_RANGES = {
+    "summary_1_week": (datetime(2025, 3, 1), datetime(2025, 3, 7)),
+    "summary_2_weeks": (datetime(2025, 3, 1), datetime(2025, 3, 14)),
+    "summary_1_month": (datetime(2025, 3, 1), datetime(2025, 3, 31)),
+    "summary_3_months": (datetime(2025, 1, 1), datetime(2025, 3, 31))
+}
+
 # Database display names
 DATABASE_NAMES = {
     "nzpost_summary": "1 week (3M)",
     "nzpost_summary_item": "1 week with item details (3M)",
+    SPLIT_DATABASE: "1 week with item details split off (3M)",
     "nzpost_summary_append": "1 week with time series (3M)"
 }
 
@@ -55,6 +84,16 @@ TPID_VOLUMES = {
     1000020: 2000
 }
 
+# Number of TPID checkboxes; the largest TPIDs in the manifests, else the TPID_VOLUMES ones
+TPID_CHECKBOXES = 10
+
+# Drill-down facet choices (nzpost_summary_item)
+FACET_CHOICES = {
+    "service_code": ["Any", "CPOLP", "CPOLR", "CPOLS"],
+    "receiver_city": ["Any", "Auckland", "Wellington", "Christchurch", "Hamilton", "Tauranga"]
+}
+FACET_FLAGS = ["is_rural", "is_signature_required", "is_dangerous_goods"]
+
 # Sample JSON for document structure
 SAMPLE_JSON_SUMMARY = {
     "_id": ObjectId("67ef08ea7e382fec192d35d3"),
@@ -109,7 +148,7 @@ SAMPLE_JSON_ITEM = {
             "service_code": "CPOLR",
             "description": "Rural Parcel",
             "service_standard": "2-DAY",
-            "sla_days": "2",
+            "sla_days": 2,
             "is_signature_required": False,
             "is_photo_required": False,
             "is_age_restricted": False,
@@ -119,7 +158,7 @@ SAMPLE_JSON_ITEM = {
             "is_no_atl": False,
             "is_dangerous_goods": False,
             "is_xl": False,
-            "initial_edd": datetime(2025, 4, 6, 14, 53, 24, 575880)
+            "initial_edd": datetime(2025, 1, 22, 9, 59, 8)
         },
         "value": {
             "amount": 444.81,
@@ -144,32 +183,10 @@ SAMPLE_JSON_APPEND = {
     "event_description": "Picked Up"
 }
 
-# Add index configurations after the SAMPLE_JSON constants
+# Index configurations (fallback when a database has no dataset manifest)
 INDEX_INFO = {
-    "nzpost_summary": [
-        {"name": "tpid_1_edifact_code_1_event_datetime_1", "fields": [("tpid", 1), ("edifact_code", 1), ("event_datetime", 1)]},
-        {"name": "tpid_1_edifact_code_1", "fields": [("tpid", 1), ("edifact_code", 1)]},
-        {"name": "tpid_1_tracking_reference_1", "fields": [("tpid", 1), ("tracking_reference", 1)]},
-        {"name": "tpid_1", "fields": [("tpid", 1)]},
-        {"name": "event_datetime_1", "fields": [("event_datetime", 1)]},
-        {"name": "tracking_reference_1", "fields": [("tracking_reference", 1)]}
-    ],
-    "nzpost_summary_item": [
-        {"name": "tpid_1_edifact_code_1_event_datetime_1", "fields": [("tpid", 1), ("edifact_code", 1), ("event_datetime", 1)]},
-        {"name": "tpid_1_edifact_code_1", "fields": [("tpid", 1), ("edifact_code", 1)]},
-        {"name": "tpid_1_tracking_reference_1", "fields": [("tpid", 1), ("tracking_reference", 1)]},
-        {"name": "tpid_1", "fields": [("tpid", 1)]},
-        {"name": "event_datetime_1", "fields": [("event_datetime", 1)]},
-        {"name": "tracking_reference_1", "fields": [("tracking_reference", 1)]}
-    ],
-    "nzpost_summary_append": [
-        {"name": "tpid_1_edifact_code_1_event_datetime_1", "fields": [("tpid", 1), ("edifact_code", 1), ("event_datetime", 1)]},
-        {"name": "tpid_1_edifact_code_1", "fields": [("tpid", 1), ("edifact_code", 1)]},
-        {"name": "tpid_1_tracking_reference_1", "fields": [("tpid", 1), ("tracking_reference", 1)]},
-        {"name": "tpid_1", "fields": [("tpid", 1)]},
-        {"name": "event_datetime_1", "fields": [("event_datetime", 1)]},
-        {"name": "tracking_reference_1", "fields": [("tracking_reference", 1)]}
-    ]
+    db_name: [{"name": index_spec[0], "fields": index_spec[1]} for index_spec in index_specs]
+    for db_name, index_specs in {**DATABASE_INDEXES, **OPTIONAL_DATABASE_INDEXES}.items()
 }
 
 class MongoQueryApp:
@@ -182,6 +199,8 @@ class MongoQueryApp:
         self.client = MongoClient('mongodb://localhost:27017/')
         self.current_db = "nzpost_summary"
         self.db = self.client[self.current_db]
+        self.refresh_manifests()
+        self.collections = self.collection_choices()
         
         # Header with Team Vulcan logo
         self.header_frame = ttk.Frame(root)
@@ -223,7 +242,8 @@ class MongoQueryApp:
         ttk.Label(self.db_frame, text="Database:").pack(side=tk.LEFT)
         self.db_var = tk.StringVar(value="nzpost_summary")
         self.db_dropdown = ttk.Combobox(self.db_frame, textvariable=self.db_var, 
-                                      values=["nzpost_summary", "nzpost_summary_item", "nzpost_summary_append"],
+                                      values=["nzpost_summary", "nzpost_summary_item", "nzpost_summary_append",
+                                              SPLIT_DATABASE],
                                       state="readonly", width=20)
         self.db_dropdown.pack(side=tk.LEFT, padx=5)
         self.db_dropdown.bind("<<ComboboxSelected>>", self.on_database_change)
@@ -241,6 +261,57 @@ class MongoQueryApp:
                                     command=self.show_indexes)
         self.indexes_btn.pack(side=tk.LEFT, padx=10)
         
+        # Look up one parcel; item details are joined only here
+        self.parcel_btn = ttk.Button(self.connection_frame, text="Parcel Details",
+                                     command=self.show_parcel_details)
+        self.parcel_btn.pack(side=tk.LEFT, padx=10)
+        
+        # Answer counts from the pre-aggregated daily rollup when it is fresh
+        self.use_rollup = tk.BooleanVar(value=False)
+        self.rollup_checkbox = ttk.Checkbutton(self.connection_frame, text="Use Daily Rollup",
+                                               variable=self.use_rollup)
+        self.rollup_checkbox.pack(side=tk.LEFT, padx=10)
+        
+        # Race candidate indexes per query shape instead of using the static hint rules
+        self.hint_selector = HintSelector()
+        self.use_cost_hints = tk.BooleanVar(value=False)
+        self.cost_hints_checkbox = ttk.Checkbutton(self.connection_frame, text="Cost-based Hints",
+                                                   variable=self.use_cost_hints)
+        self.cost_hints_checkbox.pack(side=tk.LEFT, padx=10)
+        
+        # Answer unfiltered totals from collection metadata and status counts with the count command
+        self.use_metadata_counts = tk.BooleanVar(value=False)
+        self.metadata_counts_checkbox = ttk.Checkbutton(self.connection_frame, text="Metadata Counts",
+                                                        variable=self.use_metadata_counts)
+        self.metadata_counts_checkbox.pack(side=tk.LEFT, padx=10)
+        
+        # Split status counts into concurrent sub-queries and add up the partial counts
+        self.use_scatter = tk.BooleanVar(value=False)
+        self.scatter_checkbox = ttk.Checkbutton(self.connection_frame, text="Parallel Scatter",
+                                                variable=self.use_scatter)
+        self.scatter_checkbox.pack(side=tk.LEFT, padx=10)
+        
+        # Answer status counts from the exported memory-mapped snapshot instead of MongoDB
+        self.snapshots = {}
+        self.use_offline = tk.BooleanVar(value=False)
+        self.offline_checkbox = ttk.Checkbutton(self.connection_frame, text="Offline Snapshot",
+                                                variable=self.use_offline)
+        self.offline_checkbox.pack(side=tk.LEFT, padx=10)
+        
+        # Compute the status-by-TPID matrix in the background whenever the selection changes;
+        # status clicks are then answered from it without a query
+        self.status_matrix = None
+        self.status_matrix_key = None
+        self.status_matrix_after_id = None
+        self.status_matrix_thread = None
+        self.status_matrix_requested = None
+        self.status_matrix_finished_at = 0.0
+        self.status_matrix_queue = queue.Queue()
+        self.use_status_matrix = tk.BooleanVar(value=True)
+        self.status_matrix_checkbox = ttk.Checkbutton(self.connection_frame, text="Prefetch Status Matrix",
+                                                      variable=self.use_status_matrix)
+        self.status_matrix_checkbox.pack(side=tk.LEFT, padx=10)
+        
         # Create a container frame for Data Range and Date Range
         self.range_container = ttk.Frame(root)
         self.range_container.pack(fill=tk.X, padx=10, pady=5)
@@ -249,10 +320,9 @@ class MongoQueryApp:
         self.range_frame = ttk.LabelFrame(self.range_container, text="Data Range", padding=10)
         self.range_frame.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 5))
         
-        self.collection_var = tk.StringVar(value="1 week (3M) - 1st - 7th March")
-        for text, _ in COLLECTIONS.items():
-            ttk.Radiobutton(self.range_frame, text=text, variable=self.collection_var, value=text,
-                           command=self.update_date_range).pack(anchor=tk.W)
+        self.collection_var = tk.StringVar(value=next(iter(self.collections)))
+        self.collection_buttons = []
+        self.build_collection_selector()
         
         # Date Range Selection with calendar widgets
         self.date_frame = ttk.LabelFrame(self.range_container, text="Date Range", padding=10)
@@ -289,19 +359,53 @@ class MongoQueryApp:
         
         self.tpid_vars = {}
         self.tpid_checkbuttons = {}  # Store references to checkbuttons
-        for i in range(10):
-            tpid = 1000011 + i
-            var = tk.BooleanVar(value=(tpid == 1000011))  # Set 1000011 to be checked by default
-            self.tpid_vars[tpid] = var
-            
-            # Create checkbutton
-            cb = ttk.Checkbutton(self.tpid_frame, text=f"TPID {tpid}", variable=var)
-            cb.pack(side=tk.LEFT, padx=5)
-            self.tpid_checkbuttons[tpid] = cb
-            
-            # Bind hover events
-            cb.bind("<Enter>", lambda e, t=tpid: self.show_tpid_volume(e, t))
-            cb.bind("<Leave>", self.hide_tooltip)
+        self.build_tpid_selector()
+        
+        # Named TPID groups and contiguous ranges (e.g. 2000011-2000110, 2000500+), added to the ticked TPIDs
+        self.tpid_range_frame = ttk.LabelFrame(root, text="TPID Groups and Ranges", padding=10)
+        self.tpid_range_frame.pack(fill=tk.X, padx=10, pady=5)
+        
+        ttk.Label(self.tpid_range_frame, text="Group:").pack(side=tk.LEFT)
+        self.tpid_group_var = tk.StringVar(value="None")
+        ttk.Combobox(self.tpid_range_frame, textvariable=self.tpid_group_var, values=["None"] + list(TPID_GROUPS),
+                     state="readonly", width=22).pack(side=tk.LEFT, padx=5)
+        ttk.Label(self.tpid_range_frame, text="Ranges:").pack(side=tk.LEFT)
+        self.tpid_range_var = tk.StringVar(value="")
+        ttk.Entry(self.tpid_range_frame, textvariable=self.tpid_range_var, width=40).pack(side=tk.LEFT, padx=5)
+        ttk.Label(self.tpid_range_frame, text="e.g. 1000011-1000015, 2000011+").pack(side=tk.LEFT, padx=5)
+        
+        # Drill-down facets over parcel_details (item database only)
+        self.facet_frame = ttk.LabelFrame(root, text="Item Facets", padding=10)
+        self.facet_frame.pack(fill=tk.X, padx=10, pady=5)
+        
+        self.facet_vars = {}
+        self.facet_widgets = []
+        for facet, values in FACET_CHOICES.items():
+            ttk.Label(self.facet_frame, text=f"{facet.replace('_', ' ').title()}:").pack(side=tk.LEFT)
+            self.facet_vars[facet] = tk.StringVar(value="Any")
+            widget = ttk.Combobox(self.facet_frame, textvariable=self.facet_vars[facet], values=values,
+                                  state="readonly", width=12)
+            widget.pack(side=tk.LEFT, padx=5)
+            self.facet_widgets.append(widget)
+        
+        ttk.Label(self.facet_frame, text="Postcode:").pack(side=tk.LEFT)
+        self.facet_vars["receiver_postcode"] = tk.StringVar(value="")
+        widget = ttk.Entry(self.facet_frame, textvariable=self.facet_vars["receiver_postcode"], width=6)
+        widget.pack(side=tk.LEFT, padx=5)
+        self.facet_widgets.append(widget)
+        
+        for flag in FACET_FLAGS:
+            ttk.Label(self.facet_frame, text=f"{flag[3:].replace('_', ' ').title()}:").pack(side=tk.LEFT)
+            self.facet_vars[flag] = tk.StringVar(value="Any")
+            widget = ttk.Combobox(self.facet_frame, textvariable=self.facet_vars[flag], values=["Any", "Yes", "No"],
+                                  state="readonly", width=5)
+            widget.pack(side=tk.LEFT, padx=5)
+            self.facet_widgets.append(widget)
+        
+        self.facet_counts_btn = ttk.Button(self.facet_frame, text="Facet Counts",
+                                           command=self.run_facet_counts_query)
+        self.facet_counts_btn.pack(side=tk.LEFT, padx=10)
+        self.facet_widgets.append(self.facet_counts_btn)
         
         # Status Buttons
         self.status_frame = ttk.Frame(root, padding=10)
@@ -390,6 +494,16 @@ class MongoQueryApp:
                                           command=self.show_performance_pipeline)
         self.perf_pipeline_btn.pack(side=tk.LEFT, padx=5)
         
+        # Benchmark the latest-event-per-parcel strategies for the time series collections
+        self.latest_strategy_btn = ttk.Button(self.button_frame, text="Latest Strategies",
+                                              command=self.run_latest_strategy_benchmark)
+        self.latest_strategy_btn.pack(side=tk.LEFT, padx=5)
+        
+        # List the parcels behind the current count, one keyset page at a time
+        self.parcel_list_btn = ttk.Button(self.button_frame, text="Parcel List",
+                                          command=self.show_parcel_list)
+        self.parcel_list_btn.pack(side=tk.LEFT, padx=5)
+        
         self.performance_btn.bind("<Enter>", self.show_performance_details)
         self.performance_btn.bind("<Leave>", self.hide_query_details)
         
@@ -399,7 +513,7 @@ class MongoQueryApp:
         
         # Create labels for each database's performance time
         self.perf_time_labels = {}
-        for collection_display, collection_name in COLLECTIONS.items():
+        for collection_display, collection_name in self.collections.items():
             label = ttk.Label(self.perf_times_frame, 
                             text=f"{collection_display}: Not tested",
                             justify=tk.LEFT)
@@ -412,10 +526,21 @@ class MongoQueryApp:
         
         # Initialize date pickers state
         self.toggle_date_pickers()
+        self.update_facet_state()
         
         # Set initial date range based on default collection
         self.update_date_range()
         
+        # Recompute the status matrix when the collection, TPID, date or facet selection changes
+        # (build_tpid_selector traces the TPID checkboxes it creates)
+        for var in [self.collection_var, self.use_date_range, self.tpid_group_var, self.tpid_range_var,
+                    self.use_status_matrix, *self.facet_vars.values()]:
+            var.trace_add("write", self.schedule_status_matrix)
+        for date_entry in (self.from_date, self.to_date):
+            date_entry.bind("<<DateEntrySelected>>", self.schedule_status_matrix)
+        self.schedule_status_matrix()
+        self.poll_status_matrix()
+        
         # Track selected statuses
         self.selected_statuses = set()
         
@@ -504,9 +629,9 @@ class MongoQueryApp:
         details = []
         details.append(f"Collection: {self.collection_var.get()}")
         
-        selected_tpids = [tpid for tpid, var in self.tpid_vars.items() if var.get()]
-        if selected_tpids:
-            details.append(f"\nSelected TPIDs: {', '.join(map(str, selected_tpids))}")
+        selected_ranges = self.selected_tpid_ranges()
+        if selected_ranges:
+            details.append(f"\nSelected TPIDs: {format_tpid_ranges(selected_ranges)}")
         else:
             details.append("\nNo TPIDs selected")
         
@@ -526,8 +651,8 @@ class MongoQueryApp:
             {"$count": "total"}
         ]
         
-        # Get the appropriate index hint
-        hint = self.get_optimal_hint(match_stage)
+        # Get the appropriate index hint (tooltips never start an index race)
+        hint = self.get_optimal_hint(match_stage, calibrate=False)
         
         details.append(f"\nPipeline:")
         details.append(json.dumps(pipeline, indent=2, default=str))
@@ -535,14 +660,42 @@ class MongoQueryApp:
         
         return "\n".join(details)
     
-    def build_query(self, status=None) -> Dict:
+    def has_tpid_ranges(self) -> bool:
+        """True when a TPID group or range is set (not just ticked TPIDs)"""
+        return self.tpid_group_var.get() != "None" or bool(self.tpid_range_var.get().strip())
+    
+    def selected_tpid_ranges(self) -> List:
+        """Merged (first, last) ranges of the ticked TPIDs, the TPID group and the typed ranges"""
+        ranges = tpid_ranges([tpid for tpid, var in self.tpid_vars.items() if var.get()])
+        ranges += TPID_GROUPS.get(self.tpid_group_var.get(), [])
+        # An invalid typed range raises ValueError rather than silently widening the selection
+        ranges += parse_tpid_ranges(self.tpid_range_var.get())
+        return merge_tpid_ranges(ranges)
+    
+    def check_tpid_ranges(self) -> bool:
+        """Show an error and return False when the typed TPID ranges do not parse"""
+        try:
+            parse_tpid_ranges(self.tpid_range_var.get())
+        except ValueError as e:
+            messagebox.showerror("Invalid TPID Range", str(e))
+            return False
+        return True
+    
+    def tpid_match(self) -> Dict:
+        """TPID filter for a match stage: equality, range predicates or an $or of ranges"""
+        return tpid_filter(self.selected_tpid_ranges())
+    
+    def selected_tpids(self, available: List[int]) -> List[int]:
+        """Selected TPIDs resolved against the TPIDs a manifest or snapshot knows"""
+        return tpids_in_ranges(available, self.selected_tpid_ranges())
+    
+    def build_query(self, status=None, rollup=False) -> Optional[Dict]:
+        """Build the match stage for the raw collection, or for the daily rollup when rollup=True"""
         query = {}
         current_db = self.db_var.get()
         
         # Add TPID filter
-        selected_tpids = [tpid for tpid, var in self.tpid_vars.items() if var.get()]
-        if selected_tpids:
-            query["tpid"] = {"$in": selected_tpids}
+        query.update(self.tpid_match())
         
         # Add Edifact Code filter
         if status:
@@ -564,12 +717,60 @@ class MongoQueryApp:
             else:
                 query["event_datetime"] = {"$gte": from_date, "$lte": to_date}
         
+        # Add item facet filters
+        query = facet_match(query, self.facet_filters())
+        
         # Debug output
         if current_db == "nzpost_summary_append":
             print(f"Final query for time series: {json.dumps(query, default=str)}")
         
+        if rollup:
+            # Rollup path - None when the filters cannot be answered from daily counts
+            return rollup_match(self.collections[self.collection_var.get()], query)
+        
         return query
     
+    def get_rollup_query(self, match_stage) -> Optional[Dict]:
+        """Return the rollup match for a raw match stage, or None to fall back to the raw collection"""
+        if not self.use_rollup.get():
+            return None
+        
+        collection_name = self.collections[self.collection_var.get()]
+        if self.current_db == "nzpost_summary_append":
+            # Incrementally maintained latest-status counters (refresh_append_rollup.py)
+            rollup_query = latest_rollup_match(self.db, collection_name, match_stage)
+            if rollup_query is None:
+                print("Latest-status counters are behind or the date range ends before the watermark "
+                      "- falling back to raw collection")
+            return rollup_query
+        
+        if self.current_db not in ROLLUP_DATABASES and not is_split_database(self.current_db):
+            return None
+        
+        if not is_rollup_fresh(self.db, collection_name):
+            print(f"Daily rollup for {collection_name} is missing or stale - falling back to raw collection")
+            return None
+        
+        rollup_query = rollup_match(collection_name, match_stage)
+        if rollup_query is None:
+            print("Filters cannot be answered from the daily rollup - falling back to raw collection")
+        return rollup_query
+    
+    def get_rollup_collection_name(self) -> str:
+        """Name of the pre-aggregated collection for the current database"""
+        if self.current_db == "nzpost_summary_append":
+            return STATUS_COUNTS_COLLECTION
+        return ROLLUP_COLLECTION
+    
+    def run_rollup_query(self, pipeline):
+        """Run a pipeline against the pre-aggregated collection and time it"""
+        print(f"Rollup Pipeline: {json.dumps(pipeline, indent=2, default=str)}")
+        start_time = time.time()
+        result = list(self.db[self.get_rollup_collection_name()].aggregate(pipeline))
+        response_time = (time.time() - start_time) * 1000
+        print(f"Rollup query execution time: {response_time:.2f}ms")
+        return result, response_time
+    
     def run_optimized_time_series_query(self, collection, pipeline, hint, timeout_ms):
         """Run an optimized query for time series collections with better performance"""
         print("\n=== Running Optimized Time Series Query ===")
@@ -603,6 +804,8 @@ class MongoQueryApp:
 
     def run_status_query(self, status):
         """Run a query for the selected status and update the display"""
+        if not self.check_tpid_ranges():
+            return
         try:
             # Clear any existing event summary display from "All events"
             for widget in self.results_right.winfo_children():
@@ -619,14 +822,20 @@ class MongoQueryApp:
                                        justify=tk.LEFT, wraplength=600)
             self.query_label.pack(anchor=tk.W)
             
+            if self.use_offline.get() and not self.facet_filters() and self.run_offline_status_query(status):
+                return
+            
+            if self.use_status_matrix.get() and self.run_matrix_status_query(status):
+                return
+            
             # Get the actual collection name from the display name
-            collection_name = COLLECTIONS[self.collection_var.get()]
+            collection_name = self.collections[self.collection_var.get()]
             collection = self.db[collection_name]  # Use the actual collection name
             match_stage = self.build_query(status)
             
             # Get selected TPIDs for query
-            selected_tpids = [tpid for tpid, var in self.tpid_vars.items() if var.get()]
-            tpid_query = {"tpid": {"$in": selected_tpids}} if selected_tpids else {}
+            tpid_query = self.tpid_match()
+            selected_tpids = format_tpid_ranges(self.selected_tpid_ranges())
             
             # Print query details to console
             print("\n=== Query Details ===")
@@ -639,6 +848,7 @@ class MongoQueryApp:
             
             # Detailed performance tracking
             perf_stages = {}
+            timing_start = time.time()
             
             # Pipeline for total parcels count
             pipeline_total = [
@@ -654,8 +864,25 @@ class MongoQueryApp:
             
             perf_stages["total_parcels_start"] = time.time()
             
+            rollup_total_query = self.get_rollup_query(tpid_query)
+            count_mode = "metadata" if self.use_metadata_counts.get() else "exact"
+            fast_total = None
+            manifest = self.current_manifest(check_current=True) if count_mode == "metadata" else None
+            if rollup_total_query is None and manifest:
+                manifest_tpids = self.selected_tpids([entry["tpid"] for entry in manifest["tpids"]]) \
+                    if tpid_query else None
+                fast_total = {"count": manifest_total(manifest, manifest_tpids), "method": "manifest",
+                              "time_ms": (time.time() - perf_stages["total_parcels_start"]) * 1000}
+            elif rollup_total_query is None:
+                fast_total = fast_count(collection, tpid_query, count_mode, hint_for_total)
+            
             # Use optimized query for time series collections
-            if self.current_db == "nzpost_summary_append":
+            if rollup_total_query is not None:
+                total_result, total_time = self.run_rollup_query(rollup_count_pipeline(rollup_total_query))
+            elif fast_total is not None:
+                print(f"Total answered by {fast_total['method']} in {fast_total['time_ms']:.2f}ms")
+                total_result = [{"total": fast_total["count"]}]
+            elif self.current_db == "nzpost_summary_append":
                 # For time series, we need to count unique tracking references
                 pipeline_total = [
                     {"$match": tpid_query},
@@ -681,35 +908,22 @@ class MongoQueryApp:
             total_parcels = total_result[0]["total"] if total_result else 0
             self.parcels_label.config(text=f"Parcels: {total_parcels:,}")
             
+            rollup_query = self.get_rollup_query(match_stage)
+            
             # Build main query pipeline based on database type
-            if self.current_db == "nzpost_summary_append":
-                # For time series, use $setWindowFields to efficiently find latest event per tracking reference
-                
-                # Extract date range from match_stage if present
-                date_filter = {}
-                if "timestamp" in match_stage:
-                    date_filter = {"timestamp": match_stage["timestamp"]}
-                
-                # First filter for TPIDs if selected
-                tpid_filter = {}
-                if "tpid" in match_stage:
-                    tpid_filter = {"tpid": match_stage["tpid"]}
-                
-                # Build pipeline using $setWindowFields for latest events
-                pipeline = [
-                    # Match by TPIDs and date range first if specified
-                    {"$match": {**tpid_filter, **date_filter}},
-                    # Group by tracking reference and get the latest event
-                    {"$sort": {"timestamp": -1}},
-                    {"$group": {
-                        "_id": "$tracking_reference",
-                        "latest_event": {"$first": "$$ROOT"}
-                    }},
-                    # Match the latest event's edifact code
-                    {"$match": {"latest_event.edifact_code": EDIFACT_CODES[status]}},
-                    # Count total unique tracking references
-                    {"$count": "total"}
-                ]
+            if rollup_query is not None:
+                # Sum the pre-aggregated daily counts instead of scanning the collection
+                pipeline = rollup_count_pipeline(rollup_query)
+            elif self.current_db == "nzpost_summary_append":
+                # For time series, find the latest event per tracking reference with the
+                # fastest benchmarked strategy for this collection. The status is applied to
+                # the latest event, so only TPIDs and date range filter the events.
+                latest_match = {k: v for k, v in match_stage.items() if k != "edifact_code"}
+                latest_strategy = get_latest_strategy(collection)
+                print(f"Latest event strategy: {latest_strategy}")
+                pipeline = latest_status_count_pipeline(
+                    latest_strategy, latest_match, [EDIFACT_CODES[status]], collection_name
+                )
             else:
                 # Standard query with simple match and count
                 pipeline = [
@@ -718,7 +932,12 @@ class MongoQueryApp:
                 ]
             
             # Determine optimal index based on query conditions
-            hint = self.get_optimal_hint(match_stage)
+            if rollup_query is not None:
+                hint = STATUS_COUNTS_INDEX_NAME if self.current_db == "nzpost_summary_append" else ROLLUP_INDEX_NAME
+            elif self.current_db == "nzpost_summary_append":
+                hint = latest_strategy_hint(latest_strategy, self.get_optimal_hint(latest_match))
+            else:
+                hint = self.get_optimal_hint(match_stage)
             
             # Print main query details
             print("\n=== Main Query ===")
@@ -730,10 +949,41 @@ class MongoQueryApp:
             perf_stages["main_query_start"] = time.time()
             print(f"Query starting at: {datetime.now().strftime('%H:%M:%S.%f')}")
             
+            fast_main = None
+            # Scatter-gather was asked for explicitly, so it takes precedence over the count command;
+            # without Metadata Counts the status count is always the measured $count pipeline
+            if (rollup_query is None and self.current_db != "nzpost_summary_append" and not self.use_scatter.get()
+                    and count_mode == "metadata"):
+                fast_main = fast_count(collection, match_stage, count_mode, hint)
+            
             # Run optimized query for time series collections
-            if self.current_db == "nzpost_summary_append":
+            if rollup_query is not None:
+                result, response_time = self.run_rollup_query(pipeline)
+                count = result[0]["total"] if result else 0
+            elif fast_main is not None:
+                # Index-only count command (COUNT_SCAN) instead of the $count pipeline
+                print(f"Count answered by {fast_main['method']}")
+                count, response_time = fast_main["count"], fast_main["time_ms"]
+            elif self.use_scatter.get():
+                if self.current_db == "nzpost_summary_append":
+                    scatter = scatter_gather_count(
+                        collection, latest_match,
+                        lambda m: latest_status_count_pipeline(latest_strategy, m, [EDIFACT_CODES[status]],
+                                                               collection_name),
+                        split=self.scatter_split(latest_match),
+                        target=latest_strategy_target(collection, latest_strategy)
+                    )
+                else:
+                    scatter = scatter_gather_count(
+                        collection, match_stage, lambda m: [{"$match": m}, {"$count": "total"}],
+                        split=self.scatter_split(match_stage)
+                    )
+                print(f"Scatter-gather: {scatter['parts']} sub-queries split by {scatter['split']}, "
+                      f"slowest {max(scatter['part_ms'], default=0):.2f}ms")
+                count, response_time = scatter["count"], scatter["time_ms"]
+            elif self.current_db == "nzpost_summary_append":
                 result, response_time = self.run_optimized_time_series_query(
-                    collection, pipeline, hint, 1200000
+                    latest_strategy_target(collection, latest_strategy), pipeline, hint, 1200000
                 )
                 count = result[0]["total"] if result else 0
             else:
@@ -766,7 +1016,7 @@ class MongoQueryApp:
             print("=" * 50 + "\n")
             
             self.count_label.config(text=f"Count: {count:,}")
-            self.time_label.config(text=f"Response Time: {response_time:.2f}ms")
+            self.time_label.config(text=f"Response Time: {response_time:.2f}ms{self.status_matrix_note(timing_start)}")
             
             # Calculate and display percentage
             if total_parcels > 0:
@@ -799,21 +1049,17 @@ class MongoQueryApp:
         results = {}
         current_db = self.db_var.get()
         db = self.client[current_db]
+        timing_start = time.time()
         
         print(f"\n=== Running Performance Test for {current_db} ===")
         print(f"Testing all collections with TPIDs: {test_tpids}")
         print(f"Testing status codes: {test_codes}")
         
         # Date ranges for collections
-        collection_date_ranges = {
-            "summary_1_week": (datetime(2025, 3, 1), datetime(2025, 3, 7)),
-            "summary_2_weeks": (datetime(2025, 3, 1), datetime(2025, 3, 14)),
-            "summary_1_month": (datetime(2025, 3, 1), datetime(2025, 3, 31)),
-            "summary_3_months": (datetime(2025, 1, 1), datetime(2025, 3, 31))
-        }
+        collection_date_ranges = self.collection_date_ranges()
         
         # Test each collection in the current database
-        for display_name, collection_name in COLLECTIONS.items():
+        for display_name, collection_name in self.collections.items():
             print(f"\n--- Testing Collection: {collection_name} ({display_name}) ---")
             collection = db[collection_name]
             
@@ -853,6 +1099,18 @@ class MongoQueryApp:
                     hint = "tpid_1_edifact_code_1_event_datetime_1"
                 else:
                     hint = "tpid_1_edifact_code_1"
+            total_hint = "tpid_1"
+            
+            # Cost-based hints race the candidate indexes for each query shape and selectivity
+            if self.use_cost_hints.get():
+                if current_db == "nzpost_summary_append":
+                    # The latest-event pipelines only filter events by TPID and timestamp
+                    event_match = {k: v for k, v in match_stage.items() if k != "edifact_code"}
+                    hint = self.hint_selector.choose(collection, event_match)
+                    total_hint = hint
+                else:
+                    hint = self.hint_selector.choose(collection, match_stage)
+                    total_hint = self.hint_selector.choose(collection, {"tpid": {"$in": test_tpids}})
             
             try:
                 print(f"\nRunning query with hint: {hint}")
@@ -869,56 +1127,39 @@ class MongoQueryApp:
                     else:
                         timeout_ms = 1200000   # 20 minutes for 1 week collection
                     
-                    # First get total count
-                    total_pipeline = [
-                        {"$match": {"tpid": {"$in": test_tpids}, "timestamp": {"$gte": from_date, "$lte": to_date}}},
-                        {"$group": {
-                            "_id": None,
-                            "total": {"$addToSet": "$tracking_reference"}
-                        }},
-                        {"$project": {
-                            "total": {"$size": "$total"}
-                        }}
-                    ]
+                    # First get total count of distinct parcels
+                    total_match = {"tpid": {"$in": test_tpids}, "timestamp": {"$gte": from_date, "$lte": to_date}}
+                    distinct_strategy = choose_distinct_strategy(collection, total_match, self.use_rollup.get())
+                    distinct = count_distinct_parcels(collection, total_match, strategy=distinct_strategy,
+                                                      hint=total_hint, timeout_ms=timeout_ms)
+                    total_count = distinct["count"]
+                    total_time = distinct["time_ms"]
                     
                     print("\nTotal Count Pipeline:")
-                    print(json.dumps(total_pipeline, indent=2, default=str))
-                    print("Using index: tpid_1")
-                    
-                    total_result, total_time = self.run_optimized_time_series_query(
-                        collection, total_pipeline, "tpid_1", timeout_ms
-                    )
-                    total_count = total_result[0]["total"] if total_result else 0
+                    print(json.dumps(distinct["pipeline"], indent=2, default=str))
+                    print(f"Distinct count strategy: {distinct['strategy']}")
+                    print(f"Using index: {distinct['hint']}")
                     
-                    # Then get query count using $setWindowFields
-                    query_pipeline = [
-                        {"$match": {"tpid": {"$in": test_tpids}, "timestamp": {"$gte": from_date, "$lte": to_date}}},
-                        {"$setWindowFields": {
-                            "partitionBy": "$tracking_reference",
-                            "sortBy": {"timestamp": -1},
-                            "output": {
-                                "is_latest": {
-                                    "$first": "$$ROOT",
-                                    "window": {"documents": [0, 0]}
-                                }
-                            }
-                        }},
-                        {"$match": {"is_latest.edifact_code": {"$in": test_codes}}},
-                        {"$count": "total"}
-                    ]
+                    # Then count parcels whose latest event matches, using the fastest
+                    # benchmarked latest-event strategy for this collection
+                    latest_strategy = get_latest_strategy(collection)
+                    query_pipeline = latest_status_count_pipeline(latest_strategy, total_match, test_codes, collection_name)
+                    strategy_hint = latest_strategy_hint(latest_strategy, hint)
                     
                     print("\nStatus Query Pipeline:")
                     print(json.dumps(query_pipeline, indent=2, default=str))
-                    print("Using index:", hint)
+                    print(f"Latest event strategy: {latest_strategy}")
+                    print("Using index:", strategy_hint)
                     
                     query_result, query_time = self.run_optimized_time_series_query(
-                        collection, query_pipeline, hint, timeout_ms
+                        latest_strategy_target(collection, latest_strategy), query_pipeline, strategy_hint, timeout_ms
                     )
                     query_count = query_result[0]["total"] if query_result else 0
                     
-                    print(f"\nTotal count query completed in {total_time:.2f}ms, found {total_count:,} events")
+                    print(f"\nTotal count query completed in {total_time:.2f}ms, found {total_count:,} parcels")
                     print(f"Status query completed in {query_time:.2f}ms, found {query_count:,} parcels with latest edifact_code = 500 or 600")
-                    print(f"Events per parcel: {total_count/query_count:.2f}")
+                    if query_count:
+                        print(f"Parcels in range per matching parcel: {total_count/query_count:.2f}")
                     
                     results[display_name] = {
                         "time": query_time,
@@ -930,6 +1171,7 @@ class MongoQueryApp:
                     # Update the performance time label
                     self.perf_time_labels[collection_name].config(
                         text=f"{display_name}: Total {total_time:.2f}ms, Query {query_time:.2f}ms ({query_count:,} parcels)"
+                             f"{self.status_matrix_note(timing_start)}"
                     )
                 else:
                     # First get total count
@@ -940,13 +1182,13 @@ class MongoQueryApp:
                     
                     print("\nTotal Count Pipeline:")
                     print(json.dumps(total_pipeline, indent=2, default=str))
-                    print("Using index: tpid_1")
+                    print(f"Using index: {total_hint}")
                     
                     start_time = time.time()
                     total_result = list(collection.aggregate(
                         total_pipeline,
                         allowDiskUse=True,
-                        hint="tpid_1"
+                        hint=total_hint
                     ))
                     end_time = time.time()
                     total_count = total_result[0]["total"] if total_result else 0
@@ -976,6 +1218,13 @@ class MongoQueryApp:
                     print(f"Status query completed in {query_time:.2f}ms, found {query_count:,} parcels")
                     print(f"Percentage of parcels with status: {(query_count/total_count)*100:.2f}%")
                     
+                    # The same two numbers from one grouped pass
+                    matrix = compute_status_matrix(collection, match_stage,
+                                                   distinct_strategy="precomputed" if self.use_rollup.get() else "group")
+                    print(f"Status matrix completed in {matrix['time_ms']:.2f}ms, found "
+                          f"{matrix_status_count(matrix, test_codes):,} of {matrix['total']:,} parcels "
+                          f"(hint {matrix['hint']})")
+                    
                     results[display_name] = {
                         "time": query_time,
                         "total_time": total_time,
@@ -985,7 +1234,8 @@ class MongoQueryApp:
                     
                     # Update the performance time label
                     self.perf_time_labels[collection_name].config(
-                        text=f"{display_name}: Total {total_time:.2f}ms, Query {query_time:.2f}ms ({query_count:,} parcels)"
+                        text=f"{display_name}: Total {total_time:.2f}ms, Query {query_time:.2f}ms ({query_count:,} parcels), "
+                             f"Matrix {matrix['time_ms']:.2f}ms{self.status_matrix_note(timing_start)}"
                     )
                 
             except Exception as e:
@@ -1005,6 +1255,53 @@ class MongoQueryApp:
         # Create line graph
         self.plot_results(results)
     
+    def run_latest_strategy_benchmark(self):
+        """Benchmark every latest-event strategy on each time series collection and keep the fastest"""
+        if not self.check_tpid_ranges():
+            return
+        if self.current_db != "nzpost_summary_append":
+            messagebox.showinfo("Latest Strategies",
+                                "Latest event strategies only apply to the nzpost_summary_append database")
+            return
+        
+        match_stage = self.tpid_match()
+        selected_tpids = format_tpid_ranges(self.selected_tpid_ranges())
+        status = self.active_button.cget("text") if self.active_button else None
+        codes = [EDIFACT_CODES[status]] if status in EDIFACT_CODES else [500, 600]
+        
+        print(f"\n=== Benchmarking Latest Event Strategies ===")
+        print(f"Match: {json.dumps(match_stage, default=str)}")
+        print(f"Latest status codes: {codes}")
+        
+        lines = [f"Latest event strategies for {self.current_db}",
+                 f"TPIDs: {selected_tpids or 'all'}",
+                 f"Latest status codes: {codes}", ""]
+        for display_name, collection_name in self.collections.items():
+            print(f"\n--- {collection_name} ---")
+            benchmark = benchmark_latest_strategies(self.db[collection_name], match_stage, codes)
+            lines.append(f"{display_name} -> fastest: {benchmark['best']}")
+            lines.append(f"  {'Strategy':<14}{'Time (ms)':>12}{'Parcels':>12}{'Peak MB':>10}{'Spills':>8}  Disk  DISTINCT_SCAN")
+            for strategy in LATEST_STRATEGIES:
+                result = benchmark["results"][strategy]
+                if result["error"]:
+                    lines.append(f"  {strategy:<14}error: {result['error'][:80]}")
+                    continue
+                lines.append(
+                    f"  {strategy:<14}{result['time_ms']:>12.2f}{result['count']:>12,}"
+                    f"{result['peak_memory_bytes'] / 1048576:>10.1f}{result['spills']:>8}"
+                    f"  {'yes' if result['used_disk'] else 'no':<4}  {'yes' if result['distinct_scan'] else 'no'}"
+                )
+            lines.append("")
+        
+        popup = tk.Toplevel(self.root)
+        popup.title("Latest Event Strategy Benchmark")
+        popup.geometry("900x600")
+        text = tk.Text(popup, wrap=tk.NONE, font=("Courier", 10))
+        text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        text.insert(tk.END, "\n".join(lines))
+        text.config(state=tk.DISABLED)
+        ttk.Button(popup, text="Close", command=popup.destroy).pack(pady=10)
+    
     def plot_results(self, results):
         """Plot the performance test results in a new window"""
         # Create a new window for the plot
@@ -1127,29 +1424,280 @@ class MongoQueryApp:
         self.root.destroy()  # Destroy the window
         exit(0)  # Exit the application
 
+    def collection_choices(self) -> Dict[str, str]:
+        """Data range label -> collection name, described from the dataset manifests where there is one"""
+        choices = {}
+        for default_label, collection_name in COLLECTIONS.items():
+            manifest = self.manifests.get(collection_name)
+            label = default_label
+            if manifest and manifest.get("min_time") and manifest.get("max_time"):
+                first, last = manifest["min_time"], manifest["max_time"]
+                label = (f"{(last.date() - first.date()).days + 1} days ({round(manifest['events'] / 1e6, 1):g}M) - "
+                         f"{first.day} {first:%b} - {last.day} {last:%b %Y}")
+                if label in choices:
+                    label += f" [{collection_name}]"
+            choices[label] = collection_name
+        return choices
+
+    def build_collection_selector(self):
+        """(Re)create the data range radio buttons, keeping the selected collection"""
+        selected = self.collections.get(self.collection_var.get())
+        self.collections = self.collection_choices()
+        for button in self.collection_buttons:
+            button.destroy()
+        self.collection_buttons = []
+        for text, collection_name in self.collections.items():
+            button = ttk.Radiobutton(self.range_frame, text=text, variable=self.collection_var, value=text,
+                                     command=self.update_date_range)
+            button.pack(anchor=tk.W)
+            self.collection_buttons.append(button)
+            if collection_name == selected:
+                self.collection_var.set(text)
+        if self.collection_var.get() not in self.collections:
+            self.collection_var.set(next(iter(self.collections)))
+
+    def tpid_choices(self) -> List[int]:
+        """TPIDs offered as checkboxes: the largest by parcels across the manifests, else TPID_VOLUMES"""
+        parcels = {}
+        for manifest in self.manifests.values():
+            for entry in manifest.get("tpids", []):
+                parcels[entry["tpid"]] = parcels.get(entry["tpid"], 0) + entry["parcels"]
+        if not parcels:
+            return list(TPID_VOLUMES)[:TPID_CHECKBOXES]
+        return sorted(sorted(parcels, key=lambda tpid: (-parcels[tpid], tpid))[:TPID_CHECKBOXES])
+
+    def build_tpid_selector(self):
+        """(Re)create the TPID checkboxes, keeping the ticks of TPIDs that are still offered"""
+        ticked = [tpid for tpid, var in self.tpid_vars.items() if var.get()]
+        for cb in self.tpid_checkbuttons.values():
+            cb.destroy()
+        self.tpid_vars, self.tpid_checkbuttons = {}, {}
+        tpids = self.tpid_choices()
+        if not any(tpid in tpids for tpid in ticked):
+            ticked = tpids[:1]  # Check the first TPID by default
+        for tpid in tpids:
+            var = tk.BooleanVar(value=tpid in ticked)
+            var.trace_add("write", self.schedule_status_matrix)
+            self.tpid_vars[tpid] = var
+            
+            # Create checkbutton
+            cb = ttk.Checkbutton(self.tpid_frame, text=f"TPID {tpid}", variable=var)
+            cb.pack(side=tk.LEFT, padx=5)
+            self.tpid_checkbuttons[tpid] = cb
+            
+            # Bind hover events
+            cb.bind("<Enter>", lambda e, t=tpid: self.show_tpid_volume(e, t))
+            cb.bind("<Leave>", self.hide_tooltip)
+
+    def refresh_manifests(self):
+        """Load the dataset manifests of the current database"""
+        try:
+            self.manifests = load_manifests(self.db)
+            print(f"Loaded {len(self.manifests)} dataset manifests for {self.current_db}")
+        except Exception as e:
+            print(f"Could not load dataset manifests: {str(e)}")
+            self.manifests = {}
+
+    def current_manifest(self, check_current=False):
+        """Manifest of the selected collection, optionally only if it still matches the data"""
+        manifest = self.manifests.get(self.collections[self.collection_var.get()])
+        if manifest and check_current and not is_manifest_current(self.db, manifest):
+            print("Dataset manifest is out of date - ignoring it")
+            return None
+        return manifest
+
+    def collection_date_ranges(self):
+        """(from, to) per collection: the generated range from the manifests, else the defaults"""
+        ranges = dict(COLLECTION_DATE_RANGES)
+        for collection_name, manifest in self.manifests.items():
+            if collection_name in ranges and manifest.get("min_time") and manifest.get("max_time"):
+                ranges[collection_name] = (manifest["min_time"], manifest["max_time"])
+        return ranges
+
+    def get_offline_snapshot(self):
+        """Fresh snapshot of the selected collection, or None"""
+        collection_name = self.collections[self.collection_var.get()]
+        key = (self.current_db, collection_name)
+        if key not in self.snapshots:
+            self.snapshots[key] = OfflineSnapshot.load(self.current_db, collection_name)
+        snapshot = self.snapshots[key]
+        if snapshot is None:
+            print(f"No offline snapshot for {self.current_db}.{collection_name} - run offline_snapshot.py")
+            return None
+        if not snapshot.is_fresh(self.db):
+            print(f"Offline snapshot for {self.current_db}.{collection_name} is stale - querying MongoDB")
+            return None
+        return snapshot
+
+    def run_offline_status_query(self, status):
+        """Answer a status count from the offline snapshot; returns False when MongoDB must be used"""
+        snapshot = self.get_offline_snapshot()
+        if snapshot is None:
+            return False
+        
+        selected_tpids = None
+        if self.selected_tpid_ranges():
+            selected_tpids = self.selected_tpids([int(tpid) for tpid in snapshot.meta["tpid_ranges"]])
+            if not selected_tpids:
+                return False
+        date_from = date_to = None
+        if self.use_date_range.get():
+            date_from = datetime.combine(self.from_date.get_date(), datetime.min.time())
+            date_to = datetime.combine(self.to_date.get_date(), datetime.max.time())
+        
+        start_time = time.time()
+        total_parcels = snapshot.count(selected_tpids)
+        count = snapshot.count(selected_tpids, [EDIFACT_CODES[status]], date_from, date_to)
+        response_time = (time.time() - start_time) * 1000
+        
+        print("\n=== Offline Snapshot Query ===")
+        print(f"Snapshot exported at: {snapshot.meta['exported_at']}")
+        print(f"Count: {count:,} in {response_time:.2f}ms")
+        
+        self.parcels_label.config(text=f"Parcels: {total_parcels:,}")
+        self.count_label.config(text=f"Count: {count:,}")
+        self.time_label.config(text=f"Response Time: {response_time:.2f}ms (offline)")
+        if total_parcels > 0:
+            self.percentage_label.config(text=f"Percentage: {(count / total_parcels) * 100:.2f}%")
+        return True
+
+    def status_matrix_selection(self):
+        """(key, match stage) of the current selection, or (None, None) with facets or an invalid range"""
+        if self.facet_filters():
+            return None, None
+        try:
+            match_stage = self.build_query()
+        except ValueError:
+            # The range is still being typed; the query buttons report it
+            return None, None
+        collection_name = self.collections[self.collection_var.get()]
+        return (self.current_db, collection_name, json.dumps(match_stage, default=str, sort_keys=True)), match_stage
+    
+    def schedule_status_matrix(self, *args):
+        """Recompute the status matrix shortly after the last selection change"""
+        if self.status_matrix_after_id:
+            self.root.after_cancel(self.status_matrix_after_id)
+        self.status_matrix_after_id = self.root.after(300, self.start_status_matrix)
+    
+    def start_status_matrix(self):
+        """Compute the matrix for the current selection on a background thread, one at a time"""
+        self.status_matrix_after_id = None
+        if not self.use_status_matrix.get() or self.status_matrix_busy():
+            # poll_status_matrix starts the next computation once the running one finishes
+            return
+        key, match_stage = self.status_matrix_selection()
+        if key is None or key in (self.status_matrix_key, self.status_matrix_requested):
+            return
+        self.status_matrix_requested = key
+        collection = self.db[key[1]]
+        # Tk variables are read here, never from the worker
+        distinct_strategy = "precomputed" if self.use_rollup.get() else "group"
+        
+        def compute():
+            try:
+                matrix = compute_status_matrix(collection, match_stage, distinct_strategy=distinct_strategy)
+            except Exception as e:
+                print(f"Status matrix for {key[0]}.{key[1]} failed: {e}")
+                matrix = None
+            self.status_matrix_finished_at = time.time()
+            # Tk is not thread-safe: the result is handed to the main thread through the queue
+            self.status_matrix_queue.put((key, matrix))
+        
+        self.status_matrix_thread = threading.Thread(target=compute, daemon=True)
+        self.status_matrix_thread.start()
+    
+    def status_matrix_busy(self) -> bool:
+        return self.status_matrix_thread is not None and self.status_matrix_thread.is_alive()
+    
+    def status_matrix_note(self, since: float) -> str:
+        """Label for timings that shared the server with a matrix computation"""
+        if self.status_matrix_busy() or self.status_matrix_finished_at >= since:
+            return " (status matrix computing concurrently)"
+        return ""
+    
+    def poll_status_matrix(self):
+        """Store finished matrices on the Tk thread and catch up with selection changes made meanwhile"""
+        while True:
+            try:
+                key, matrix = self.status_matrix_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.store_status_matrix(key, matrix)
+        if self.status_matrix_after_id is None and not self.status_matrix_busy():
+            self.start_status_matrix()
+        self.root.after(200, self.poll_status_matrix)
+    
+    def store_status_matrix(self, key, matrix):
+        # A result for an earlier selection must not replace the current one
+        if matrix is None or key != self.status_matrix_selection()[0]:
+            return
+        self.status_matrix, self.status_matrix_key = matrix, key
+        print(f"Status matrix for {key[0]}.{key[1]}: {len(matrix['cells'])} cells, "
+              f"{matrix['total']:,} parcels in {matrix['time_ms']:.2f}ms (hint {matrix['hint']})")
+    
+    def run_matrix_status_query(self, status):
+        """Answer a status count from the prefetched matrix; returns False when it is not ready"""
+        key, _ = self.status_matrix_selection()
+        if key is None or key != self.status_matrix_key:
+            return False
+        
+        start_time = time.time()
+        count = matrix_status_count(self.status_matrix, [EDIFACT_CODES[status]])
+        total_parcels = self.status_matrix["total"]
+        response_time = (time.time() - start_time) * 1000
+        
+        print("\n=== Status Matrix Query ===")
+        print(f"Matrix computed in {self.status_matrix['time_ms']:.2f}ms")
+        print(f"Count: {count:,} in {response_time:.2f}ms")
+        
+        self.parcels_label.config(text=f"Parcels: {total_parcels:,}")
+        self.count_label.config(text=f"Count: {count:,}")
+        self.time_label.config(text=f"Response Time: {response_time:.2f}ms (status matrix)")
+        if total_parcels > 0:
+            self.percentage_label.config(text=f"Percentage: {(count / total_parcels) * 100:.2f}%")
+        return True
+    
+    def scatter_split(self, match_stage):
+        """Split for scatter-gather: per selected TPID, else by day (regular) or reference range"""
+        if match_tpid_ranges(match_stage):
+            return "tpid"
+        if self.current_db != "nzpost_summary_append" and "event_datetime" in match_stage:
+            return "day"
+        return "reference"
+
+    def valid_hint(self, hint, collection=None):
+        """Drop a hint for an index the collection does not have or has hidden.
+
+        Checked against the live indexes: the manifest's list is taken when the data is
+        generated, before create_mongo_indexes.py builds the query indexes.
+        """
+        if not hint:
+            return hint
+        if collection is None:
+            collection = self.db[self.collections[self.collection_var.get()]]
+        info = collection.index_information().get(hint)
+        if info is None or info.get("hidden"):
+            print(f"Index {hint} does not exist on {collection.name} or is hidden - letting MongoDB choose")
+            return None
+        return hint
+
     def update_date_range(self):
         """Update the date range based on the selected collection"""
-        collection_name = self.collection_var.get()
-        
         # Store current state and temporarily enable if disabled
         current_state = self.from_date.cget("state")
         if current_state == "disabled":
             self.from_date.configure(state="normal")
             self.to_date.configure(state="normal")
         
-        # Update the date range
-        if collection_name == "1 week (3M) - 1st - 7th March":
-            self.from_date.set_date(datetime(2025, 3, 1))
-            self.to_date.set_date(datetime(2025, 3, 7))
-        elif collection_name == "2 weeks (6M) - 1st - 14th March":
-            self.from_date.set_date(datetime(2025, 3, 1))
-            self.to_date.set_date(datetime(2025, 3, 14))
-        elif collection_name == "1 month (13M) - March":
-            self.from_date.set_date(datetime(2025, 3, 1))
-            self.to_date.set_date(datetime(2025, 3, 31))
-        elif collection_name == "3 months (38.6M) - Jan-Mar":
-            self.from_date.set_date(datetime(2025, 1, 1))
-            self.to_date.set_date(datetime(2025, 3, 31))
+        # Update the date range, preferring the generated range from the manifest
+        manifest = self.current_manifest()
+        if manifest and manifest.get("min_time") and manifest.get("max_time"):
+            self.from_date.set_date(manifest["min_time"])
+            self.to_date.set_date(manifest["max_time"])
+        else:
+            from_date, to_date = COLLECTION_DATE_RANGES[self.collections[self.collection_var.get()]]
+            self.from_date.set_date(from_date)
+            self.to_date.set_date(to_date)
         
         # Restore original state if it was disabled
         if current_state == "disabled":
@@ -1187,7 +1735,7 @@ class MongoQueryApp:
                 details.append(f"Date Range: {from_date} to {to_date}")
             
             details.append(f"\nWill test all collections in {self.db_var.get()}:")
-            for collection_display in COLLECTIONS.keys():
+            for collection_display in self.collections.keys():
                 details.append(f"- {collection_display}")
             
             tooltip = tk.Toplevel(self.root)
@@ -1216,8 +1764,13 @@ class MongoQueryApp:
             tooltip.wm_overrideredirect(True)
             tooltip.wm_geometry(f"+{event.x_root+10}+{event.y_root+10}")
             
-            volume = TPID_VOLUMES[tpid]
-            volume_text = f"{volume:,} parcels/month"
+            volume = TPID_VOLUMES.get(tpid)
+            lines = [f"{volume:,} parcels/month"] if volume else []
+            manifest = self.current_manifest()
+            if manifest:
+                parcels = manifest_tpid_parcels(manifest, tpid) or 0
+                lines.append(f"{parcels:,} parcels in {manifest['_id']}")
+            volume_text = "\n".join(lines) or f"TPID {tpid}"
             
             label = ttk.Label(tooltip, text=volume_text, justify=tk.LEFT,
                              background="#ffffe0", relief='solid', borderwidth=1,
@@ -1256,6 +1809,8 @@ class MongoQueryApp:
             sample_json = SAMPLE_JSON_SUMMARY
         elif self.db_var.get() == "nzpost_summary_item":
             sample_json = SAMPLE_JSON_ITEM
+        elif is_split_database(self.db_var.get()):
+            sample_json = {field: value for field, value in SAMPLE_JSON_ITEM.items() if field != "parcel_details"}
         else:  # nzpost_summary_append
             sample_json = SAMPLE_JSON_APPEND
         
@@ -1263,6 +1818,12 @@ class MongoQueryApp:
         formatted_json = json.dumps(sample_json, indent=2, default=str)
         text.insert(tk.END, formatted_json)
         
+        if is_split_database(self.db_var.get()):
+            text.insert(tk.END, "\n\nNote: parcel_details are stored in <collection>_details with the tracking "
+                                "reference as _id and are joined only when a parcel's details are requested:\n\n")
+            text.insert(tk.END, json.dumps({"_id": SAMPLE_JSON_ITEM["tracking_reference"],
+                                            **SAMPLE_JSON_ITEM["parcel_details"]}, indent=2, default=str))
+        
         # Add explanation for append database
         if self.db_var.get() == "nzpost_summary_append":
             text.insert(tk.END, "\n\nNote: In the append database, each event is stored as a separate document.\n")
@@ -1314,6 +1875,190 @@ class MongoQueryApp:
         close_button = ttk.Button(popup, text="Close", command=popup.destroy)
         close_button.pack(pady=10)
 
+    def show_parcel_details(self):
+        """Look up parcels by tracking reference and show their timelines (and details)"""
+        tracking_reference = simpledialog.askstring("Parcel Details",
+                                                    "Tracking reference(s), separated by commas or spaces,\n"
+                                                    "or a partial number (4321 or *4321 suffix, NZ1000* prefix):",
+                                                    initialvalue="NZ100000001", parent=self.root)
+        if not tracking_reference:
+            return
+        references = tracking_reference.replace(",", " ").split()
+        
+        collection_name = self.collections[self.collection_var.get()]
+        start_time = time.time()
+        if len(references) == 1 and reference_search_match(references[0])[1] != "exact":
+            # Partial number (e.g. 4321 or *4321 for a suffix, NZ1000* for a prefix): list the matches
+            document = search_references(self.db[collection_name], references[0])
+            if not document["rows"]:
+                document = None
+        elif len(references) == 1 and self.current_db != "nzpost_summary_append":
+            document = find_parcel(self.db, collection_name, references[0])
+        else:
+            # One $in round trip for every reference's ordered events
+            document = parcel_timelines(self.db[collection_name], references)
+            if is_split_database(self.current_db):
+                attach_details(self.db, collection_name,
+                               [event for events in document.values() for event in events])
+            if not any(document.values()):
+                document = None
+        if not document and len(references) == 1 and reference_search_match(references[0])[1] == "exact":
+            # A complete-looking number can still be the prefix of a longer reference
+            document = search_references(self.db[collection_name], references[0] + "*")
+            if not document["rows"]:
+                document = None
+        response_time = (time.time() - start_time) * 1000
+        if not document:
+            messagebox.showinfo("Parcel Details", f"{tracking_reference} not found in {collection_name}")
+            return
+        
+        popup = tk.Toplevel(self.root)
+        popup.title(f"Parcel {tracking_reference} ({response_time:.2f}ms)")
+        popup.geometry("800x600")
+        
+        text_frame = ttk.Frame(popup)
+        text_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        scrollbar = ttk.Scrollbar(text_frame)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        text = tk.Text(text_frame, wrap=tk.WORD, yscrollcommand=scrollbar.set)
+        text.pack(fill=tk.BOTH, expand=True)
+        scrollbar.config(command=text.yview)
+        
+        text.insert(tk.END, json.dumps(document, indent=2, default=str))
+        text.config(state=tk.DISABLED)
+        ttk.Button(popup, text="Close", command=popup.destroy).pack(pady=10)
+
+    def show_parcel_list(self):
+        """List the parcels of the current selection; further pages load as the table is scrolled"""
+        if not self.check_tpid_ranges():
+            return
+        status = self.active_button.cget("text") if self.active_button else None
+        match_stage = self.build_query(status if status in EDIFACT_CODES else None)
+        collection = self.db[self.collections[self.collection_var.get()]]
+        fields = listing_fields(collection)
+        pages = parcel_pages(collection, match_stage)
+        state = {"rows": 0, "exhausted": False, "loading": False, "scheduled": False}
+        
+        popup = tk.Toplevel(self.root)
+        popup.title(f"Parcels - {self.current_db}.{collection.name}")
+        popup.geometry("900x600")
+        
+        info_label = ttk.Label(popup, text=f"Filter: {json.dumps(match_stage, default=str)}", wraplength=850)
+        info_label.pack(anchor=tk.W, padx=10, pady=(10, 0))
+        rows_label = ttk.Label(popup, text="Rows: 0")
+        rows_label.pack(anchor=tk.W, padx=10)
+        
+        table_frame = ttk.Frame(popup)
+        table_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        scrollbar = ttk.Scrollbar(table_frame)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        tree = ttk.Treeview(table_frame, columns=fields, show="headings")
+        for field in fields:
+            tree.heading(field, text=field)
+            tree.column(field, width=150)
+        tree.pack(fill=tk.BOTH, expand=True)
+        scrollbar.config(command=tree.yview)
+        
+        def load_next_page():
+            state["scheduled"] = False
+            if state["exhausted"] or state["loading"]:
+                return
+            state["loading"] = True
+            start_time = time.time()
+            page = next(pages, None)
+            elapsed = (time.time() - start_time) * 1000
+            if page is None:
+                state["exhausted"] = True
+            else:
+                for row in page:
+                    tree.insert("", tk.END, values=[row.get(field, "") for field in fields])
+                state["rows"] += len(page)
+            rows_label.config(text=f"Rows: {state['rows']:,}{' (all)' if state['exhausted'] else ''} - "
+                                   f"last page {elapsed:.2f}ms")
+            state["loading"] = False
+        
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            # Fetch the next page when the bottom of the loaded rows comes into view; every scroll
+            # event near the bottom lands here, so at most one load is queued at a time
+            if float(last) >= 0.95 and not state["scheduled"] and not state["exhausted"]:
+                state["scheduled"] = True
+                popup.after_idle(load_next_page)
+        
+        tree.configure(yscrollcommand=on_scroll)
+        
+        def export():
+            path = filedialog.asksaveasfilename(parent=popup, defaultextension=".csv.gz",
+                                                initialfile=f"parcels_{collection.name}.csv.gz",
+                                                filetypes=[("Compressed CSV", "*.csv.gz"), ("Parquet", "*.parquet")])
+            if not path:
+                return
+            try:
+                stats = export_parcels(collection, match_stage, path,
+                                       "parquet" if path.endswith(".parquet") else "csv")
+                messagebox.showinfo("Export", f"{stats['rows']:,} parcels written to {path} "
+                                              f"in {stats['seconds']:.2f}s", parent=popup)
+            except Exception as e:
+                messagebox.showerror("Export Error", str(e), parent=popup)
+        
+        button_frame = ttk.Frame(popup)
+        button_frame.pack(pady=10)
+        ttk.Button(button_frame, text="Export...", command=export).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Close", command=popup.destroy).pack(side=tk.LEFT, padx=5)
+        
+        load_next_page()
+
+    def facet_filters(self) -> Dict:
+        """Selected item facet values ({facet: value}); empty outside the item database"""
+        if self.db_var.get() != ITEM_DATABASE:
+            return {}
+        filters = {}
+        for facet, var in self.facet_vars.items():
+            value = var.get().strip()
+            if facet in FACET_FLAGS:
+                if value in ("Yes", "No"):
+                    filters[facet] = value == "Yes"
+            elif value and value != "Any":
+                filters[facet] = value
+        return filters
+
+    def update_facet_state(self):
+        """Facets only apply to the item database"""
+        enabled = self.db_var.get() == ITEM_DATABASE
+        for widget in self.facet_widgets:
+            if isinstance(widget, ttk.Combobox):
+                widget.config(state="readonly" if enabled else "disabled")
+            else:
+                widget.config(state="normal" if enabled else "disabled")
+
+    def run_facet_counts_query(self):
+        """Count every facet's values for the current selection in one $facet round trip"""
+        if not self.check_tpid_ranges():
+            return
+        try:
+            status = self.active_button.cget("text") if self.active_button else None
+            match_stage = self.build_query(status if status in EDIFACT_CODES else None)
+            collection = self.db[self.collections[self.collection_var.get()]]
+            hint = self.get_optimal_hint(match_stage, collection)
+            
+            print("\n=== Facet Counts ===")
+            print(f"Match: {json.dumps(match_stage, default=str)}")
+            print(f"Index Hint: {hint}")
+            result = benchmark_facets(collection, match_stage, hint=hint)
+            
+            lines = [f"$facet (one round trip): {result['facet_ms']:.2f}ms",
+                     f"Separate queries (total): {result['separate_total_ms']:.2f}ms", ""]
+            for facet in ITEM_FACETS:
+                counts = result["counts"].get(facet, {})
+                lines.append(f"{facet} - {result['per_facet'][facet]['time_ms']:.2f}ms on its own")
+                lines.extend(f"    {value}: {count:,}" for value, count in counts.items())
+            print("\n".join(lines))
+            messagebox.showinfo("Facet Counts", "\n".join(lines))
+        except Exception as e:
+            error_msg = f"Error running facet counts: {str(e)}"
+            print(error_msg)
+            messagebox.showerror("Query Error", error_msg)
+
     def on_database_change(self, event):
         """Handle database selection change"""
         # Store old database for cleanup
@@ -1325,6 +2070,12 @@ class MongoQueryApp:
         
         # Connect to the new database
         self.db = self.client[self.current_db]
+        self.refresh_manifests()
+        self.build_collection_selector()
+        self.build_tpid_selector()
+        self.update_date_range()
+        self.update_facet_state()
+        self.schedule_status_matrix()
         
         # Update the query based on active button
         if self.active_button:
@@ -1368,8 +2119,15 @@ class MongoQueryApp:
         current_db = self.db_var.get()
         text.insert(tk.END, f"Indexes for {current_db}:\n\n")
         
-        if current_db in INDEX_INFO:
-            for index in INDEX_INFO[current_db]:
+        try:
+            collection = self.db[self.collections[self.collection_var.get()]]
+            index_list = [{"name": name, "fields": info["key"]}
+                          for name, info in collection.index_information().items() if not info.get("hidden")]
+        except Exception as e:
+            print(f"Could not read indexes: {str(e)}")
+            index_list = INDEX_INFO.get(current_db, [])
+        if index_list:
+            for index in index_list:
                 # Format the index fields for display
                 fields_str = ", ".join([f"{field}: {order}" for field, order in index["fields"]])
                 text.insert(tk.END, f"Index: {index['name']}\n")
@@ -1408,6 +2166,8 @@ class MongoQueryApp:
 
     def show_pipeline(self):
         """Show the current pipeline in a popup window"""
+        if not self.check_tpid_ranges():
+            return
         # Create a new window
         popup = tk.Toplevel(self.root)
         popup.title("Query Pipeline Details")
@@ -1429,7 +2189,7 @@ class MongoQueryApp:
             status = self.active_button.cget("text") if self.active_button else None
             
             # Get selected TPIDs
-            selected_tpids = [tpid for tpid, var in self.tpid_vars.items() if var.get()]
+            selected_tpids = format_tpid_ranges(self.selected_tpid_ranges()) or "all"
             
             # Get date range if enabled
             date_range_str = ""
@@ -1447,51 +2207,32 @@ class MongoQueryApp:
                 hint = self.get_optimal_hint(match_stage)
                 
                 if self.current_db == "nzpost_summary_append":
-                    # For time series database, show latest events pipeline
-                    time_series_pipeline = [
-                        {"$match": match_stage},
-                        # Sort by timestamp in descending order and group by tracking reference
-                        {"$sort": {"timestamp": -1}},
-                        {"$group": {
-                            "_id": "$tracking_reference",
-                            "latest_event": {"$first": "$$ROOT"}
-                        }},
-                        # Group by edifact code to get counts
-                        {"$group": {
-                            "_id": {
-                                "edifact_code": "$latest_event.edifact_code",
-                                "event_description": "$latest_event.event_description"
-                            },
-                            "count": {"$sum": 1}
-                        }},
-                        {"$project": {
-                            "_id": 0,
-                            "edifact_code": "$_id.edifact_code",
-                            "event_description": "$_id.event_description",
-                            "count": 1
-                        }},
-                        {"$sort": {"edifact_code": 1}}
-                    ]
+                    # For time series database, show the latest-event pipeline for the chosen strategy
+                    collection = self.db[self.collections[self.collection_var.get()]]
+                    latest_strategy = get_latest_strategy(collection)
+                    time_series_pipeline = latest_status_summary_pipeline(
+                        latest_strategy, match_stage, collection.name
+                    )
+                    hint = latest_strategy_hint(latest_strategy, hint)
                     
                     details = (
                         "Time Series All Events Query\n"
                         "-------------------------\n"
                         f"Database: {self.current_db}\n"
-                        f"Collection: {COLLECTIONS[self.collection_var.get()]}\n"
+                        f"Collection: {self.collections[self.collection_var.get()]}\n"
                         f"Selected TPIDs: {selected_tpids}\n"
                         f"{date_range_str}\n\n"
+                        f"Latest Event Strategy: {latest_strategy}\n\n"
                         "Pipeline (counts most recent events per tracking reference):\n"
                         f"{json.dumps(time_series_pipeline, indent=2, default=str)}\n\n"
                         f"Using Index Hint: {hint}\n\n"
                         "Explanation:\n"
                         "1. Match documents based on TPID and date range filters\n"
-                        "2. Sort events by timestamp in descending order\n"
-                        "3. Group by tracking reference and keep only the most recent event\n"
-                        "4. Group again by edifact_code and event_description to count occurrences\n"
-                        "5. Project the results in a clean format\n"
-                        "6. Sort by edifact_code for consistent display\n\n"
-                        "Note: For time series data, we first identify the latest event for each\n"
-                        "tracking reference, then count those latest events by type."
+                        "2. Reduce the events to the latest tpid and edifact_code per tracking reference\n"
+                        "3. Group by edifact_code to count parcels per latest status\n"
+                        "4. Sort by edifact_code for consistent display\n\n"
+                        "Note: The strategy is the fastest one found by 'Latest Strategies' for this\n"
+                        "collection (group_top until a benchmark has been run)."
                     )
                     
                     text.insert(tk.END, details)
@@ -1516,7 +2257,7 @@ class MongoQueryApp:
                         "Standard Collection All Events Query\n"
                         "--------------------------------\n"
                         f"Database: {self.current_db}\n"
-                        f"Collection: {COLLECTIONS[self.collection_var.get()]}\n"
+                        f"Collection: {self.collections[self.collection_var.get()]}\n"
                         f"Selected TPIDs: {selected_tpids}\n"
                         f"{date_range_str}\n\n"
                         "Pipeline (counts events by edifact code):\n"
@@ -1536,60 +2277,36 @@ class MongoQueryApp:
                 
             # Format the pipeline details based on database type for regular status queries
             elif self.current_db == "nzpost_summary_append":
-                # For time series database, show latest event pipeline using $setWindowFields
-                
-                # Extract date range from match_stage if present
-                date_filter = {}
-                if "timestamp" in match_stage:
-                    date_filter = {"timestamp": match_stage["timestamp"]}
-                
-                # First filter for TPIDs if selected
-                tpid_filter = {}
-                if "tpid" in match_stage:
-                    tpid_filter = {"tpid": match_stage["tpid"]}
-                
-                # Build pipeline using $setWindowFields
-                setwindow_pipeline = [
-                    # Match by TPIDs and date range first if specified
-                    {"$match": {**tpid_filter, **date_filter}},
-                    # Use $setWindowFields to efficiently find latest event per tracking reference
-                    {"$setWindowFields": {
-                        "partitionBy": "$tracking_reference",
-                        "sortBy": {"timestamp": -1},
-                        "output": {
-                            "is_latest": {
-                                "$first": "$$ROOT",
-                                "window": {"documents": [0, 0]}
-                            }
-                        }
-                    }},
-                    # Keep only the first document for each tracking reference
-                    {"$match": {"is_latest.edifact_code": EDIFACT_CODES[status] if status else None}},
-                    # Count total unique tracking references
-                    {"$count": "total"}
-                ]
+                # For time series database, show the latest-event pipeline for the chosen strategy
+                collection = self.db[self.collections[self.collection_var.get()]]
+                latest_strategy = get_latest_strategy(collection)
+                latest_match = {k: v for k, v in match_stage.items() if k != "edifact_code"}
+                latest_pipeline = latest_status_count_pipeline(
+                    latest_strategy, latest_match, [EDIFACT_CODES[status]] if status else [], collection.name
+                )
                 
                 # Determine the hint being used
-                hint = self.get_optimal_hint(match_stage)
+                hint = latest_strategy_hint(latest_strategy, self.get_optimal_hint(latest_match, calibrate=False))
                 
                 details = (
                     "Time Series Collection Query\n"
                     "------------------------\n"
                     f"Database: {self.current_db}\n"
-                    f"Collection: {COLLECTIONS[self.collection_var.get()]}\n"
+                    f"Collection: {self.collections[self.collection_var.get()]}\n"
                     f"Status: {status}\n"
                     f"Selected TPIDs: {selected_tpids}\n"
                     f"{date_range_str}\n\n"
+                    f"Latest Event Strategy: {latest_strategy}\n\n"
                     "Pipeline (counts parcels where LATEST status matches criteria):\n"
-                    f"{json.dumps(setwindow_pipeline, indent=2, default=str)}\n\n"
+                    f"{json.dumps(latest_pipeline, indent=2, default=str)}\n\n"
                     f"Using Index Hint: {hint}\n\n"
                     "Explanation:\n"
                     "1. First we find all events for the specified TPIDs within the date range\n"
-                    "2. Then we use $setWindowFields to efficiently find the latest event for each parcel\n"
+                    "2. Then we reduce them to the latest tpid and edifact_code for each parcel\n"
                     f"3. Filter to include only parcels whose latest status is '{status}'\n"
                     "4. Count the resulting unique parcels\n\n"
-                    "Note: This uses MongoDB's optimized $setWindowFields operator which is designed\n"
-                    "specifically for time series data and performs better than sort+group for large collections."
+                    "Note: The strategy is the fastest one found by 'Latest Strategies' for this\n"
+                    "collection (group_top until a benchmark has been run)."
                 )
                 
                 text.insert(tk.END, details)
@@ -1608,7 +2325,7 @@ class MongoQueryApp:
                     "Standard Collection Query\n"
                     "----------------------\n"
                     f"Database: {self.current_db}\n"
-                    f"Collection: {COLLECTIONS[self.collection_var.get()]}\n"
+                    f"Collection: {self.collections[self.collection_var.get()]}\n"
                     f"Status: {status}\n"
                     f"Selected TPIDs: {selected_tpids}\n"
                     f"{date_range_str}\n\n"
@@ -1628,9 +2345,25 @@ class MongoQueryApp:
         close_button = ttk.Button(popup, text="Close", command=popup.destroy)
         close_button.pack(pady=10)
 
-    def get_optimal_hint(self, match_stage):
-        """Determine the optimal index hint based on query conditions"""
-        selected_tpids = [tpid for tpid, var in self.tpid_vars.items() if var.get()]
+    def get_optimal_hint(self, match_stage, collection=None, calibrate=True):
+        """Determine the optimal index hint based on query conditions.
+        
+        With cost-based hints enabled the winner of a per-shape index race is used;
+        calibrate=False only reuses an existing race result (for tooltips and previews).
+        """
+        if self.use_cost_hints.get():
+            if collection is None:
+                collection = self.db[self.collections[self.collection_var.get()]]
+            if calibrate:
+                hint = self.hint_selector.choose(collection, match_stage)
+                print(f"Cost-based hint for {collection.name}: {hint}")
+                return hint
+            choice = self.hint_selector.cached(collection, match_stage)
+            if choice is not None:
+                return choice["hint"]
+            print("No calibrated hint yet for this query shape - using static rules")
+        
+        selected_tpids = self.selected_tpid_ranges()
         status = self.active_button.cget("text") if self.active_button else None
         current_db = self.db_var.get()
         
@@ -1652,6 +2385,16 @@ class MongoQueryApp:
         # - tpid_1
         # - event_datetime_1
         # - tracking_reference_1
+        # - inflight_edifact_code_1_tpid_1_event_datetime_1 (partial: edifact_code != 500)
+        
+        # Facet filters: the compound facet index that matches the most filtered fields
+        if has_facet_filters(match_stage):
+            if collection is None:
+                collection = self.db[self.collections[self.collection_var.get()]]
+            hint = facet_index_hint(collection, match_stage)
+            print(f"Selected hint for facet filters: {hint}")
+            if hint:
+                return hint
         
         # Special handling for "All events" mode
         if is_all_events:
@@ -1674,16 +2417,27 @@ class MongoQueryApp:
                 hint = None
                 print("No hint selected for All events - letting MongoDB choose optimal index")
                 
-            return hint
+            return self.valid_hint(hint, collection)
         
         # For other modes, proceed with existing logic
         # Check if this is a total count query (no status filter)
         is_total_count = not status and "tracking_reference" in str(match_stage)
         
+        # Statuses other than Delivered can use the much smaller in-flight partial index
+        partial_hints = []
+        if status and current_db != "nzpost_summary_append" and (selected_tpids or "event_datetime" in match_stage):
+            if collection is None:
+                collection = self.db[self.collections[self.collection_var.get()]]
+            partial_hints = usable_partial_indexes(collection, match_stage)
+        
         if is_total_count and selected_tpids:
             # Total count query - use the optimized index for tracking reference counting
             hint = "tpid_1_tracking_reference_1"
             print(f"Selected hint: {hint} - Total count query with TPID")
+        elif partial_hints:
+            # In-flight status - the partial index skips all Delivered parcels
+            hint = partial_hints[0]
+            print(f"Selected hint: {hint} - In-flight status with partial index")
         elif selected_tpids and status and "event_datetime" in match_stage:
             # All three filters - use the compound index
             hint = "tpid_1_edifact_code_1_event_datetime_1"
@@ -1705,7 +2459,7 @@ class MongoQueryApp:
             hint = None
             print("No hint selected - letting MongoDB choose optimal index")
         
-        return hint
+        return self.valid_hint(hint, collection)
 
     def show_performance_pipeline(self):
         """Show the performance test pipeline details in a popup window"""
@@ -1731,12 +2485,7 @@ class MongoQueryApp:
         current_db = self.db_var.get()
         
         # Date ranges for collections
-        collection_date_ranges = {
-            "summary_1_week": (datetime(2025, 3, 1), datetime(2025, 3, 7)),
-            "summary_2_weeks": (datetime(2025, 3, 1), datetime(2025, 3, 14)),
-            "summary_1_month": (datetime(2025, 3, 1), datetime(2025, 3, 31)),
-            "summary_3_months": (datetime(2025, 1, 1), datetime(2025, 3, 31))
-        }
+        collection_date_ranges = self.collection_date_ranges()
         
         details = []
         details.append(f"\n=== Database: {current_db} ===\n")
@@ -1764,56 +2513,25 @@ class MongoQueryApp:
                 match_stage["event_datetime"] = {"$gte": date_range[0], "$lte": date_range[1]}
             
             # Get the optimal hint
-            hint = self.get_optimal_hint(match_stage)
+            hint = self.get_optimal_hint(match_stage, collection=self.client[current_db][collection_key],
+                                         calibrate=False)
             
             # Show different pipelines based on collection type
             if current_db == "nzpost_summary_append":
-                # For time series database, show the SetWindowFields pipeline
+                # For time series database, show the chosen latest-event strategy pipelines
+                latest_strategy = get_latest_strategy(self.client[current_db][collection_key])
                 details.append("\nTime Series Collection Test Pipeline:")
+                details.append(f"Latest Event Strategy: {latest_strategy}")
                 details.append("This test measures:")
                 details.append("1. Count of all events by type for the latest event per tracking reference")
                 details.append("2. Count of parcels with specific latest status codes")
                 
                 # All events pipeline for time series
-                all_events_pipeline = [
-                    {"$match": match_stage},
-                    {"$sort": {"timestamp": -1}},
-                    {"$group": {
-                        "_id": "$tracking_reference",
-                        "latest_event": {"$first": "$$ROOT"}
-                    }},
-                    {"$group": {
-                        "_id": {
-                            "edifact_code": "$latest_event.edifact_code",
-                            "event_description": "$latest_event.event_description"
-                        },
-                        "count": {"$sum": 1}
-                    }},
-                    {"$project": {
-                        "_id": 0,
-                        "edifact_code": "$_id.edifact_code",
-                        "event_description": "$_id.event_description",
-                        "count": 1
-                    }},
-                    {"$sort": {"edifact_code": 1}}
-                ]
+                all_events_pipeline = latest_status_summary_pipeline(latest_strategy, match_stage, collection_key)
                 
                 # Specific status pipeline for time series
-                status_pipeline = [
-                    {"$match": match_stage},
-                    {"$setWindowFields": {
-                        "partitionBy": "$tracking_reference",
-                        "sortBy": {"timestamp": -1},
-                        "output": {
-                            "is_latest": {
-                                "$first": "$$ROOT",
-                                "window": {"documents": [0, 0]}
-                            }
-                        }
-                    }},
-                    {"$match": {"is_latest.edifact_code": {"$in": test_codes}}},
-                    {"$count": "total"}
-                ]
+                status_pipeline = latest_status_count_pipeline(latest_strategy, match_stage, test_codes, collection_key)
+                hint = latest_strategy_hint(latest_strategy, hint)
                 
                 details.append("\nAll Events Pipeline (counts most recent events per tracking reference):")
                 details.append(json.dumps(all_events_pipeline, indent=2, default=str))
@@ -1846,17 +2564,7 @@ class MongoQueryApp:
                 ]
                 
                 # Unique parcels pipeline
-                parcels_pipeline = [
-                    {"$match": match_stage},
-                    {"$group": {
-                        "_id": None,  # Using None for null
-                        "distinct_parcels": {"$addToSet": "$tracking_reference"}
-                    }},
-                    {"$project": {
-                        "_id": 0,
-                        "count": {"$size": "$distinct_parcels"}
-                    }}
-                ]
+                parcels_pipeline = distinct_parcels_pipeline(match_stage)
                 
                 # Specific status pipeline
                 status_pipeline = [
@@ -1886,6 +2594,8 @@ class MongoQueryApp:
 
     def run_all_events_query(self):
         """Run a query to count events by type and display the results"""
+        if not self.check_tpid_ranges():
+            return
         try:
             # Reset previous active button style
             if self.active_button:
@@ -1896,16 +2606,15 @@ class MongoQueryApp:
             self.active_button = self.all_events_btn
             
             # Get the actual collection name from the display name
-            collection_name = COLLECTIONS[self.collection_var.get()]
+            collection_name = self.collections[self.collection_var.get()]
             collection = self.db[collection_name]
             
             # Build base query for filtering
             match_stage = {}
             
             # Add TPID filter
-            selected_tpids = [tpid for tpid, var in self.tpid_vars.items() if var.get()]
-            if selected_tpids:
-                match_stage["tpid"] = {"$in": selected_tpids}
+            match_stage.update(self.tpid_match())
+            selected_tpids = format_tpid_ranges(self.selected_tpid_ranges())
             
             # Add date range filter if enabled
             if self.use_date_range.get():
@@ -1928,39 +2637,37 @@ class MongoQueryApp:
             # Get optimal index hint
             hint = self.get_optimal_hint(match_stage)
             
+            rollup_query = self.get_rollup_query(match_stage)
+            
             # Execute aggregation pipeline with timing
             start_time = time.time()
-            
-            if self.current_db == "nzpost_summary_append":
-                # For time series, first get latest event per tracking reference
-                pipeline = [
-                    {"$match": match_stage},
-                    # Sort by timestamp in descending order and group by tracking reference
-                    {"$sort": {"timestamp": -1}},
-                    {"$group": {
-                        "_id": "$tracking_reference",
-                        "latest_event": {"$first": "$$ROOT"}
-                    }},
-                    # Group by edifact code to get counts
-                    {"$group": {
-                        "_id": {
-                            "edifact_code": "$latest_event.edifact_code",
-                            "event_description": "$latest_event.event_description"
-                        },
-                        "count": {"$sum": 1}
-                    }},
-                    {"$project": {
-                        "_id": 0,
-                        "edifact_code": "$_id.edifact_code",
-                        "event_description": "$_id.event_description",
-                        "count": 1
-                    }},
-                    {"$sort": {"edifact_code": 1}}
-                ]
+            timing_start = start_time
+            
+            if rollup_query is not None:
+                # Sum the pre-aggregated daily counts per edifact code
+                result, response_time = self.run_rollup_query(rollup_events_pipeline(rollup_query))
+                code_descriptions = {code: desc for desc, code in EDIFACT_CODES.items()}
+                for item in result:
+                    item["event_description"] = code_descriptions.get(item["edifact_code"], "Unknown")
+                
+                # One document per parcel, so the event total is also the parcel total
+                total_count = sum(item["count"] for item in result)
+                parcels_count = total_count
+                
+            elif self.current_db == "nzpost_summary_append":
+                # For time series, first get latest event per tracking reference using the
+                # fastest benchmarked strategy for this collection
+                latest_strategy = get_latest_strategy(collection)
+                print(f"Latest event strategy: {latest_strategy}")
+                pipeline = latest_status_summary_pipeline(latest_strategy, match_stage, collection_name)
                 
                 result, response_time = self.run_optimized_time_series_query(
-                    collection, pipeline, hint, 1200000
+                    latest_strategy_target(collection, latest_strategy), pipeline,
+                    latest_strategy_hint(latest_strategy, hint), 1200000
                 )
+                code_descriptions = {code: desc for desc, code in EDIFACT_CODES.items()}
+                for item in result:
+                    item["event_description"] = code_descriptions.get(item["edifact_code"], "Unknown")
                 
                 # For time series, total parcels is the sum of all counts since each tracking reference
                 # is counted exactly once in its latest status
@@ -1997,30 +2704,17 @@ class MongoQueryApp:
                 # Calculate total count from results
                 total_count = sum(item["count"] for item in result)
                 
-                # For standard collections, count distinct tracking references efficiently
-                parcels_pipeline = [
-                    {"$match": match_stage},
-                    {"$group": {
-                        "_id": None,  # Use None instead of null
-                        "distinct_parcels": {"$addToSet": "$tracking_reference"}
-                    }},
-                    {"$project": {
-                        "_id": 0,
-                        "count": {"$size": "$distinct_parcels"}
-                    }}
-                ]
-                
-                # Execute parcels count pipeline
-                parcels_result = list(collection.aggregate(
-                    parcels_pipeline,
-                    allowDiskUse=True,
-                    hint=hint
-                ))
-                parcels_count = parcels_result[0]["count"] if parcels_result else 0
+                # For standard collections, count distinct tracking references without
+                # materialising them all in one array
+                distinct_strategy = choose_distinct_strategy(collection, match_stage, self.use_rollup.get())
+                distinct = count_distinct_parcels(collection, match_stage, strategy=distinct_strategy, hint=hint)
+                parcels_count = distinct["count"]
+                print(f"Distinct parcels: {parcels_count:,} via {distinct['strategy']} strategy "
+                      f"in {distinct['time_ms']:.2f}ms")
             
             # Update display labels
             self.count_label.config(text=f"Count: {total_count:,}")
-            self.time_label.config(text=f"Response Time: {response_time:.2f}ms")
+            self.time_label.config(text=f"Response Time: {response_time:.2f}ms{self.status_matrix_note(timing_start)}")
             self.parcels_label.config(text=f"Parcels: {parcels_count:,}")
             
             # For time series, percentage should be relative to total unique tracking references
@@ -2049,9 +2743,9 @@ class MongoQueryApp:
             details = []
             details.append(f"Collection: {self.collection_var.get()}")
             
-            selected_tpids = [tpid for tpid, var in self.tpid_vars.items() if var.get()]
-            if selected_tpids:
-                details.append(f"\nSelected TPIDs: {', '.join(map(str, selected_tpids))}")
+            selected_ranges = self.selected_tpid_ranges()
+            if selected_ranges:
+                details.append(f"\nSelected TPIDs: {format_tpid_ranges(selected_ranges)}")
             else:
                 details.append("\nNo TPIDs selected")
             
@@ -2066,9 +2760,7 @@ class MongoQueryApp:
                 details.append(f"To: {self.to_date.get_date()}")
             
             # Build sample query to show
-            match_stage = {}
-            if selected_tpids:
-                match_stage["tpid"] = {"$in": selected_tpids}
+            match_stage = self.tpid_match()
                 
             if self.use_date_range.get():
                 from_date = datetime.combine(self.from_date.get_date(), datetime.min.time())
@@ -2081,28 +2773,11 @@ class MongoQueryApp:
             
             # Build pipeline based on database type
             if self.current_db == "nzpost_summary_append":
-                pipeline = [
-                    {"$match": match_stage},
-                    {"$sort": {"timestamp": -1}},
-                    {"$group": {
-                        "_id": "$tracking_reference",
-                        "latest_event": {"$first": "$$ROOT"}
-                    }},
-                    {"$group": {
-                        "_id": {
-                            "edifact_code": "$latest_event.edifact_code",
-                            "event_description": "$latest_event.event_description"
-                        },
-                        "count": {"$sum": 1}
-                    }},
-                    {"$project": {
-                        "_id": 0,
-                        "edifact_code": "$_id.edifact_code",
-                        "event_description": "$_id.event_description",
-                        "count": 1
-                    }},
-                    {"$sort": {"edifact_code": 1}}
-                ]
+                latest_strategy = get_latest_strategy(self.db[self.collections[self.collection_var.get()]])
+                pipeline = latest_status_summary_pipeline(
+                    latest_strategy, match_stage, self.collections[self.collection_var.get()]
+                )
+                details.append(f"\nLatest Event Strategy: {latest_strategy}")
                 details.append("\nPipeline (counts most recent events per tracking reference):")
             else:
                 # Show both pipelines for standard collections
@@ -2123,22 +2798,12 @@ class MongoQueryApp:
                 details.append("\nPipeline #1 (counts all events by type):")
                 details.append(json.dumps(event_pipeline, indent=2, default=str))
                 
-                parcel_pipeline = [
-                    {"$match": match_stage},
-                    {"$group": {
-                        "_id": None,  # Use None instead of null
-                        "distinct_parcels": {"$addToSet": "$tracking_reference"}
-                    }},
-                    {"$project": {
-                        "_id": 0,
-                        "count": {"$size": "$distinct_parcels"}
-                    }}
-                ]
+                parcel_pipeline = distinct_parcels_pipeline(match_stage)
                 details.append("\nPipeline #2 (counts distinct parcels):")
                 details.append(json.dumps(parcel_pipeline, indent=2, default=str))
                 
                 # Get the appropriate index hint
-                hint = self.get_optimal_hint(match_stage)
+                hint = self.get_optimal_hint(match_stage, calibrate=False)
                 details.append(f"\nUsing Index Hint: {hint}")
                 
                 details.append("\nNote: We run two separate queries for optimal performance:")
@@ -2149,7 +2814,7 @@ class MongoQueryApp:
             details.append(json.dumps(pipeline, indent=2, default=str))
             
             # Get the appropriate index hint
-            hint = self.get_optimal_hint(match_stage)
+            hint = self.get_optimal_hint(match_stage, calibrate=False)
             details.append(f"\nUsing Index Hint: {hint}")
             
             if self.current_db == "nzpost_summary_append":
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Daily Rollup Builder for NZ Post Summary Databases
+
+This script pre-aggregates the one-document-per-parcel databases:
+1. nzpost_summary - Regular collections
+2. nzpost_summary_item - Item detail collections
+
+Each source collection is reduced to parcel counts per (tpid, edifact_code, day)
+and stored in a small `daily_rollup` collection in the same database. Any
+TPID/status/date-range count can then be answered by summing a few thousand rows
+instead of scanning index ranges over millions of parcels.
+
+A `daily_rollup_state` document per source collection records the source document
+count at build time so readers can detect a stale rollup and fall back to the raw
+collection.
+"""
+
+import pymongo
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# MongoDB connection parameters
+MONGO_URI = "mongodb://localhost:27017/"
+
+# Databases with one document per parcel
+ROLLUP_DATABASES = ["nzpost_summary", "nzpost_summary_item"]
+
+# Collection names
+COLLECTIONS = [
+    "summary_1_week",
+    "summary_2_weeks",
+    "summary_1_month",
+    "summary_3_months"
+]
+
+# Rollup collections
+ROLLUP_COLLECTION = "daily_rollup"
+ROLLUP_STATE_COLLECTION = "daily_rollup_state"
+ROLLUP_INDEX_NAME = "source_1_tpid_1_edifact_code_1_day_1_count_1"
+
+def build_collection_rollup(db, collection_name: str) -> Dict:
+    """Rebuild the daily rollup rows for a single source collection"""
+    start_time = time.time()
+    source = db[collection_name]
+    rollup = db[ROLLUP_COLLECTION]
+
+    # Covering index so rollup sums never fetch documents
+    rollup.create_index(
+        [("source", 1), ("tpid", 1), ("edifact_code", 1), ("day", 1), ("count", 1)],
+        name=ROLLUP_INDEX_NAME
+    )
+
+    # Record the source size before aggregating so inserts during the build mark it stale
+    source_count = source.estimated_document_count()
+
+    rollup.delete_many({"source": collection_name})
+    pipeline = [
+        {"$group": {
+            "_id": {
+                "tpid": "$tpid",
+                "edifact_code": "$edifact_code",
+                "day": {"$dateTrunc": {"date": "$event_datetime", "unit": "day"}}
+            },
+            "count": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": {
+                "source": collection_name,
+                "tpid": "$_id.tpid",
+                "edifact_code": "$_id.edifact_code",
+                "day": "$_id.day"
+            },
+            "source": collection_name,
+            "tpid": "$_id.tpid",
+            "edifact_code": "$_id.edifact_code",
+            "day": "$_id.day",
+            "count": 1
+        }},
+        {"$merge": {
+            "into": ROLLUP_COLLECTION,
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }}
+    ]
+    source.aggregate(pipeline, allowDiskUse=True)
+
+    rows = rollup.count_documents({"source": collection_name})
+    build_time = time.time() - start_time
+    state = {
+        "_id": collection_name,
+        "source_count": source_count,
+        "rows": rows,
+        "built_at": datetime.now(),
+        "build_seconds": build_time
+    }
+    db[ROLLUP_STATE_COLLECTION].replace_one({"_id": collection_name}, state, upsert=True)
+
+    print(f"  {collection_name}: {source_count:,} parcels -> {rows:,} rollup rows in {build_time:.2f}s")
+    return state
+
+def build_database_rollups(client, db_name: str) -> List[Dict]:
+    """Rebuild the daily rollup for every collection in a database"""
+    print(f"\nBuilding daily rollup for {db_name}...")
+    db = client[db_name]
+    return [build_collection_rollup(db, collection_name) for collection_name in COLLECTIONS]
+
+def is_rollup_fresh(db, collection_name: str) -> bool:
+    """Check whether the rollup still matches the size of its source collection"""
+    state = db[ROLLUP_STATE_COLLECTION].find_one({"_id": collection_name})
+    if not state:
+        return False
+    return db[collection_name].estimated_document_count() == state["source_count"]
+
+def day_bounds(date_filter: Dict) -> Optional[Dict]:
+    """Convert a whole-day datetime range into a range over rollup days"""
+    day_filter = {}
+    for op, value in date_filter.items():
+        day = datetime.combine(value.date(), datetime.min.time())
+        if op == "$gte" and value == day:
+            day_filter["$gte"] = day
+        elif op == "$lt" and value == day:
+            day_filter["$lt"] = day
+        elif op == "$lte" and value.time() == datetime.max.time():
+            day_filter["$lte"] = day
+        elif op == "$gt" and value.time() == datetime.max.time():
+            day_filter["$gt"] = day
+        else:
+            # Partial days cannot be answered from daily counts
+            return None
+    return day_filter
+
+def is_tpid_or(condition) -> bool:
+    """True for an $or whose branches only filter tpid (as written by mongo_query_engine.tpid_filter)"""
+    return isinstance(condition, list) and bool(condition) and all(
+        isinstance(branch, dict) and set(branch) == {"tpid"} for branch in condition)
+
+def rollup_match(collection_name: str, match_stage: Dict) -> Optional[Dict]:
+    """Translate a raw collection match stage into a rollup match stage.
+
+    Returns None when the match uses fields or date bounds the rollup cannot answer.
+    """
+    query = {"source": collection_name}
+    for field, condition in match_stage.items():
+        if field in ("tpid", "edifact_code") or (field == "$or" and is_tpid_or(condition)):
+            query[field] = condition
+        elif field == "event_datetime":
+            day_filter = day_bounds(condition)
+            if day_filter is None:
+                return None
+            query["day"] = day_filter
+        else:
+            return None
+    return query
+
+def rollup_count_pipeline(rollup_query: Dict) -> List[Dict]:
+    """Pipeline that sums rollup rows into a single total"""
+    return [
+        {"$match": rollup_query},
+        {"$group": {"_id": None, "total": {"$sum": "$count"}}}
+    ]
+
+def rollup_events_pipeline(rollup_query: Dict) -> List[Dict]:
+    """Pipeline that sums rollup rows per edifact code"""
+    return [
+        {"$match": rollup_query},
+        {"$group": {"_id": "$edifact_code", "count": {"$sum": "$count"}}},
+        {"$project": {"_id": 0, "edifact_code": "$_id", "count": 1}},
+        {"$sort": {"edifact_code": 1}}
+    ]
+
+if __name__ == "__main__":
+    print("Daily Rollup Builder for NZ Post Databases")
+    print("==========================================")
+    print(f"Script execution started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    try:
+        client = pymongo.MongoClient(MONGO_URI)
+        start_time = time.time()
+        for db_name in ROLLUP_DATABASES:
+            build_database_rollups(client, db_name)
+        print(f"\nRollup build completed in {time.time() - start_time:.2f} seconds")
+        client.close()
+
+        print("\nScript completed successfully!")
+    except Exception as e:
+        print(f"\nError: {str(e)}")
+        print("\nScript execution failed.")
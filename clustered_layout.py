@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Clustered Layout for the NZ Post Summary Database
+
+nzpost_summary holds one document per parcel, yet every collection carries an
+ObjectId _id index next to tracking_reference_1 and tpid_1_tracking_reference_1.
+The clustered layouts (written by Generate_Mongo_Test_Data_summary.py
+--schema clustered) store the documents in clustered collections ordered by a
+natural _id instead:
+- reference (nzpost_summary_clustered): _id is the tracking reference, so
+  tracking_reference_1 and the ObjectId index are gone and parcel lookups
+  read the clustered key directly
+- tpid_reference (nzpost_summary_clustered_tpid): _id is
+  {tpid, tracking_reference}, so tpid_1_tracking_reference_1 and the ObjectId
+  index are gone and a TPID's parcels are one contiguous clustered range
+
+The tracking_reference field moves into _id; tpid, edifact_code,
+event_description and event_datetime stay top-level so the status indexes are
+unchanged. Generate_Mongo_Test_Data_summary_Item.py --layout clustered writes
+the item documents (parcel_details included) in the same layouts to
+CLUSTERED_ITEM_DATABASES.
+
+Run this script for a report of load speed, storage and point-lookup latency
+of each clustered layout against the standard layout.
+"""
+
+import argparse
+import pymongo
+import statistics
+import time
+from typing import Dict, List, Optional, Tuple
+from mongo_query_engine import WORKLOAD_TPIDS, WORKLOAD_TRACKING_REFERENCE, collection_storage_stats
+
+# MongoDB connection parameters
+MONGO_URI = "mongodb://localhost:27017/"
+
+STANDARD_DATABASE = "nzpost_summary"
+
+# Cluster key -> database
+CLUSTERED_DATABASES = {
+    "reference": "nzpost_summary_clustered",
+    "tpid_reference": "nzpost_summary_clustered_tpid"
+}
+CLUSTER_KEYS = list(CLUSTERED_DATABASES)
+
+# Cluster key -> database of the clustered item layout
+CLUSTERED_ITEM_DATABASES = {
+    "reference": "nzpost_summary_item_clustered",
+    "tpid_reference": "nzpost_summary_item_clustered_tpid"
+}
+DEFAULT_CLUSTER_KEY = "reference"
+
+# Collection names
+COLLECTIONS = [
+    "summary_1_week",
+    "summary_2_weeks",
+    "summary_1_month",
+    "summary_3_months"
+]
+
+# Where the tracking reference lives in each layout
+REFERENCE_FIELDS = {
+    "reference": "_id",
+    "tpid_reference": "_id.tracking_reference"
+}
+
+# Indexes made redundant by each cluster key
+REDUNDANT_INDEXES = {
+    "reference": ["tracking_reference_1"],
+    "tpid_reference": ["tpid_1_tracking_reference_1"]
+}
+
+# Scratch collection for the load test
+LOAD_TEST_COLLECTION = "_load_test"
+LOAD_TEST_REFERENCE_BASE = 900000001
+
+def create_clustered_collection(db, collection_name: str):
+    """Create an empty collection clustered on _id"""
+    return db.create_collection(collection_name, clusteredIndex={"key": {"_id": 1}, "unique": True})
+
+def to_clustered(document: Dict, cluster_key: str = DEFAULT_CLUSTER_KEY) -> Dict:
+    """Convert a standard parcel document to a clustered layout"""
+    clustered = {field: value for field, value in document.items()
+                 if field not in ("_id", "tracking_reference")}
+    if cluster_key == "reference":
+        clustered["_id"] = document["tracking_reference"]
+    else:
+        clustered["_id"] = {"tpid": document["tpid"], "tracking_reference": document["tracking_reference"]}
+    return {"_id": clustered.pop("_id"), **clustered}
+
+def clustered_index_specs(index_specs: List[Tuple], cluster_key: str = DEFAULT_CLUSTER_KEY) -> List[Tuple]:
+    """Drop the indexes the cluster key replaces and move tracking_reference to its _id path"""
+    reference_field = REFERENCE_FIELDS[cluster_key]
+    specs = []
+    for index_spec in index_specs:
+        if index_spec[0] in REDUNDANT_INDEXES[cluster_key]:
+            continue
+        key = [(reference_field if field == "tracking_reference" else field, direction)
+               for field, direction in index_spec[1]]
+        if key == index_spec[1]:
+            specs.append(index_spec)
+        else:
+            name = "_".join(f"{field}_{direction}" for field, direction in key)
+            specs.append((name, key) + tuple(index_spec[2:]))
+    return specs
+
+def parcel_filter(tracking_reference: str, tpid: Optional[int] = None,
+                  cluster_key: str = DEFAULT_CLUSTER_KEY) -> Dict:
+    """Point lookup of one parcel; with the TPID known the tpid_reference layout reads the cluster key"""
+    if cluster_key == "reference":
+        return {"_id": tracking_reference}
+    if tpid is not None:
+        return {"_id": {"tpid": tpid, "tracking_reference": tracking_reference}}
+    return {"_id.tracking_reference": tracking_reference}
+
+def tpid_filter(tpid: int, cluster_key: str = DEFAULT_CLUSTER_KEY) -> Dict:
+    """All parcels of a TPID; a bounded clustered scan in the tpid_reference layout"""
+    if cluster_key == "reference":
+        return {"tpid": tpid}
+    # Embedded documents compare field by field, so every {tpid, reference} of the TPID sorts in between
+    return {"_id": {"$gte": {"tpid": tpid, "tracking_reference": ""},
+                    "$lt": {"tpid": tpid + 1, "tracking_reference": ""}}}
+
+def existing_index_specs(collection) -> List[Tuple]:
+    """(name, key[, options]) specs of a collection's secondary indexes"""
+    specs = []
+    for name, info in collection.index_information().items():
+        if name == "_id_":
+            continue
+        key = [(field, int(direction)) for field, direction in info["key"]]
+        options = {"partialFilterExpression": info["partialFilterExpression"]} \
+            if "partialFilterExpression" in info else {}
+        specs.append((name, key, options) if options else (name, key))
+    return specs
+
+def _median_ms(query, repeats: int) -> float:
+    runs = []
+    for _ in range(repeats):
+        start_time = time.time()
+        query()
+        runs.append((time.time() - start_time) * 1000)
+    return statistics.median(runs)
+
+def _parcel_tpid(collection) -> Optional[int]:
+    document = collection.find_one({"tracking_reference": WORKLOAD_TRACKING_REFERENCE}, {"tpid": 1})
+    return document["tpid"] if document else None
+
+def measure_load(db, index_specs: List[Tuple], samples: List[Dict], num_docs: int,
+                 cluster_key: Optional[str] = None) -> float:
+    """Insert num_docs parcels into a scratch collection with the layout's indexes; returns docs/second"""
+    db.drop_collection(LOAD_TEST_COLLECTION)
+    collection = (create_clustered_collection(db, LOAD_TEST_COLLECTION) if cluster_key
+                  else db[LOAD_TEST_COLLECTION])
+    for index_spec in index_specs:
+        collection.create_index(index_spec[1], name=index_spec[0], **(index_spec[2] if len(index_spec) > 2 else {}))
+
+    documents = []
+    for i in range(num_docs):
+        document = {field: value for field, value in samples[i % len(samples)].items() if field != "_id"}
+        document["tracking_reference"] = f"NZ{LOAD_TEST_REFERENCE_BASE + i:09d}"
+        documents.append(to_clustered(document, cluster_key) if cluster_key else document)
+
+    try:
+        start_time = time.time()
+        for offset in range(0, num_docs, 10000):
+            collection.insert_many(documents[offset:offset + 10000], ordered=False)
+        elapsed = time.time() - start_time
+    finally:
+        db.drop_collection(LOAD_TEST_COLLECTION)
+    return num_docs / elapsed if elapsed > 0 else 0.0
+
+def _layout_report(collection, index_specs: List[Tuple], lookup: Dict, tpid_match: Dict,
+                   samples: List[Dict], load_docs: int, repeats: int, cluster_key: Optional[str]) -> Dict:
+    storage = collection_storage_stats(collection)
+    return {
+        "count": storage["count"],
+        "data_size": storage["data_size"],
+        "storage_size": storage["storage_size"],
+        "total_index_size": storage["total_index_size"],
+        "index_count": len(storage["index_sizes"]),
+        "inserts_per_second": measure_load(collection.database, index_specs, samples, load_docs, cluster_key)
+                              if load_docs else None,
+        "latency_ms": {
+            "parcel_lookup": _median_ms(lambda: collection.find_one(lookup), repeats),
+            "tpid_scan": _median_ms(lambda: list(collection.find(tpid_match, {"edifact_code": 1})), repeats)
+        }
+    }
+
+def compare_collection(client, collection_name: str, cluster_keys: List[str],
+                       load_docs: int = 100000, repeats: int = 5) -> Dict:
+    """Storage, load speed and lookup latency of one collection in the standard and clustered layouts"""
+    standard = client[STANDARD_DATABASE][collection_name]
+    index_specs = existing_index_specs(standard)
+    samples = list(standard.aggregate([{"$sample": {"size": 1000}}]))
+    tpid = _parcel_tpid(standard)
+    scan_tpid = WORKLOAD_TPIDS[-1]
+
+    report = {"standard": _layout_report(
+        standard, index_specs, {"tracking_reference": WORKLOAD_TRACKING_REFERENCE}, {"tpid": scan_tpid},
+        samples, load_docs, repeats, None)}
+    for cluster_key in cluster_keys:
+        collection = client[CLUSTERED_DATABASES[cluster_key]][collection_name]
+        report[cluster_key] = _layout_report(
+            collection, clustered_index_specs(index_specs, cluster_key),
+            parcel_filter(WORKLOAD_TRACKING_REFERENCE, tpid, cluster_key), tpid_filter(scan_tpid, cluster_key),
+            samples, load_docs, repeats, cluster_key)
+    return report
+
+def print_report(reports: Dict):
+    """Print each layout next to the standard layout"""
+    mb = 1048576
+    for collection_name, report in reports.items():
+        layouts = list(report)
+        print(f"\n===== {collection_name} =====")
+        print(f"{'':<24}" + "".join(f"{layout:>16}" for layout in layouts))
+        rows = [
+            ("Documents", "count", 1, ",.0f"),
+            ("Indexes", "index_count", 1, "d"),
+            ("Data size (MB)", "data_size", mb, ".1f"),
+            ("Storage size (MB)", "storage_size", mb, ".1f"),
+            ("Index size (MB)", "total_index_size", mb, ".1f"),
+            ("Inserts/second", "inserts_per_second", 1, ",.0f")
+        ]
+        for label, field, scale, fmt in rows:
+            values = [report[layout][field] for layout in layouts]
+            print(f"{label:<24}" + "".join(
+                f"{(value / scale if scale != 1 else value):>16{fmt}}" if value is not None else f"{'-':>16}"
+                for value in values))
+        for query in report["standard"]["latency_ms"]:
+            print(f"{query + ' (ms)':<24}" + "".join(
+                f"{report[layout]['latency_ms'][query]:>16.3f}" for layout in layouts))
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the clustered summary layouts with the standard layout")
+    parser.add_argument("--collection", action="append", choices=COLLECTIONS,
+                        help="Collection to compare (repeatable, default: all)")
+    parser.add_argument("--load-docs", type=int, default=100000,
+                        help="Documents inserted per layout for the load test (0 to skip)")
+    parser.add_argument("--repeats", type=int, default=5, help="Runs per query")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(MONGO_URI)
+    print(f"Connected to MongoDB at {MONGO_URI}")
+    try:
+        reports = {}
+        for collection_name in args.collection or COLLECTIONS:
+            cluster_keys = [key for key, db_name in CLUSTERED_DATABASES.items()
+                            if collection_name in client[db_name].list_collection_names()]
+            if not cluster_keys:
+                print(f"  {collection_name}: no clustered layout found - generate it with --schema clustered")
+                continue
+            print(f"  Comparing {collection_name}...")
+            reports[collection_name] = compare_collection(client, collection_name, cluster_keys,
+                                                          args.load_docs, args.repeats)
+        print_report(reports)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
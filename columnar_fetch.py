@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Columnar Batch Fetch for NZ Post Databases
+
+Pulls projected query results back as NumPy columns (or an Arrow table when
+pyarrow is installed) instead of one Python dict per document.
+
+Cursor batches are read with find_raw_batches, so pymongo never decodes them.
+The generators write every document with the same field order and fixed-width
+values (int32 codes, 8-byte datetimes, 11-character tracking references).
+Projected documents in a batch are therefore usually identical in layout, and
+the whole batch is decoded in one np.frombuffer call with a structured dtype
+built from the first document. Batches that do not fit that layout (missing
+fields, different lengths) fall back to bson.decode_all for that batch only,
+typed like the fast path (datetime64[ms], byte strings) so columns keep one dtype.
+
+Run this script to compare client-side status counts over columns and over
+dicts with the server-side $group.
+"""
+
+import argparse
+import bson
+import numpy as np
+import pymongo
+import struct
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# MongoDB connection parameters
+MONGO_URI = "mongodb://localhost:27017/"
+
+DEFAULT_BATCH_SIZE = 50000
+
+# BSON element types with a fixed-width value, and how NumPy reads them
+BSON_STRING = 0x02
+FIXED_WIDTH_TYPES = {
+    0x01: "<f8",  # double
+    0x08: "u1",   # boolean
+    0x09: "<i8",  # UTC datetime (milliseconds since epoch)
+    0x10: "<i4",  # int32
+    0x12: "<i8"   # int64
+}
+BSON_DATETIME = 0x09
+
+def _document_layout(batch: bytes, offset: int = 0) -> Optional[Tuple[int, List[Tuple]]]:
+    """Layout of the document at offset: (length, [(name, type, header offset, header size, value size)]).
+
+    Returns None when the document holds a type without a fixed-width decoding.
+    """
+    length = struct.unpack_from("<i", batch, offset)[0]
+    elements = []
+    position = offset + 4
+    end = offset + length - 1
+    while position < end:
+        header_start = position
+        element_type = batch[position]
+        name_end = batch.index(b"\x00", position + 1)
+        name = batch[position + 1:name_end].decode("utf-8")
+        position = name_end + 1
+        if element_type in FIXED_WIDTH_TYPES:
+            value_size = np.dtype(FIXED_WIDTH_TYPES[element_type]).itemsize
+        elif element_type == BSON_STRING:
+            value_size = 4 + struct.unpack_from("<i", batch, position)[0]
+        else:
+            return None
+        elements.append((name, element_type, header_start - offset, position - header_start, value_size))
+        position += value_size
+    return length, elements
+
+def _decode_fixed_layout(batch: bytes, fields: List[str]) -> Optional[Dict[str, np.ndarray]]:
+    """Decode a batch of identically laid out documents with one structured dtype, or return None"""
+    layout = _document_layout(batch)
+    if layout is None:
+        return None
+    length, elements = layout
+    if len(batch) % length:
+        return None
+    count = len(batch) // length
+
+    names, formats, offsets = ["_length"], ["<i4"], [0]
+    for name, element_type, header_offset, header_size, value_size in elements:
+        names.append(f"_header_{name}")
+        formats.append(f"V{header_size}")
+        offsets.append(header_offset)
+        value_offset = header_offset + header_size
+        if element_type == BSON_STRING:
+            names.extend([f"_strlen_{name}", name])
+            formats.extend(["<i4", f"S{value_size - 5}"])
+            offsets.extend([value_offset, value_offset + 4])
+        else:
+            names.append(name)
+            formats.append(FIXED_WIDTH_TYPES[element_type])
+            offsets.append(value_offset)
+    records = np.frombuffer(batch, dtype=np.dtype(
+        {"names": names, "formats": formats, "offsets": offsets, "itemsize": length}
+    ), count=count)
+
+    # Every document must have the first one's length, field names, types and string lengths
+    if not (records["_length"] == length).all():
+        return None
+    for name in names[1:]:
+        if name.startswith("_") and not (records[name] == records[name][0]).all():
+            return None
+
+    element_types = {name: element_type for name, element_type, _, _, _ in elements}
+    columns = {}
+    for field in fields:
+        if field not in element_types:
+            return None
+        column = records[field].copy()
+        if element_types[field] == BSON_DATETIME:
+            column = column.view("datetime64[ms]")
+        columns[field] = column
+    return columns
+
+def _generic_column(values: List) -> np.ndarray:
+    """Column of decoded values with the dtypes _decode_fixed_layout produces.
+
+    Datetimes become datetime64[ms] (missing ones NaT), strings UTF-8 byte strings
+    and booleans u1, so that np.concatenate with fixed-layout batches keeps one
+    dtype. Other columns with missing values stay object arrays of None.
+    """
+    present = [value for value in values if value is not None]
+    if present and isinstance(present[0], datetime):
+        return np.array(values, dtype="datetime64[ms]")
+    if not values or len(present) < len(values):
+        return np.array(values, dtype=object)
+    if isinstance(present[0], str):
+        return np.array([value.encode("utf-8") for value in values], dtype="S")
+    if isinstance(present[0], bool):
+        return np.array(values, dtype="u1")
+    return np.array(values)
+
+def _decode_generic(batch: bytes, fields: List[str]) -> Dict[str, np.ndarray]:
+    """Decode a batch through bson.decode_all"""
+    documents = bson.decode_all(batch)
+    return {field: _generic_column([document.get(field) for document in documents]) for field in fields}
+
+def _collect_columns(cursor, fields: List[str]) -> Dict[str, np.ndarray]:
+    """Decode every raw batch of a cursor and join the columns"""
+    parts = {field: [] for field in fields}
+    for batch in cursor:
+        columns = _decode_fixed_layout(batch, fields)
+        if columns is None:
+            columns = _decode_generic(batch, fields)
+        for field in fields:
+            parts[field].append(columns[field])
+    return {field: np.concatenate(chunks) if chunks else np.array([]) for field, chunks in parts.items()}
+
+def fetch_columns(collection, filter_doc: Dict, fields: List[str], batch_size: int = DEFAULT_BATCH_SIZE,
+                  hint=None) -> Dict[str, np.ndarray]:
+    """Fetch the given fields of all matching documents as NumPy columns"""
+    projection = {field: 1 for field in fields}
+    if "_id" not in fields:
+        projection["_id"] = 0
+    cursor = collection.find_raw_batches(filter_doc, projection, batch_size=batch_size)
+    if hint:
+        cursor = cursor.hint(hint)
+    return _collect_columns(cursor, fields)
+
+def aggregate_columns(collection, pipeline: List[Dict], fields: List[str],
+                      batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, np.ndarray]:
+    """Run an aggregation and return the given output fields as NumPy columns"""
+    cursor = collection.aggregate_raw_batches(pipeline, allowDiskUse=True, batchSize=batch_size)
+    return _collect_columns(cursor, fields)
+
+def columns_to_arrow(columns: Dict[str, np.ndarray]):
+    """Wrap NumPy columns in an Arrow table (requires pyarrow)"""
+    if pa is None:
+        raise ImportError("pyarrow is not installed")
+    return pa.table({field: pa.array(column) for field, column in columns.items()})
+
+def columns_nbytes(columns: Dict[str, np.ndarray]) -> int:
+    """Memory held by the column buffers"""
+    return sum(column.nbytes for column in columns.values())
+
+def client_status_counts(columns: Dict[str, np.ndarray]) -> Dict[int, int]:
+    """Count documents per edifact_code from the column"""
+    codes, counts = np.unique(columns["edifact_code"], return_counts=True)
+    return {int(code): int(count) for code, count in zip(codes, counts)}
+
+def benchmark_status_counts(collection, match_stage: Dict, hint=None) -> Dict:
+    """Compare per-status counts computed by $group, over columns and over dicts"""
+    results = {}
+
+    start_time = time.time()
+    rows = collection.aggregate([
+        {"$match": match_stage},
+        {"$group": {"_id": "$edifact_code", "count": {"$sum": 1}}}
+    ], allowDiskUse=True, **({"hint": hint} if hint else {}))
+    server_counts = {row["_id"]: row["count"] for row in rows}
+    results["server_group"] = {"time_ms": (time.time() - start_time) * 1000, "counts": server_counts}
+
+    tracemalloc.start()
+    start_time = time.time()
+    columns = fetch_columns(collection, match_stage, ["edifact_code"], hint=hint)
+    column_counts = client_status_counts(columns)
+    elapsed = (time.time() - start_time) * 1000
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    results["numpy_columns"] = {"time_ms": elapsed, "counts": column_counts, "peak_bytes": peak,
+                                "rows": len(columns["edifact_code"]),
+                                "bytes_per_row": columns_nbytes(columns) / max(1, len(columns["edifact_code"]))}
+
+    tracemalloc.start()
+    start_time = time.time()
+    cursor = collection.find(match_stage, {"edifact_code": 1, "_id": 0}, batch_size=DEFAULT_BATCH_SIZE)
+    if hint:
+        cursor = cursor.hint(hint)
+    documents = list(cursor)
+    dict_counts = dict(Counter(document["edifact_code"] for document in documents))
+    elapsed = (time.time() - start_time) * 1000
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    results["python_dicts"] = {"time_ms": elapsed, "counts": dict_counts, "peak_bytes": peak,
+                               "rows": len(documents),
+                               "bytes_per_row": peak / max(1, len(documents))}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare client-side columnar status counts with $group")
+    parser.add_argument("--database", default="nzpost_summary", choices=["nzpost_summary", "nzpost_summary_item"])
+    parser.add_argument("--collection", default="summary_1_week")
+    parser.add_argument("--tpid", type=int, action="append", help="TPID to count (repeatable, default: all)")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(MONGO_URI)
+    print(f"Connected to MongoDB at {MONGO_URI}")
+    try:
+        collection = client[args.database][args.collection]
+        match_stage = {"tpid": {"$in": args.tpid}} if args.tpid else {}
+        results = benchmark_status_counts(collection, match_stage)
+
+        print(f"\n===== Status counts: {args.database}.{args.collection} =====")
+        print(f"{'Method':<16}{'Time (ms)':>12}{'Peak memory (MB)':>18}{'Bytes/row':>12}")
+        for method, result in results.items():
+            peak = result.get("peak_bytes")
+            per_row = result.get("bytes_per_row")
+            print(f"{method:<16}{result['time_ms']:>12.2f}"
+                  f"{(peak / 1048576 if peak is not None else 0):>18.1f}"
+                  f"{(per_row if per_row is not None else 0):>12.1f}")
+        agree = results["numpy_columns"]["counts"] == results["server_group"]["counts"] == \
+            results["python_dicts"]["counts"]
+        print(f"\nCounts agree: {agree}")
+        print(f"Arrow output available: {pa is not None}")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Compact Schema for the NZ Post Summary Database
+
+The standard nzpost_summary documents store the tracking reference as an
+11-character "NZ%09d" string, repeat the status text in event_description and
+use long field names. The compact schema (database nzpost_summary_compact,
+written by Generate_Mongo_Test_Data_summary.py --schema compact) stores:
+- r: tracking reference number as int64
+- t: tpid
+- c: edifact_code
+- d: event_datetime
+The description is resolved from the edifact code on read.
+
+Run this script for a side-by-side report of data size, index size and query
+latency of the two schemas.
+"""
+
+import argparse
+import pymongo
+import statistics
+import time
+from bson.int64 import Int64
+from typing import Dict, List, Tuple
+from mongo_query_engine import (WORKLOAD_TPIDS, WORKLOAD_CODES, WORKLOAD_DATE_RANGE, WORKLOAD_TRACKING_REFERENCE,
+                                run_aggregate, collection_storage_stats)
+
+# MongoDB connection parameters
+MONGO_URI = "mongodb://localhost:27017/"
+
+STANDARD_DATABASE = "nzpost_summary"
+COMPACT_DATABASE = "nzpost_summary_compact"
+
+# Collection names
+COLLECTIONS = [
+    "summary_1_week",
+    "summary_2_weeks",
+    "summary_1_month",
+    "summary_3_months"
+]
+
+# Standard field name -> compact field name
+COMPACT_FIELDS = {
+    "tracking_reference": "r",
+    "tpid": "t",
+    "edifact_code": "c",
+    "event_datetime": "d"
+}
+STANDARD_FIELDS = {short: name for name, short in COMPACT_FIELDS.items()}
+
+# Descriptions resolved on read
+EVENT_DESCRIPTIONS = {
+    100: "Picked Up",
+    200: "In Transit",
+    300: "In Depot",
+    400: "Out for Delivery",
+    500: "Delivered",
+    600: "Attempted Delivery"
+}
+
+TRACKING_REFERENCE_PREFIX = "NZ"
+
+def reference_number(tracking_reference: str) -> int:
+    return int(tracking_reference[len(TRACKING_REFERENCE_PREFIX):])
+
+def reference_string(number: int) -> str:
+    return f"{TRACKING_REFERENCE_PREFIX}{number:09d}"
+
+def to_compact(document: Dict) -> Dict:
+    """Convert a standard parcel document to the compact schema"""
+    return {
+        "r": Int64(reference_number(document["tracking_reference"])),
+        "t": document["tpid"],
+        "c": document["edifact_code"],
+        "d": document["event_datetime"]
+    }
+
+def from_compact(document: Dict) -> Dict:
+    """Convert a compact document back to the standard field names, with the description"""
+    standard = {STANDARD_FIELDS.get(field, field): value for field, value in document.items()}
+    if "tracking_reference" in standard:
+        standard["tracking_reference"] = reference_string(standard["tracking_reference"])
+    if "edifact_code" in standard:
+        standard["event_description"] = EVENT_DESCRIPTIONS.get(standard["edifact_code"])
+    return standard
+
+def _compact_value(field: str, value):
+    """Translate a condition value on a standard field"""
+    if field != "tracking_reference":
+        return value
+    if isinstance(value, str):
+        return reference_number(value)
+    if isinstance(value, list):
+        return [_compact_value(field, item) for item in value]
+    if isinstance(value, dict):
+        return {op: _compact_value(field, operand) for op, operand in value.items()}
+    return value
+
+def compact_match(match_stage: Dict) -> Dict:
+    """Translate a standard match stage to compact field names and values"""
+    translated = {}
+    for field, condition in match_stage.items():
+        if field in ("$and", "$or"):
+            translated[field] = [compact_match(clause) for clause in condition]
+        else:
+            translated[COMPACT_FIELDS.get(field, field)] = _compact_value(field, condition)
+    return translated
+
+def compact_index_specs(index_specs: List[Tuple]) -> List[Tuple]:
+    """Translate (name, key[, options]) index specs to compact field names.
+
+    Specs on fields the compact schema does not store are left out.
+    """
+    specs = []
+    for index_spec in index_specs:
+        if any(field not in COMPACT_FIELDS for field, _ in index_spec[1]):
+            continue
+        key = [(COMPACT_FIELDS.get(field, field), direction) for field, direction in index_spec[1]]
+        name = "_".join(f"{field}_{direction}" for field, direction in key)
+        if index_spec[0].startswith("inflight_"):
+            name = f"inflight_{name}"
+        options = dict(index_spec[2]) if len(index_spec) > 2 else {}
+        if "partialFilterExpression" in options:
+            options["partialFilterExpression"] = compact_match(options["partialFilterExpression"])
+        specs.append((name, key, options) if options else (name, key))
+    return specs
+
+def _median_ms(query, repeats: int) -> float:
+    runs = []
+    for _ in range(repeats):
+        start_time = time.time()
+        query()
+        runs.append((time.time() - start_time) * 1000)
+    return statistics.median(runs)
+
+def compare_collection(client, collection_name: str, repeats: int = 3) -> Dict:
+    """Storage and latency of one collection in both schemas"""
+    date_from, date_to = WORKLOAD_DATE_RANGE
+    queries = {
+        "status_count": {"tpid": {"$in": WORKLOAD_TPIDS}, "edifact_code": {"$in": WORKLOAD_CODES}},
+        "status_date_range": {"tpid": {"$in": WORKLOAD_TPIDS}, "edifact_code": {"$in": WORKLOAD_CODES},
+                              "event_datetime": {"$gte": date_from, "$lte": date_to}},
+        "tpid_total": {"tpid": WORKLOAD_TPIDS[0]}
+    }
+
+    report = {}
+    for schema, db_name in (("standard", STANDARD_DATABASE), ("compact", COMPACT_DATABASE)):
+        collection = client[db_name][collection_name]
+        translate = compact_match if schema == "compact" else (lambda match: match)
+        storage = collection_storage_stats(collection)
+        latency = {
+            name: _median_ms(lambda m=translate(match): run_aggregate(
+                collection, [{"$match": m}, {"$count": "total"}]), repeats)
+            for name, match in queries.items()
+        }
+        lookup = translate({"tracking_reference": WORKLOAD_TRACKING_REFERENCE})
+        latency["parcel_lookup"] = _median_ms(lambda: collection.find_one(lookup), repeats)
+        report[schema] = {
+            "avg_document_size": storage["data_size"] / storage["count"] if storage["count"] else 0,
+            "data_size": storage["data_size"],
+            "storage_size": storage["storage_size"],
+            "total_index_size": storage["total_index_size"],
+            "reference_index_size": storage["index_sizes"].get(
+                "tracking_reference_1" if schema == "standard" else "r_1", 0),
+            "latency_ms": latency
+        }
+    return report
+
+def print_report(reports: Dict):
+    """Print the standard and compact figures side by side"""
+    mb = 1048576
+    for collection_name, report in reports.items():
+        standard, compact = report["standard"], report["compact"]
+        print(f"\n===== {collection_name} =====")
+        print(f"{'':<26}{'standard':>14}{'compact':>14}{'change':>10}")
+        rows = [
+            ("Avg document (bytes)", standard["avg_document_size"], compact["avg_document_size"], 1),
+            ("Data size (MB)", standard["data_size"], compact["data_size"], mb),
+            ("Storage size (MB)", standard["storage_size"], compact["storage_size"], mb),
+            ("Index size (MB)", standard["total_index_size"], compact["total_index_size"], mb),
+            ("Reference index (MB)", standard["reference_index_size"], compact["reference_index_size"], mb)
+        ]
+        rows += [(f"{name} (ms)", standard["latency_ms"][name], compact["latency_ms"][name], 1)
+                 for name in standard["latency_ms"]]
+        for label, before, after, scale in rows:
+            change = f"{(after - before) / before * 100:+.1f}%" if before else "-"
+            print(f"{label:<26}{before / scale:>14.1f}{after / scale:>14.1f}{change:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the standard and compact summary schemas")
+    parser.add_argument("--collection", action="append", choices=COLLECTIONS,
+                        help="Collection to compare (repeatable, default: all)")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per query")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(MONGO_URI)
+    print(f"Connected to MongoDB at {MONGO_URI}")
+    try:
+        existing = client[COMPACT_DATABASE].list_collection_names()
+        reports = {}
+        for collection_name in args.collection or COLLECTIONS:
+            if collection_name not in existing:
+                print(f"  {COMPACT_DATABASE}.{collection_name} not found - generate it with --schema compact")
+                continue
+            reports[collection_name] = compare_collection(client, collection_name, args.repeats)
+        print_report(reports)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
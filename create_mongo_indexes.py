@@ -7,12 +7,22 @@ This script creates the necessary indexes for:
 2. nzpost_summary_item - Item detail collections
 3. nzpost_summary_append - Time series collections
 
-All collections in each database will receive the appropriate indexes.
+All collections in each database will receive the appropriate indexes. Only
+indexes that are missing or whose key changed are built; each collection gets
+one createIndexes command and several collections build at the same time.
 """
 
+import argparse
 import pymongo
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
+from typing import Dict, List, Tuple
+from mongo_query_engine import collection_storage_stats, set_index_hidden, LATENESS_INDEX_NAME, LATENESS_INDEX_KEY
+from compact_schema import COMPACT_DATABASE, compact_index_specs
+from dataset_manifest import refresh_manifest_indexes
+from clustered_layout import CLUSTERED_DATABASES, CLUSTERED_ITEM_DATABASES, clustered_index_specs
+from item_split import SPLIT_DATABASE
 
 # MongoDB connection parameters
 MONGO_URI = "mongodb://localhost:27017/"
@@ -25,7 +35,217 @@ COLLECTIONS = [
     "summary_3_months"
 ]
 
-def create_indexes():
+# Status codes of parcels that have not been delivered yet (about half of all parcels)
+IN_FLIGHT_CODES = [100, 200, 300, 400, 600]
+IN_FLIGHT_FILTER = {"edifact_code": {"$in": IN_FLIGHT_CODES}}
+
+# Index specs are (name, key, options); options is optional
+# Regular collection indexes (nzpost_summary and nzpost_summary_item)
+REGULAR_INDEXES = [
+    ("tpid_1_edifact_code_1_event_datetime_1", [("tpid", 1), ("edifact_code", 1), ("event_datetime", 1)]),
+    ("tpid_1_edifact_code_1", [("tpid", 1), ("edifact_code", 1)]),
+    ("tpid_1_tracking_reference_1", [("tpid", 1), ("tracking_reference", 1)]),
+    ("tpid_1", [("tpid", 1)]),
+    ("event_datetime_1", [("event_datetime", 1)]),
+    ("tracking_reference_1", [("tracking_reference", 1)]),
+    # Suffix searches on the last digits of a tracking number
+    ("tracking_reference_reversed_1", [("tracking_reference_reversed", 1)]),
+    # Operational status queries skip the Delivered half of the collection
+    ("inflight_edifact_code_1_tpid_1_event_datetime_1",
+     [("edifact_code", 1), ("tpid", 1), ("event_datetime", 1)],
+     {"partialFilterExpression": IN_FLIGHT_FILTER})
+]
+
+# Drill-down facet indexes, nzpost_summary_item only (TPID first, status last for the status counts)
+ITEM_FACET_INDEXES = [
+    ("tpid_1_parcel_details.product.service_code_1_edifact_code_1",
+     [("tpid", 1), ("parcel_details.product.service_code", 1), ("edifact_code", 1)]),
+    ("tpid_1_parcel_details.Receiver_details.address.city_1_edifact_code_1",
+     [("tpid", 1), ("parcel_details.Receiver_details.address.city", 1), ("edifact_code", 1)]),
+    ("tpid_1_parcel_details.Receiver_details.address.postcode_1_edifact_code_1",
+     [("tpid", 1), ("parcel_details.Receiver_details.address.postcode", 1), ("edifact_code", 1)]),
+    ("tpid_1_parcel_details.product.is_rural_1_parcel_details.product.is_signature_required_1_edifact_code_1",
+     [("tpid", 1), ("parcel_details.product.is_rural", 1), ("parcel_details.product.is_signature_required", 1),
+      ("edifact_code", 1)]),
+    # About 2% of parcels are dangerous goods
+    ("dangerous_goods_tpid_1_edifact_code_1",
+     [("tpid", 1), ("edifact_code", 1)],
+     {"partialFilterExpression": {"parcel_details.product.is_dangerous_goods": True}}),
+    # Late-parcel report: overdue parcels seek by status and EDD, delivered lateness is a covered scan
+    (LATENESS_INDEX_NAME, LATENESS_INDEX_KEY)
+]
+ITEM_INDEXES = REGULAR_INDEXES + ITEM_FACET_INDEXES
+
+# Time series collection indexes (nzpost_summary_append)
+TIMESERIES_INDEXES = [
+    ("tpid_1", [("tpid", 1)]),
+    ("tracking_reference_1", [("tracking_reference", 1)]),
+    ("tracking_reference_reversed_1", [("tracking_reference_reversed", 1)]),
+    ("edifact_code_1", [("edifact_code", 1)]),
+    ("timestamp_1", [("timestamp", 1)]),
+    ("tpid_1_timestamp_1", [("tpid", 1), ("timestamp", 1)]),
+    ("tpid_1_edifact_code_1", [("tpid", 1), ("edifact_code", 1)]),
+    ("tracking_reference_1_timestamp_1", [("tracking_reference", 1), ("timestamp", 1)]),
+    # Latest event per parcel via DISTINCT_SCAN ($sort + $group/$first)
+    ("tracking_reference_1_timestamp_-1", [("tracking_reference", 1), ("timestamp", -1)])
+]
+
+# Compact schema indexes (same keys with short field names)
+COMPACT_INDEXES = compact_index_specs(REGULAR_INDEXES)
+
+# Index specs for each database
+DATABASE_INDEXES = {
+    "nzpost_summary": REGULAR_INDEXES,
+    "nzpost_summary_item": ITEM_INDEXES,
+    "nzpost_summary_append": TIMESERIES_INDEXES
+}
+
+# Alternative layouts, indexed only when they have been generated
+OPTIONAL_DATABASE_INDEXES = {
+    COMPACT_DATABASE: COMPACT_INDEXES,
+    # Slim event collections; parcel_details live in <collection>_details
+    SPLIT_DATABASE: REGULAR_INDEXES,
+    # Clustered on _id, without the indexes the cluster key replaces
+    **{db_name: clustered_index_specs(REGULAR_INDEXES, cluster_key)
+       for cluster_key, db_name in CLUSTERED_DATABASES.items()},
+    **{db_name: clustered_index_specs(ITEM_INDEXES, cluster_key)
+       for cluster_key, db_name in CLUSTERED_ITEM_DATABASES.items()}
+}
+
+# Collections building indexes at the same time
+MAX_PARALLEL_BUILDS = 4
+
+# Seconds between currentOp progress polls
+PROGRESS_POLL_SECONDS = 5
+
+def _normalise_key(key) -> List[Tuple[str, int]]:
+    """Key pattern as a list of (field, direction) with integer directions"""
+    return [(field, int(direction)) for field, direction in key]
+
+def index_options(index_spec: Tuple) -> Dict:
+    """createIndexes options of an index spec (e.g. partialFilterExpression)"""
+    return index_spec[2] if len(index_spec) > 2 else {}
+
+def _index_matches(existing: Dict, index_spec: Tuple) -> bool:
+    """Check whether an index_information() entry matches an index spec"""
+    if _normalise_key(existing["key"]) != _normalise_key(index_spec[1]):
+        return False
+    return existing.get("partialFilterExpression") == index_options(index_spec).get("partialFilterExpression")
+
+def diff_indexes(collection, desired: List[Tuple]) -> Tuple[List[Tuple], List[str]]:
+    """Compare the desired specs with index_information().
+
+    Returns the specs that are missing or changed, and the names of existing
+    indexes whose key or partial filter differs from the spec and must be
+    dropped first. Indexes that are not in the spec are left alone.
+    """
+    existing = collection.index_information()
+    to_create, to_drop = [], []
+    for index_spec in desired:
+        index_name = index_spec[0]
+        if index_name not in existing:
+            to_create.append(index_spec)
+        elif not _index_matches(existing[index_name], index_spec):
+            to_drop.append(index_name)
+            to_create.append(index_spec)
+    return to_create, to_drop
+
+def build_collection_indexes(client, db_name: str, collection_name: str, desired: List[Tuple]) -> Dict:
+    """Create the missing or changed indexes of one collection in a single createIndexes command"""
+    db = client[db_name]
+    collection = db[collection_name]
+    to_create, to_drop = diff_indexes(collection, desired)
+    result = {
+        "database": db_name,
+        "collection": collection_name,
+        "created": [index_spec[0] for index_spec in to_create],
+        "rebuilt": to_drop,
+        "skipped": len(desired) - len(to_create),
+        "build_seconds": 0.0,
+        "index_sizes": {},
+        "error": None
+    }
+
+    try:
+        for index_name in to_drop:
+            collection.drop_index(index_name)
+
+        if to_create:
+            # All indexes in one command are built together in a single collection scan
+            start_time = time.time()
+            db.command("createIndexes", collection_name, indexes=[
+                {"key": dict(index_spec[1]), "name": index_spec[0], **index_options(index_spec)}
+                for index_spec in to_create
+            ])
+            result["build_seconds"] = time.time() - start_time
+
+        # The manifest's index list dates from generation, before these builds
+        refresh_manifest_indexes(db, collection_name)
+        sizes = collection_storage_stats(collection)["index_sizes"]
+        result["index_sizes"] = {index_spec[0]: sizes.get(index_spec[0], 0) for index_spec in desired}
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+def poll_index_builds(client) -> List[Dict]:
+    """Return the progress of the index builds currently running on the server"""
+    builds = client.admin.aggregate([
+        {"$currentOp": {"allUsers": True, "idleConnections": False}},
+        {"$match": {"command.createIndexes": {"$exists": True}}}
+    ])
+    return [{
+        "ns": op.get("ns"),
+        "indexes": [index.get("name") for index in op.get("command", {}).get("indexes", [])],
+        "msg": op.get("msg", ""),
+        "done": op.get("progress", {}).get("done"),
+        "total": op.get("progress", {}).get("total"),
+        "seconds": op.get("secs_running", 0)
+    } for op in builds]
+
+def build_indexes(client, targets: List[Tuple[str, str, List[Tuple]]],
+                  max_workers: int = MAX_PARALLEL_BUILDS) -> List[Dict]:
+    """Build indexes for several (database, collection, specs) targets concurrently"""
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(build_collection_indexes, client, db_name, collection_name, desired)
+                   for db_name, collection_name, desired in targets]
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=PROGRESS_POLL_SECONDS)
+            for future in done:
+                result = future.result()
+                results.append(result)
+                status = f"error: {result['error']}" if result["error"] else (
+                    f"{len(result['created'])} built in {result['build_seconds']:.2f}s, "
+                    f"{result['skipped']} already present")
+                print(f"  {result['database']}.{result['collection']}: {status}")
+            if pending:
+                try:
+                    for build in poll_index_builds(client):
+                        progress = (f"{build['done']:,}/{build['total']:,}"
+                                    if build["done"] is not None and build["total"] else "")
+                        print(f"    ... {build['ns']} {build['msg']} {progress} ({build['seconds']}s)")
+                except pymongo.errors.PyMongoError:
+                    pass
+    return results
+
+def print_build_report(results: List[Dict]):
+    """Print build time and final size for every index in the spec"""
+    print("\n===== Index Build Report =====")
+    for result in sorted(results, key=lambda r: (r["database"], r["collection"])):
+        print(f"\n{result['database']}.{result['collection']}")
+        if result["error"]:
+            print(f"  Error: {result['error']}")
+            continue
+        for index_name, size in result["index_sizes"].items():
+            if index_name in result["created"]:
+                action = "rebuilt" if index_name in result["rebuilt"] else "built"
+                timing = f"{action} in {result['build_seconds']:.2f}s (shared build)"
+            else:
+                timing = "already present"
+            print(f"  - {index_name:<40} {size / 1048576:>9.1f} MB  {timing}")
+
+def create_indexes(max_workers: int = MAX_PARALLEL_BUILDS):
     """Create all required indexes for the NZ Post MongoDB databases"""
     
     client = pymongo.MongoClient(MONGO_URI)
@@ -34,12 +254,16 @@ def create_indexes():
     # Start time tracking
     start_time = time.time()
     
-    # Create indexes for regular collections (nzpost_summary and nzpost_summary_item)
-    create_regular_indexes(client, "nzpost_summary")
-    create_regular_indexes(client, "nzpost_summary_item")
-    
-    # Create indexes for time series collections (nzpost_summary_append)
-    create_timeseries_indexes(client, "nzpost_summary_append")
+    targets = [(db_name, collection_name, desired)
+               for db_name, desired in DATABASE_INDEXES.items()
+               for collection_name in COLLECTIONS]
+    for db_name, desired in OPTIONAL_DATABASE_INDEXES.items():
+        existing = client[db_name].list_collection_names()
+        targets += [(db_name, collection_name, desired)
+                    for collection_name in COLLECTIONS if collection_name in existing]
+    print(f"\nBuilding indexes for {len(targets)} collections ({max_workers} at a time)...")
+    results = build_indexes(client, targets, max_workers=max_workers)
+    print_build_report(results)
     
     # Print completion time
     end_time = time.time()
@@ -52,60 +276,26 @@ def create_regular_indexes(client, db_name):
     """Create indexes for regular collections (nzpost_summary and nzpost_summary_item)"""
     
     print(f"\nCreating indexes for {db_name}...")
-    db = client[db_name]
-    
-    # Regular collection indexes
-    regular_indexes = [
-        ("tpid_1_edifact_code_1_event_datetime_1", [("tpid", 1), ("edifact_code", 1), ("event_datetime", 1)]),
-        ("tpid_1_edifact_code_1", [("tpid", 1), ("edifact_code", 1)]),
-        ("tpid_1_tracking_reference_1", [("tpid", 1), ("tracking_reference", 1)]),
-        ("tpid_1", [("tpid", 1)]),
-        ("event_datetime_1", [("event_datetime", 1)]),
-        ("tracking_reference_1", [("tracking_reference", 1)])
-    ]
-    
-    # Create indexes for each collection
-    for collection_name in COLLECTIONS:
-        collection = db[collection_name]
-        
-        print(f"  Creating indexes for {collection_name}...")
-        for index_name, index_fields in regular_indexes:
-            print(f"    - Creating index: {index_name}")
-            collection.create_index(index_fields, name=index_name)
-        
-        # Verify indexes were created
-        index_info = collection.index_information()
-        print(f"  Created {len(index_info) - 1} indexes for {collection_name}")  # -1 for _id index
+    desired = DATABASE_INDEXES.get(db_name, REGULAR_INDEXES)
+    return build_indexes(client, [(db_name, collection_name, desired) for collection_name in COLLECTIONS])
 
 def create_timeseries_indexes(client, db_name):
     """Create indexes for time series collections (nzpost_summary_append)"""
     
     print(f"\nCreating indexes for time series database {db_name}...")
-    db = client[db_name]
-    
-    # Time series collection indexes
-    timeseries_indexes = [
-        ("tpid_1", [("tpid", 1)]),
-        ("tracking_reference_1", [("tracking_reference", 1)]),
-        ("edifact_code_1", [("edifact_code", 1)]),
-        ("timestamp_1", [("timestamp", 1)]),
-        ("tpid_1_timestamp_1", [("tpid", 1), ("timestamp", 1)]),
-        ("tpid_1_edifact_code_1", [("tpid", 1), ("edifact_code", 1)]),
-        ("tracking_reference_1_timestamp_1", [("tracking_reference", 1), ("timestamp", 1)])
-    ]
-    
-    # Create indexes for each collection
-    for collection_name in COLLECTIONS:
-        collection = db[collection_name]
-        
-        print(f"  Creating indexes for {collection_name}...")
-        for index_name, index_fields in timeseries_indexes:
-            print(f"    - Creating index: {index_name}")
-            collection.create_index(index_fields, name=index_name)
-        
-        # Verify indexes were created
-        index_info = collection.index_information()
-        print(f"  Created {len(index_info) - 1} indexes for {collection_name}")  # -1 for _id index
+    return build_indexes(client, [(db_name, collection_name, TIMESERIES_INDEXES) for collection_name in COLLECTIONS])
+
+def set_hidden(client, index_name: str, hidden: bool, databases: List[str] = None, collections: List[str] = None):
+    """Hide or unhide an index on every selected collection that has it"""
+    action = "Hiding" if hidden else "Unhiding"
+    for db_name in databases or list(DATABASE_INDEXES):
+        for collection_name in collections or COLLECTIONS:
+            collection = client[db_name][collection_name]
+            if index_name not in collection.index_information():
+                continue
+            print(f"  {action} {index_name} on {db_name}.{collection_name}")
+            set_index_hidden(collection, index_name, hidden)
+            refresh_manifest_indexes(client[db_name], collection_name)
 
 def print_index_summary(client):
     """Print a summary of all created indexes"""
@@ -127,7 +317,8 @@ def print_index_summary(client):
             for index_name, index_info in indexes.items():
                 if index_name != "_id_":  # Skip the default _id index
                     key_pattern = ", ".join([f"{k[0]}: {k[1]}" for k in index_info["key"]])
-                    print(f"    - {index_name}: {key_pattern}")
+                    hidden = " (hidden)" if index_info.get("hidden") else ""
+                    print(f"    - {index_name}: {key_pattern}{hidden}")
             
             print("")
 
@@ -136,8 +327,24 @@ if __name__ == "__main__":
     print("===========================================")
     print(f"Script execution started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
+    parser = argparse.ArgumentParser(description="Create the NZ Post indexes that are missing or changed")
+    parser.add_argument("--parallel", type=int, default=MAX_PARALLEL_BUILDS,
+                        help="Collections building indexes at the same time")
+    parser.add_argument("--hide", metavar="INDEX", help="Hide an index from the query planner instead of building")
+    parser.add_argument("--unhide", metavar="INDEX", help="Make a hidden index visible again instead of building")
+    parser.add_argument("--database", action="append", choices=list(DATABASE_INDEXES),
+                        help="Database for --hide/--unhide (repeatable, default: all)")
+    parser.add_argument("--collection", action="append", choices=COLLECTIONS,
+                        help="Collection for --hide/--unhide (repeatable, default: all)")
+    args = parser.parse_args()
+    
     try:
-        create_indexes()
+        if args.hide or args.unhide:
+            client = pymongo.MongoClient(MONGO_URI)
+            set_hidden(client, args.hide or args.unhide, bool(args.hide), args.database, args.collection)
+            client.close()
+        else:
+            create_indexes(max_workers=args.parallel)
         
         # Uncomment to print detailed index summary
         # client = pymongo.MongoClient(MONGO_URI)
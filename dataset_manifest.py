@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Dataset Manifest for NZ Post Databases
+
+Each generator finishes a collection by writing one document to the `_manifest`
+collection of its database describing what it generated:
+1. Parcel and event counts, overall and per TPID and status
+2. Min/max event timestamps
+3. The indexes on the collection
+4. The random seed, generator configuration and generation time
+
+The GUI and command line tools read the manifest instead of hardcoding
+collection sizes, date ranges and index lists, and use it to answer unfiltered
+totals without scanning. A manifest is only trusted while the collection still
+matches it (same document count, or same newest event for time series).
+
+Run this script to (re)build manifests for data generated before the
+generators wrote them, or with --show to print the stored manifests.
+"""
+
+import argparse
+import pymongo
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# MongoDB connection parameters
+MONGO_URI = "mongodb://localhost:27017/"
+
+# Databases and collection names
+DATABASES = ["nzpost_summary", "nzpost_summary_item", "nzpost_summary_append"]
+COLLECTIONS = [
+    "summary_1_week",
+    "summary_2_weeks",
+    "summary_1_month",
+    "summary_3_months"
+]
+
+MANIFEST_COLLECTION = "_manifest"
+
+def _is_time_series(db, collection_name: str) -> bool:
+    """Check whether a collection is a time series collection"""
+    return "timeseries" in db[collection_name].options()
+
+def _time_bounds(collection, time_field: str):
+    """Oldest and newest event time using the time field index"""
+    bounds = []
+    for direction in (1, -1):
+        first = list(collection.find({}, {time_field: 1, "_id": 0}).sort(time_field, direction).limit(1))
+        bounds.append(first[0][time_field] if first else None)
+    return bounds
+
+def _count_rows(collection, pipeline: List[Dict]) -> Dict:
+    """Run a pipeline that groups by {tpid, edifact_code} and return {(tpid, code): count}"""
+    return {(row["_id"]["tpid"], row["_id"]["edifact_code"]): row["count"]
+            for row in collection.aggregate(pipeline, allowDiskUse=True)}
+
+def index_entries(collection) -> List[Dict]:
+    """Name, key, partial filter and hidden flag of every index of a collection"""
+    return [{"name": name, "key": [list(k) for k in info["key"]], "partial": info.get("partialFilterExpression"),
+             "hidden": info.get("hidden", False)}
+            for name, info in collection.index_information().items()]
+
+def build_manifest(db, collection_name: str, seed: Optional[int] = None, config: Optional[Dict] = None) -> Dict:
+    """Describe a generated collection and store the result in _manifest"""
+    start_time = time.time()
+    collection = db[collection_name]
+    time_series = _is_time_series(db, collection_name)
+    time_field = "timestamp" if time_series else "event_datetime"
+
+    events = _count_rows(collection, [
+        {"$group": {"_id": {"tpid": "$tpid", "edifact_code": "$edifact_code"}, "count": {"$sum": 1}}}
+    ])
+    if time_series:
+        # A parcel's status is its latest event
+        parcels = _count_rows(collection, [
+            {"$group": {
+                "_id": "$tracking_reference",
+                "latest": {"$top": {"sortBy": {"timestamp": -1},
+                                    "output": {"tpid": "$tpid", "edifact_code": "$edifact_code"}}}
+            }},
+            {"$group": {"_id": {"tpid": "$latest.tpid", "edifact_code": "$latest.edifact_code"},
+                        "count": {"$sum": 1}}}
+        ])
+    else:
+        parcels = events
+
+    tpids = {}
+    for (tpid, code), count in parcels.items():
+        entry = tpids.setdefault(tpid, {"tpid": tpid, "parcels": 0, "events": 0, "statuses": {}})
+        entry["parcels"] += count
+        entry["statuses"][str(code)] = count
+    for (tpid, _), count in events.items():
+        tpids.setdefault(tpid, {"tpid": tpid, "parcels": 0, "events": 0, "statuses": {}})["events"] += count
+
+    statuses = {}
+    for (_, code), count in parcels.items():
+        statuses[str(code)] = statuses.get(str(code), 0) + count
+
+    min_time, max_time = _time_bounds(collection, time_field)
+    manifest = {
+        "_id": collection_name,
+        "database": db.name,
+        "layout": "timeseries" if time_series else "regular",
+        "time_field": time_field,
+        "parcels": sum(parcels.values()),
+        "events": sum(events.values()),
+        "statuses": statuses,
+        "tpids": sorted(tpids.values(), key=lambda t: (-t["parcels"], t["tpid"])),
+        "min_time": min_time,
+        "max_time": max_time,
+        "indexes": index_entries(collection),
+        "seed": seed,
+        "config": config,
+        "generated_at": datetime.now(),
+        "build_seconds": time.time() - start_time
+    }
+    db[MANIFEST_COLLECTION].replace_one({"_id": collection_name}, manifest, upsert=True)
+
+    print(f"  {db.name}.{collection_name}: manifest with {manifest['parcels']:,} parcels, "
+          f"{manifest['events']:,} events, {len(manifest['tpids'])} TPIDs")
+    return manifest
+
+def refresh_manifest_indexes(db, collection_name: str) -> bool:
+    """Rewrite a manifest's index list; indexes are built after the generator writes the manifest"""
+    result = db[MANIFEST_COLLECTION].update_one(
+        {"_id": collection_name},
+        {"$set": {"indexes": index_entries(db[collection_name]), "indexes_updated_at": datetime.now()}})
+    return result.matched_count > 0
+
+def get_manifest(db, collection_name: str) -> Optional[Dict]:
+    """Return the stored manifest of a collection, or None"""
+    return db[MANIFEST_COLLECTION].find_one({"_id": collection_name})
+
+def load_manifests(db) -> Dict[str, Dict]:
+    """Return {collection name: manifest} for every manifest in a database"""
+    return {manifest["_id"]: manifest for manifest in db[MANIFEST_COLLECTION].find()}
+
+def is_manifest_current(db, manifest: Optional[Dict]) -> bool:
+    """Check that the collection still holds the documents the manifest counted.
+
+    Counting a time series collection unpacks every bucket, so for those the
+    newest event time is compared instead; they are only ever appended to.
+    """
+    if not manifest:
+        return False
+    collection = db[manifest["_id"]]
+    if manifest["layout"] == "timeseries":
+        return _time_bounds(collection, manifest["time_field"])[1] == manifest["max_time"]
+    return collection.estimated_document_count() == manifest["events"]
+
+def manifest_total(manifest: Dict, tpids: Optional[List[int]] = None, codes: Optional[List[int]] = None) -> int:
+    """Parcel count for optional TPIDs and latest statuses, read from the manifest.
+
+    None means no filter; an empty list selects nothing and counts 0.
+    """
+    total = 0
+    for entry in manifest["tpids"]:
+        if tpids is not None and entry["tpid"] not in tpids:
+            continue
+        if codes is not None:
+            total += sum(entry["statuses"].get(str(code), 0) for code in codes)
+        else:
+            total += entry["parcels"]
+    return total
+
+def manifest_tpid_parcels(manifest: Dict, tpid: int) -> Optional[int]:
+    """Parcels of one TPID in the collection, or None when it has none"""
+    for entry in manifest["tpids"]:
+        if entry["tpid"] == tpid:
+            return entry["parcels"]
+    return None
+
+def manifest_index_names(manifest: Dict) -> List[str]:
+    """Names of the indexes recorded in the manifest"""
+    return [index["name"] for index in manifest["indexes"]]
+
+def print_manifest(manifest: Dict):
+    """Print a manifest in a readable form"""
+    print(f"\n{manifest['database']}.{manifest['_id']} ({manifest['layout']})")
+    print(f"  Parcels: {manifest['parcels']:,}  Events: {manifest['events']:,}")
+    print(f"  {manifest['time_field']}: {manifest['min_time']} to {manifest['max_time']}")
+    print("  Statuses: " + ", ".join(f"{code}={count:,}" for code, count in sorted(manifest["statuses"].items())))
+    print(f"  TPIDs: {len(manifest['tpids'])} (largest: " +
+          ", ".join(f"{t['tpid']}={t['parcels']:,}" for t in manifest["tpids"][:5]) + ")")
+    print(f"  Indexes: {', '.join(manifest_index_names(manifest))}")
+    print(f"  Seed: {manifest['seed']}  Generated: {manifest['generated_at']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or show the dataset manifests")
+    parser.add_argument("--database", action="append", choices=DATABASES,
+                        help="Database to process (repeatable, default: all)")
+    parser.add_argument("--show", action="store_true", help="Print the stored manifests instead of rebuilding")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(MONGO_URI)
+    print(f"Connected to MongoDB at {MONGO_URI}")
+    try:
+        for db_name in args.database or DATABASES:
+            db = client[db_name]
+            if args.show:
+                for manifest in load_manifests(db).values():
+                    print_manifest(manifest)
+                    if not is_manifest_current(db, manifest):
+                        print("  Warning: collection size no longer matches the manifest")
+                continue
+            print(f"\nBuilding manifests for {db_name}...")
+            existing = db.list_collection_names()
+            for collection_name in COLLECTIONS:
+                if collection_name in existing:
+                    previous = get_manifest(db, collection_name) or {}
+                    build_manifest(db, collection_name, seed=previous.get("seed"), config=previous.get("config"))
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Index-Set A/B Experiment Runner for NZ Post Databases
+
+Applies named candidate index sets to one collection in turn and, for each set,
+measures:
+1. Build time per index
+2. Index storage size
+3. Latency of the standard benchmark workload (planner's choice, no hints)
+4. Insert throughput with that set of indexes maintained
+
+The collection's original indexes are restored when the experiment finishes
+(unless --keep is given), and the results are stored in `index_experiments`.
+
+With --what-if-hidden INDEX the indexes are left as they are; instead the
+workload is replayed with that index hidden from the planner and the latency
+change is reported next to the storage and cache the index uses.
+"""
+
+import argparse
+import pymongo
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+from create_mongo_indexes import MONGO_URI, REGULAR_INDEXES, TIMESERIES_INDEXES, index_options
+from mongo_query_engine import is_time_series, run_workload, collection_storage_stats, what_if_hidden
+
+def _select(indexes: List[Tuple], names: List[str]) -> List[Tuple]:
+    """Pick named index specs out of a full index list"""
+    return [index_spec for index_spec in indexes if index_spec[0] in names]
+
+# Candidate index sets for nzpost_summary and nzpost_summary_item
+REGULAR_INDEX_SETS = {
+    "current": REGULAR_INDEXES,
+    # tpid_1 and tpid_1_edifact_code_1 are prefixes of tpid_1_edifact_code_1_event_datetime_1
+    "no_prefix_duplicates": _select(REGULAR_INDEXES, [
+        "tpid_1_edifact_code_1_event_datetime_1",
+        "tpid_1_tracking_reference_1",
+        "event_datetime_1",
+        "tracking_reference_1"
+    ]),
+    "minimal": _select(REGULAR_INDEXES, [
+        "tpid_1_edifact_code_1_event_datetime_1",
+        "tpid_1_tracking_reference_1"
+    ]),
+    # minimal plus the partial index for in-flight parcels
+    "minimal_inflight": _select(REGULAR_INDEXES, [
+        "tpid_1_edifact_code_1_event_datetime_1",
+        "tpid_1_tracking_reference_1",
+        "inflight_edifact_code_1_tpid_1_event_datetime_1"
+    ])
+}
+
+# Candidate index sets for nzpost_summary_append
+TIMESERIES_INDEX_SETS = {
+    "current": TIMESERIES_INDEXES,
+    # tpid_1 and tracking_reference_1 are prefixes of the compound indexes
+    "no_prefix_duplicates": _select(TIMESERIES_INDEXES, [
+        "edifact_code_1",
+        "timestamp_1",
+        "tpid_1_timestamp_1",
+        "tpid_1_edifact_code_1",
+        "tracking_reference_1_timestamp_1",
+        "tracking_reference_1_timestamp_-1"
+    ]),
+    "latest_event": _select(TIMESERIES_INDEXES, [
+        "tpid_1_timestamp_1",
+        "tracking_reference_1_timestamp_-1"
+    ])
+}
+
+EXPERIMENT_RESULTS_COLLECTION = "index_experiments"
+EXPERIMENT_REFERENCE_PREFIX = "EXP"
+DEFAULT_INSERT_DOCS = 10000
+
+def snapshot_indexes(collection) -> Dict[str, Dict]:
+    """Record the collection's secondary indexes so they can be restored"""
+    return {name: info for name, info in collection.index_information().items() if name != "_id_"}
+
+def drop_secondary_indexes(collection):
+    """Drop every index except _id"""
+    for name in list(snapshot_indexes(collection)):
+        collection.drop_index(name)
+
+def restore_indexes(collection, snapshot: Dict[str, Dict]):
+    """Recreate the recorded indexes with their original options"""
+    drop_secondary_indexes(collection)
+    for name, info in snapshot.items():
+        options = {k: v for k, v in info.items() if k not in ("key", "v", "ns")}
+        collection.create_index(info["key"], name=name, **options)
+
+def apply_index_set(collection, index_set: List[Tuple]) -> Dict[str, float]:
+    """Replace the secondary indexes with an index set and return build seconds per index"""
+    drop_secondary_indexes(collection)
+    build_times = {}
+    for index_spec in index_set:
+        index_name = index_spec[0]
+        start_time = time.time()
+        collection.create_index(index_spec[1], name=index_name, **index_options(index_spec))
+        build_times[index_name] = time.time() - start_time
+        print(f"    - Built {index_name} in {build_times[index_name]:.2f}s")
+    return build_times
+
+def measure_insert_throughput(collection, num_docs: int) -> float:
+    """Insert copies of sampled documents under throwaway tracking references, then remove them"""
+    if num_docs <= 0:
+        return 0.0
+    samples = list(collection.aggregate([{"$sample": {"size": min(num_docs, 1000)}}]))
+    if not samples:
+        return 0.0
+
+    documents = []
+    for i in range(num_docs):
+        document = dict(samples[i % len(samples)])
+        document.pop("_id", None)
+        document["tracking_reference"] = f"{EXPERIMENT_REFERENCE_PREFIX}{i:09d}"
+        documents.append(document)
+
+    start_time = time.time()
+    collection.insert_many(documents, ordered=False)
+    elapsed = time.time() - start_time
+
+    collection.delete_many({"tracking_reference": {"$regex": f"^{EXPERIMENT_REFERENCE_PREFIX}"}})
+    return num_docs / elapsed if elapsed > 0 else 0.0
+
+def run_experiment(collection, set_names: List[str], repeats: int, insert_docs: int, keep: bool = False) -> Dict:
+    """Apply each index set in turn and measure it"""
+    index_sets = TIMESERIES_INDEX_SETS if is_time_series(collection) else REGULAR_INDEX_SETS
+    original = snapshot_indexes(collection)
+    results = {}
+
+    try:
+        for set_name in set_names:
+            print(f"\n  Index set: {set_name}")
+            build_times = apply_index_set(collection, index_sets[set_name])
+            storage = collection_storage_stats(collection)
+            workload = run_workload(collection, repeats=repeats)
+            throughput = measure_insert_throughput(collection, insert_docs)
+            results[set_name] = {
+                "indexes": [index_spec[0] for index_spec in index_sets[set_name]],
+                "build_seconds": build_times,
+                "total_build_seconds": sum(build_times.values()),
+                "total_index_size": storage["total_index_size"],
+                "index_sizes": storage["index_sizes"],
+                "workload": workload,
+                "inserts_per_second": throughput
+            }
+    finally:
+        if not keep:
+            print("\n  Restoring original indexes...")
+            restore_indexes(collection, original)
+
+    return results
+
+def print_report(db_name: str, collection_name: str, results: Dict):
+    """Print a side-by-side comparison of the index sets"""
+    set_names = list(results)
+    width = max(16, *(len(name) + 2 for name in set_names))
+
+    print(f"\n===== Index Experiment: {db_name}.{collection_name} =====")
+    print(f"{'':<26}" + "".join(f"{name:>{width}}" for name in set_names))
+    print(f"{'Indexes':<26}" + "".join(f"{len(results[n]['indexes']):>{width}}" for n in set_names))
+    print(f"{'Build time (s)':<26}" + "".join(f"{results[n]['total_build_seconds']:>{width}.2f}" for n in set_names))
+    print(f"{'Index size (MB)':<26}" + "".join(
+        f"{results[n]['total_index_size'] / 1048576:>{width}.1f}" for n in set_names))
+    print(f"{'Inserts/s':<26}" + "".join(f"{results[n]['inserts_per_second']:>{width},.0f}" for n in set_names))
+
+    for query in results[set_names[0]]["workload"]:
+        cells = []
+        for name in set_names:
+            run = results[name]["workload"][query]
+            cells.append(f"{'error':>{width}}" if run["error"] else f"{run['median_ms']:>{width}.2f}")
+        print(f"{query + ' (ms)':<26}" + "".join(cells))
+
+def print_what_if_report(db_name: str, collection_name: str, result: Dict):
+    """Print workload latency with the index visible and hidden"""
+    print(f"\n===== What-if hidden: {result['index']} on {db_name}.{collection_name} =====")
+    print(f"Index size: {result['index_size'] / 1048576:.1f} MB, "
+          f"in cache: {result['index_cache_bytes'] / 1048576:.1f} MB")
+    print(f"{'Query':<26}{'Visible (ms)':>14}{'Hidden (ms)':>14}{'Delta (ms)':>14}")
+    for query, run in result["queries"].items():
+        if run["error"]:
+            print(f"{query:<26}  error: {run['error']}")
+            continue
+        print(f"{query:<26}{run['visible_ms']:>14.2f}{run['hidden_ms']:>14.2f}{run['delta_ms']:>+14.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare candidate index sets on one collection")
+    parser.add_argument("--database", default="nzpost_summary",
+                        choices=["nzpost_summary", "nzpost_summary_item", "nzpost_summary_append"])
+    parser.add_argument("--collection", default="summary_1_week")
+    parser.add_argument("--sets", nargs="+", help="Index sets to compare (default: all for the collection type)")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per workload query")
+    parser.add_argument("--insert-docs", type=int, default=DEFAULT_INSERT_DOCS,
+                        help="Documents inserted to measure write throughput")
+    parser.add_argument("--keep", action="store_true", help="Leave the last index set in place")
+    parser.add_argument("--what-if-hidden", metavar="INDEX",
+                        help="Compare the workload with this index hidden instead of swapping index sets")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(MONGO_URI)
+    print(f"Connected to MongoDB at {MONGO_URI}")
+    db = client[args.database]
+    collection = db[args.collection]
+
+    if args.what_if_hidden:
+        try:
+            result = what_if_hidden(collection, args.what_if_hidden, repeats=args.repeats)
+            print_what_if_report(args.database, args.collection, result)
+            db[EXPERIMENT_RESULTS_COLLECTION].insert_one({
+                "collection": args.collection,
+                "run_at": datetime.now(),
+                "what_if_hidden": result
+            })
+        finally:
+            client.close()
+        return
+
+    index_sets = TIMESERIES_INDEX_SETS if is_time_series(collection) else REGULAR_INDEX_SETS
+    set_names = args.sets or list(index_sets)
+    unknown = [name for name in set_names if name not in index_sets]
+    if unknown:
+        parser.error(f"Unknown index sets {unknown}; choose from {list(index_sets)}")
+
+    try:
+        results = run_experiment(collection, set_names, args.repeats, args.insert_docs, keep=args.keep)
+        print_report(args.database, args.collection, results)
+        db[EXPERIMENT_RESULTS_COLLECTION].insert_one({
+            "collection": args.collection,
+            "run_at": datetime.now(),
+            "results": results
+        })
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Vertical Split of the NZ Post Item Database
+
+Status queries on nzpost_summary_item only read tpid, edifact_code and
+event_datetime, but every document also carries the large nested
+parcel_details (two addresses, product flags, dimensions). Whenever a query
+is not covered by an index, those bytes are paged through the WiredTiger
+cache too.
+
+The split layout (database nzpost_summary_item_split, written by
+Generate_Mongo_Test_Data_summary_Item.py --layout split) keeps the slim event
+fields in the summary collections and moves parcel_details to a
+<collection>_details collection whose _id is the tracking reference. Details
+are joined only when a caller asks for them.
+
+Run this script to compare status query latency and cache hit rate of the
+nested and split layouts.
+"""
+
+import argparse
+import pymongo
+import statistics
+import time
+from typing import Dict, List, Optional, Tuple
+from mongo_query_engine import WORKLOAD_TPIDS, WORKLOAD_CODES, WORKLOAD_DATE_RANGE, collection_storage_stats
+
+# MongoDB connection parameters
+MONGO_URI = "mongodb://localhost:27017/"
+
+NESTED_DATABASE = "nzpost_summary_item"
+SPLIT_DATABASE = "nzpost_summary_item_split"
+DETAILS_FIELD = "parcel_details"
+
+# Collection names
+COLLECTIONS = [
+    "summary_1_week",
+    "summary_2_weeks",
+    "summary_1_month",
+    "summary_3_months"
+]
+
+# Secondary indexes of the details collections
+DETAILS_INDEXES = [
+    ("custom_item_id_1", [("custom_item_id", 1)]),
+    ("product.service_code_1", [("product.service_code", 1)])
+]
+
+def details_collection_name(collection_name: str) -> str:
+    return f"{collection_name}_details"
+
+def split_document(document: Dict) -> Tuple[Dict, Dict]:
+    """Split an item document into its event document and its details document"""
+    event = {field: value for field, value in document.items() if field != DETAILS_FIELD}
+    details = {"_id": document["tracking_reference"], **document[DETAILS_FIELD]}
+    return event, details
+
+def attach_details(db, collection_name: str, events: List[Dict]) -> List[Dict]:
+    """Join parcel_details onto split event documents with one $in lookup"""
+    references = [event["tracking_reference"] for event in events]
+    details = {document.pop("_id"): document
+               for document in db[details_collection_name(collection_name)].find({"_id": {"$in": references}})}
+    for event in events:
+        event[DETAILS_FIELD] = details.get(event["tracking_reference"])
+    return events
+
+def is_split_database(db_name: str) -> bool:
+    return db_name == SPLIT_DATABASE
+
+def find_parcel(db, collection_name: str, tracking_reference: str) -> Optional[Dict]:
+    """A parcel with its details from either layout"""
+    document = db[collection_name].find_one({"tracking_reference": tracking_reference})
+    if document and is_split_database(db.name):
+        attach_details(db, collection_name, [document])
+    return document
+
+def status_queries(collection) -> List[Tuple[str, object]]:
+    """Status queries that fetch documents (not covered by an index)"""
+    date_from, date_to = WORKLOAD_DATE_RANGE
+    tpid_match = {"tpid": {"$in": WORKLOAD_TPIDS}}
+    status_match = {**tpid_match, "edifact_code": {"$in": WORKLOAD_CODES}}
+    return [
+        ("status_descriptions", lambda: list(collection.aggregate([
+            {"$match": tpid_match},
+            {"$group": {"_id": "$event_description", "count": {"$sum": 1}}}
+        ], allowDiskUse=True))),
+        ("status_count_tpid_index", lambda: list(collection.aggregate([
+            {"$match": status_match}, {"$count": "total"}
+        ], hint="tpid_1", allowDiskUse=True))),
+        ("status_list_date_range", lambda: list(collection.find(
+            {**status_match, "event_datetime": {"$gte": date_from, "$lte": date_to}},
+            {"_id": 0, "tracking_reference": 1, "event_description": 1, "event_datetime": 1})))
+    ]
+
+def cache_counters(client) -> Dict[str, int]:
+    """WiredTiger cache request and read counters"""
+    cache = client.admin.command("serverStatus")["wiredTiger"]["cache"]
+    return {
+        "requested": cache.get("pages requested from the cache", 0),
+        "read_into": cache.get("pages read into cache", 0),
+        "bytes_read_into": cache.get("bytes read into cache", 0)
+    }
+
+def measure_query(client, query, repeats: int) -> Dict:
+    """Median latency and cache hit rate of a query over repeated runs"""
+    before = cache_counters(client)
+    runs = []
+    for _ in range(repeats):
+        start_time = time.time()
+        query()
+        runs.append((time.time() - start_time) * 1000)
+    after = cache_counters(client)
+    requested = after["requested"] - before["requested"]
+    read_into = after["read_into"] - before["read_into"]
+    return {
+        "median_ms": statistics.median(runs),
+        "cache_hit_rate": 1 - read_into / requested if requested else None,
+        "bytes_read_into_cache": after["bytes_read_into"] - before["bytes_read_into"]
+    }
+
+def compare_collection(client, collection_name: str, repeats: int = 3) -> Dict:
+    """Storage, latency and cache hit rate of status queries in both layouts"""
+    report = {}
+    for layout, db_name in (("nested", NESTED_DATABASE), ("split", SPLIT_DATABASE)):
+        collection = client[db_name][collection_name]
+        storage = collection_storage_stats(collection)
+        report[layout] = {
+            "data_size": storage["data_size"],
+            "avg_document_size": storage["data_size"] / storage["count"] if storage["count"] else 0,
+            "queries": {name: measure_query(client, query, repeats) for name, query in status_queries(collection)}
+        }
+    return report
+
+def print_report(reports: Dict):
+    """Print the nested and split figures side by side"""
+    for collection_name, report in reports.items():
+        nested, split = report["nested"], report["split"]
+        print(f"\n===== {collection_name} =====")
+        print(f"Event documents: {nested['avg_document_size']:.0f} bytes nested, "
+              f"{split['avg_document_size']:.0f} bytes split "
+              f"({nested['data_size'] / 1048576:.1f} MB -> {split['data_size'] / 1048576:.1f} MB)")
+        print(f"{'Query':<26}{'Nested (ms)':>13}{'Split (ms)':>12}{'Nested hit':>12}{'Split hit':>11}"
+              f"{'Nested read (MB)':>18}{'Split read (MB)':>17}")
+        for name in nested["queries"]:
+            before, after = nested["queries"][name], split["queries"][name]
+            hit = lambda rate: f"{rate * 100:.1f}%" if rate is not None else "-"
+            print(f"{name:<26}{before['median_ms']:>13.2f}{after['median_ms']:>12.2f}"
+                  f"{hit(before['cache_hit_rate']):>12}{hit(after['cache_hit_rate']):>11}"
+                  f"{before['bytes_read_into_cache'] / 1048576:>18.1f}{after['bytes_read_into_cache'] / 1048576:>17.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare status queries on the nested and split item layouts")
+    parser.add_argument("--collection", action="append", choices=COLLECTIONS,
+                        help="Collection to compare (repeatable, default: all)")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per query")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(MONGO_URI)
+    print(f"Connected to MongoDB at {MONGO_URI}")
+    try:
+        existing = client[SPLIT_DATABASE].list_collection_names()
+        reports = {}
+        for collection_name in args.collection or COLLECTIONS:
+            if collection_name not in existing:
+                print(f"  {SPLIT_DATABASE}.{collection_name} not found - generate it with --layout split")
+                continue
+            print(f"  Comparing {collection_name}...")
+            reports[collection_name] = compare_collection(client, collection_name, args.repeats)
+        print_report(reports)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Late Parcel Report for the NZ Post Item Database
+
+Reports, per TPID and service code:
+- overdue: parcels not yet delivered whose initial EDD is before the report time
+- delivered late: delivered parcels whose delivery event is after the initial EDD
+
+Both aggregations run on the lateness index (edifact_code, initial_edd, tpid,
+service_code, event_datetime) without fetching documents, so they need the
+typed sla_days/initial_edd written by the current item generator.
+"""
+
+import argparse
+import pymongo
+from datetime import datetime
+from mongo_query_engine import ITEM_DATABASE, late_parcel_report
+from create_mongo_indexes import IN_FLIGHT_CODES
+
+# MongoDB connection parameters
+MONGO_URI = "mongodb://localhost:27017/"
+
+# Collection names
+COLLECTIONS = [
+    "summary_1_week",
+    "summary_2_weeks",
+    "summary_1_month",
+    "summary_3_months"
+]
+
+def print_report(collection_name: str, report: dict):
+    """Print the late-parcel rows and query times"""
+    print(f"\n===== Late Parcels: {collection_name} (as of {report['as_of']}) =====")
+    print(f"Index: {report['hint'] or 'none - run create_mongo_indexes.py'}")
+    print(f"{'TPID':<10}{'Service':<10}{'Overdue':>12}{'Delivered':>12}{'Late':>12}{'Late %':>9}")
+    for row in report["rows"]:
+        rate = f"{row['late_rate'] * 100:.1f}" if row["late_rate"] is not None else "-"
+        print(f"{row['tpid']:<10}{str(row['service_code']):<10}{row['overdue']:>12,}{row['delivered']:>12,}"
+              f"{row['delivered_late']:>12,}{rate:>9}")
+    print(f"Overdue query: {report['time_ms']['overdue']:.2f}ms, "
+          f"delivered query: {report['time_ms']['delivered']:.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Late parcels per TPID and service code")
+    parser.add_argument("--collection", action="append", choices=COLLECTIONS,
+                        help="Collection to report (repeatable, default: all)")
+    parser.add_argument("--tpid", type=int, action="append", help="TPID to report (repeatable, default: all)")
+    parser.add_argument("--as-of", type=datetime.fromisoformat,
+                        help="Report time for overdue parcels (default: latest event in the collection)")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(MONGO_URI)
+    print(f"Connected to MongoDB at {MONGO_URI}")
+    try:
+        db = client[ITEM_DATABASE]
+        for collection_name in args.collection or COLLECTIONS:
+            report = late_parcel_report(db[collection_name], IN_FLIGHT_CODES, args.as_of, args.tpid)
+            print_report(collection_name, report)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
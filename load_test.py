@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Concurrent Load Test for NZ Post Databases
+
+The GUI measures one query at a time on an idle server; in production many
+merchants' dashboards query the same collections at once. This script runs N
+simulated users, each a worker thread that issues the GUI's queries back to back:
+- status: total parcels and the count for one status (the status buttons)
+- all_events: counts per edifact code (the All events button)
+- performance: the performance test's total and status pipelines
+- matrix: the single-pass status-by-TPID matrix the GUI prefetches
+
+Parameters are drawn the way real traffic is skewed: TPIDs in proportion to
+their parcel volume (TPID_VOLUMES, 50,000 for the long tail), statuses in the
+generators' edifact ratios, and half of the queries with a random date range.
+
+Concurrency ramps through the given levels; each level reports sustained
+throughput, latency percentiles and error and timeout rates. Whether the
+collection is time series, its latest-event strategy and the distinct count
+strategy are resolved once per collection, not inside the timed queries.
+"""
+
+import argparse
+import pymongo
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+from pymongo.errors import ExecutionTimeout
+from mongo_query_engine import (TPID_VOLUMES, DEFAULT_TPID_VOLUME, WORKLOAD_TPIDS, WORKLOAD_CODES, is_time_series,
+                                run_aggregate, count_distinct_parcels, can_cover_distinct, get_latest_strategy,
+                                latest_strategy_target,
+                                latest_strategy_hint, latest_status_count_pipeline, latest_status_summary_pipeline,
+                                compute_status_matrix)
+
+# MongoDB connection parameters
+MONGO_URI = "mongodb://localhost:27017/"
+
+DATABASES = ["nzpost_summary", "nzpost_summary_item", "nzpost_summary_append"]
+
+# Collection names and their generated date ranges
+COLLECTIONS = {
+    "summary_1_week": (datetime(2025, 3, 1), datetime(2025, 3, 7)),
+    "summary_2_weeks": (datetime(2025, 3, 1), datetime(2025, 3, 14)),
+    "summary_1_month": (datetime(2025, 3, 1), datetime(2025, 3, 31)),
+    "summary_3_months": (datetime(2025, 1, 1), datetime(2025, 3, 31))
+}
+
+# Edifact codes and their ratios in the generated data
+EDIFACT_RATIOS = {100: 5, 200: 15, 300: 15, 400: 10, 500: 50, 600: 5}
+
+# Query type -> share of the simulated traffic
+QUERY_MIX = {"status": 70, "all_events": 15, "performance": 10, "matrix": 5}
+
+DEFAULT_CONCURRENCY = [1, 2, 4, 8, 16, 32]
+DEFAULT_DURATION_SECONDS = 30
+DEFAULT_TIMEOUT_MS = 30000
+DATE_RANGE_SHARE = 0.5
+
+class ParameterSampler:
+    """Draws TPID, status and date parameters with production-like skew"""
+
+    def __init__(self, tpids: List[int], date_range: Tuple[datetime, datetime], seed: int = None):
+        self.random = random.Random(seed)
+        self.tpids = tpids
+        self.tpid_weights = [TPID_VOLUMES.get(tpid, DEFAULT_TPID_VOLUME) for tpid in tpids]
+        self.codes = list(EDIFACT_RATIOS)
+        self.code_weights = list(EDIFACT_RATIOS.values())
+        self.date_range = date_range
+        self.lock = threading.Lock()
+
+    def sample(self) -> Dict:
+        with self.lock:
+            params = {
+                "tpid": self.random.choices(self.tpids, self.tpid_weights)[0],
+                "code": self.random.choices(self.codes, self.code_weights)[0],
+                "query": self.random.choices(list(QUERY_MIX), list(QUERY_MIX.values()))[0],
+                "dates": None
+            }
+            if self.random.random() < DATE_RANGE_SHARE:
+                first, last = self.date_range
+                days = (last - first).days
+                start = first + timedelta(days=self.random.randint(0, days))
+                end = min(last, start + timedelta(days=self.random.randint(0, 6)))
+                params["dates"] = (start, datetime.combine(end.date(), datetime.max.time()))
+        return params
+
+def collection_setup(collection, use_rollup: bool) -> Dict:
+    """Per-collection facts the queries need, looked up once before the load starts"""
+    time_series = is_time_series(collection)
+    return {
+        "time_series": time_series,
+        "latest_strategy": get_latest_strategy(collection) if time_series else None,
+        "use_rollup": use_rollup,
+        "covered": can_cover_distinct(collection, {"tpid": None})
+    }
+
+def _distinct_strategy(setup: Dict, match_stage: Dict) -> str:
+    # Same choice as choose_distinct_strategy, without its per-call index lookup
+    if setup["use_rollup"]:
+        return "precomputed"
+    return "covered" if setup["covered"] and set(match_stage) <= {"tpid"} else "group"
+
+def _match(setup: Dict, tpids: List[int], dates) -> Dict:
+    match_stage = {"tpid": tpids[0] if len(tpids) == 1 else {"$in": tpids}}
+    if dates:
+        match_stage["timestamp" if setup["time_series"] else "event_datetime"] = {"$gte": dates[0], "$lte": dates[1]}
+    return match_stage
+
+def _status_hint(match_stage: Dict):
+    return "tpid_1_edifact_code_1_event_datetime_1" if "event_datetime" in match_stage else "tpid_1_edifact_code_1"
+
+def status_query(collection, setup: Dict, params: Dict, timeout_ms: int):
+    """Total parcels of the TPID, then the count for one status"""
+    match_stage = _match(setup, [params["tpid"]], params["dates"])
+    tpid_match = {"tpid": match_stage["tpid"]}
+    if setup["time_series"]:
+        count_distinct_parcels(collection, tpid_match, strategy=_distinct_strategy(setup, tpid_match),
+                               timeout_ms=timeout_ms)
+        strategy = setup["latest_strategy"]
+        run_aggregate(latest_strategy_target(collection, strategy),
+                      latest_status_count_pipeline(strategy, match_stage, [params["code"]], collection.name),
+                      hint=latest_strategy_hint(strategy), timeout_ms=timeout_ms)
+        return
+    run_aggregate(collection, [{"$match": tpid_match}, {"$count": "total"}], hint="tpid_1", timeout_ms=timeout_ms)
+    status_match = {**match_stage, "edifact_code": params["code"]}
+    run_aggregate(collection, [{"$match": status_match}, {"$count": "total"}], hint=_status_hint(status_match),
+                  timeout_ms=timeout_ms)
+
+def all_events_query(collection, setup: Dict, params: Dict, timeout_ms: int):
+    """Counts per edifact code and the distinct parcel count"""
+    match_stage = _match(setup, [params["tpid"]], params["dates"])
+    if setup["time_series"]:
+        strategy = setup["latest_strategy"]
+        run_aggregate(latest_strategy_target(collection, strategy),
+                      latest_status_summary_pipeline(strategy, match_stage, collection.name),
+                      hint=latest_strategy_hint(strategy), timeout_ms=timeout_ms)
+        return
+    run_aggregate(collection, [
+        {"$match": match_stage},
+        {"$group": {"_id": {"edifact_code": "$edifact_code", "event_description": "$event_description"},
+                    "count": {"$sum": 1}}},
+        {"$sort": {"_id.edifact_code": 1}}
+    ], timeout_ms=timeout_ms)
+    count_distinct_parcels(collection, match_stage, strategy=_distinct_strategy(setup, match_stage),
+                           timeout_ms=timeout_ms)
+
+def performance_query(collection, setup: Dict, params: Dict, timeout_ms: int):
+    """The performance test's total and status pipelines for its fixed TPIDs and codes"""
+    match_stage = _match(setup, WORKLOAD_TPIDS, params["dates"])
+    if setup["time_series"]:
+        count_distinct_parcels(collection, match_stage, strategy=_distinct_strategy(setup, match_stage),
+                               timeout_ms=timeout_ms)
+        strategy = setup["latest_strategy"]
+        run_aggregate(latest_strategy_target(collection, strategy),
+                      latest_status_count_pipeline(strategy, match_stage, WORKLOAD_CODES, collection.name),
+                      hint=latest_strategy_hint(strategy), timeout_ms=timeout_ms)
+        return
+    run_aggregate(collection, [{"$match": {"tpid": match_stage["tpid"]}}, {"$count": "total"}], hint="tpid_1",
+                  timeout_ms=timeout_ms)
+    status_match = {**match_stage, "edifact_code": {"$in": WORKLOAD_CODES}}
+    run_aggregate(collection, [{"$match": status_match}, {"$count": "total"}], hint=_status_hint(status_match),
+                  timeout_ms=timeout_ms)
+
+def matrix_query(collection, setup: Dict, params: Dict, timeout_ms: int):
+    match_stage = _match(setup, [params["tpid"]], params["dates"])
+    compute_status_matrix(collection, match_stage, strategy=setup["latest_strategy"],
+                          distinct_strategy=_distinct_strategy(setup, {"tpid": match_stage["tpid"]}),
+                          timeout_ms=timeout_ms, time_series=setup["time_series"])
+
+QUERIES: Dict[str, Callable] = {
+    "status": status_query,
+    "all_events": all_events_query,
+    "performance": performance_query,
+    "matrix": matrix_query
+}
+
+def _percentile(values: List[float], percentile: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))]
+
+def run_level(collection, setup: Dict, sampler: ParameterSampler, users: int, duration: float,
+              timeout_ms: int) -> Dict:
+    """Run `users` workers issuing queries back to back for `duration` seconds"""
+    deadline = time.time() + duration
+    samples = []
+    samples_lock = threading.Lock()
+
+    def worker():
+        while time.time() < deadline:
+            params = sampler.sample()
+            start_time = time.time()
+            outcome = "ok"
+            try:
+                QUERIES[params["query"]](collection, setup, params, timeout_ms)
+            except ExecutionTimeout:
+                outcome = "timeout"
+            except Exception as e:
+                outcome = "error"
+                print(f"    {params['query']} failed: {e}")
+            with samples_lock:
+                samples.append((params["query"], outcome, (time.time() - start_time) * 1000))
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        for _ in range(users):
+            executor.submit(worker)
+    elapsed = time.time() - start_time
+
+    latencies = [latency for _, outcome, latency in samples if outcome == "ok"]
+    by_query = {}
+    for query in QUERIES:
+        query_latencies = [latency for name, outcome, latency in samples if name == query and outcome == "ok"]
+        if query_latencies:
+            by_query[query] = {"requests": len(query_latencies), "p50_ms": statistics.median(query_latencies),
+                               "p99_ms": _percentile(query_latencies, 99)}
+    requests = len(samples)
+    return {
+        "users": users,
+        "requests": requests,
+        "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": statistics.median(latencies) if latencies else None,
+        "p95_ms": _percentile(latencies, 95) if latencies else None,
+        "p99_ms": _percentile(latencies, 99) if latencies else None,
+        "error_rate": sum(outcome == "error" for _, outcome, _ in samples) / requests if requests else 0.0,
+        "timeout_rate": sum(outcome == "timeout" for _, outcome, _ in samples) / requests if requests else 0.0,
+        "by_query": by_query
+    }
+
+def print_report(name: str, levels: List[Dict]):
+    """Print one row per concurrency level and the per-query medians"""
+    format_ms = lambda value: f"{value:.1f}" if value is not None else "-"
+    print(f"\n===== Load Test: {name} =====")
+    print(f"{'Users':>6}{'Requests':>10}{'Req/s':>9}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}"
+          f"{'Errors':>8}{'Timeouts':>10}  " + "".join(f"{query + ' p50':>18}" for query in QUERIES))
+    for level in levels:
+        per_query = "".join(f"{format_ms(level['by_query'].get(query, {}).get('p50_ms')):>18}" for query in QUERIES)
+        print(f"{level['users']:>6}{level['requests']:>10,}{level['throughput']:>9.1f}{format_ms(level['p50_ms']):>10}"
+              f"{format_ms(level['p95_ms']):>10}{format_ms(level['p99_ms']):>10}{level['error_rate'] * 100:>7.1f}%"
+              f"{level['timeout_rate'] * 100:>9.1f}%  {per_query}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Ramp up concurrent simulated dashboard users")
+    parser.add_argument("--database", default="nzpost_summary", choices=DATABASES)
+    parser.add_argument("--collection", action="append", choices=list(COLLECTIONS),
+                        help="Collection to load (repeatable, default: summary_1_week)")
+    parser.add_argument("--users", type=int, action="append",
+                        help="Concurrency level (repeatable, default: 1 2 4 8 16 32)")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION_SECONDS, help="Seconds per level")
+    parser.add_argument("--timeout-ms", type=int, default=DEFAULT_TIMEOUT_MS, help="maxTimeMS of every query")
+    parser.add_argument("--seed", type=int, help="Seed for the parameter sampler")
+    parser.add_argument("--use-rollup", action="store_true",
+                        help="Count distinct parcels from the precomputed rollups (default: covered/group)")
+    args = parser.parse_args()
+    levels = sorted(args.users or DEFAULT_CONCURRENCY)
+
+    # One pooled connection per simulated user
+    client = pymongo.MongoClient(MONGO_URI, maxPoolSize=max(levels) * 2)
+    print(f"Connected to MongoDB at {MONGO_URI}")
+    print(f"Load test started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    try:
+        for collection_name in args.collection or ["summary_1_week"]:
+            collection = client[args.database][collection_name]
+            tpids = sorted(collection.distinct("tpid"))
+            if not tpids:
+                print(f"  {args.database}.{collection_name} is empty - skipping")
+                continue
+            sampler = ParameterSampler(tpids, COLLECTIONS[collection_name], args.seed)
+            setup = collection_setup(collection, args.use_rollup)
+            results = []
+            for users in levels:
+                print(f"  {args.database}.{collection_name}: {users} users for {args.duration:.0f}s...")
+                results.append(run_level(collection, setup, sampler, users, args.duration, args.timeout_ms))
+            print_report(f"{args.database}.{collection_name}", results)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1372 @@
+"""
+Headless query engine for the NZ Post MongoDB performance tests
+
+Holds the query-building and execution logic shared by Measure_Mongo_Queries
+(the GUI) and the command line benchmark scripts, so both run exactly the same
+pipelines against:
+1. nzpost_summary - Regular collections
+2. nzpost_summary_item - Item detail collections
+3. nzpost_summary_append - Time series collections
+"""
+
+import math
+import re
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from build_daily_rollup import ROLLUP_COLLECTION, is_rollup_fresh, is_tpid_or, rollup_match, rollup_count_pipeline
+from refresh_append_rollup import STATUS_COUNTS_COLLECTION, LATEST_STATUS_COLLECTION, latest_rollup_match
+
+TIME_SERIES_DATABASE = "nzpost_summary_append"
+
+# Default timeout for long running aggregations (20 minutes)
+DEFAULT_TIMEOUT_MS = 1200000
+
+# Distinct parcel counting strategies, in the order "auto" tries them
+DISTINCT_STRATEGIES = ["precomputed", "covered", "group"]
+
+def run_aggregate(collection, pipeline: List[Dict], hint=None,
+                  timeout_ms: int = DEFAULT_TIMEOUT_MS) -> Tuple[List[Dict], float]:
+    """Run an aggregation to completion and return (results, response time in ms)"""
+    start_time = time.time()
+    kwargs = {"allowDiskUse": True, "maxTimeMS": timeout_ms}
+    if hint:
+        kwargs["hint"] = hint
+    result = list(collection.aggregate(pipeline, **kwargs))
+    return result, (time.time() - start_time) * 1000
+
+def is_time_series(collection) -> bool:
+    """Check whether a collection is a time series collection"""
+    return collection.database.name == TIME_SERIES_DATABASE or "timeseries" in collection.options()
+
+def distinct_parcels_pipeline(match_stage: Dict, covered: bool = False) -> List[Dict]:
+    """Count distinct tracking references by grouping on them and counting the groups.
+
+    Unlike a single $addToSet array this never builds one huge document: each
+    group is a small key that spills to disk when memory runs short.
+    """
+    pipeline = [{"$match": match_stage}]
+    if covered:
+        # Only project indexed fields so the plan can stay index-only
+        pipeline.append({"$project": {"_id": 0, "tracking_reference": 1}})
+    pipeline.extend([
+        {"$group": {"_id": "$tracking_reference"}},
+        {"$count": "total"}
+    ])
+    return pipeline
+
+def precomputed_parcels_query(collection, match_stage: Dict) -> Optional[Tuple[object, Dict]]:
+    """Return (rollup collection, rollup match) when a fresh precomputed count can answer the match"""
+    db = collection.database
+    if is_time_series(collection):
+        # Counters are keyed by latest status, not by every status a parcel passed through
+        if "edifact_code" in match_stage:
+            return None
+        rollup_query = latest_rollup_match(db, collection.name, match_stage)
+        return (db[STATUS_COUNTS_COLLECTION], rollup_query) if rollup_query is not None else None
+
+    if db.name in ("nzpost_summary", "nzpost_summary_item") and is_rollup_fresh(db, collection.name):
+        rollup_query = rollup_match(collection.name, match_stage)
+        return (db[ROLLUP_COLLECTION], rollup_query) if rollup_query is not None else None
+    return None
+
+def can_cover_distinct(collection, match_stage: Dict) -> bool:
+    """The tpid_1_tracking_reference_1 index covers the count when only tpid is filtered"""
+    if is_time_series(collection) or not set(match_stage) <= {"tpid"}:
+        return False
+    return "tpid_1_tracking_reference_1" in collection.index_information()
+
+def choose_distinct_strategy(collection, match_stage: Dict, use_rollup: bool) -> str:
+    """Explicit distinct count strategy: the rollups only when the caller opted in to them"""
+    if use_rollup:
+        return "precomputed"
+    return "covered" if can_cover_distinct(collection, match_stage) else "group"
+
+def count_distinct_parcels(collection, match_stage: Dict, strategy: str = "auto", hint=None,
+                           timeout_ms: int = DEFAULT_TIMEOUT_MS) -> Dict:
+    """Count distinct parcels matching a filter.
+
+    Strategies:
+    - precomputed: sum the daily rollup / latest-status counters when they are fresh
+    - covered: group tracking references streamed from tpid_1_tracking_reference_1
+    - group: group by tracking_reference then count, using the given hint
+    - auto: the first of the above that applies
+
+    Returns {"count", "strategy", "time_ms", "pipeline", "hint"}.
+    """
+    if strategy not in ("auto", *DISTINCT_STRATEGIES):
+        raise ValueError(f"Unknown distinct count strategy: {strategy}")
+
+    if strategy in ("auto", "precomputed"):
+        precomputed = precomputed_parcels_query(collection, match_stage)
+        if precomputed is not None:
+            rollup, rollup_query = precomputed
+            pipeline = rollup_count_pipeline(rollup_query)
+            result, response_time = run_aggregate(rollup, pipeline, timeout_ms=timeout_ms)
+            return {
+                "count": result[0]["total"] if result else 0,
+                "strategy": "precomputed",
+                "time_ms": response_time,
+                "pipeline": pipeline,
+                "hint": None
+            }
+        if strategy == "precomputed":
+            print("Precomputed parcel counts unavailable - falling back to group strategy")
+
+    if strategy in ("auto", "covered") and can_cover_distinct(collection, match_stage):
+        used_strategy = "covered"
+        pipeline = distinct_parcels_pipeline(match_stage, covered=True)
+        hint = "tpid_1_tracking_reference_1"
+    else:
+        if strategy == "covered":
+            print("Filter cannot be covered by tpid_1_tracking_reference_1 - falling back to group strategy")
+        used_strategy = "group"
+        pipeline = distinct_parcels_pipeline(match_stage)
+
+    result, response_time = run_aggregate(collection, pipeline, hint=hint, timeout_ms=timeout_ms)
+    return {
+        "count": result[0]["total"] if result else 0,
+        "strategy": used_strategy,
+        "time_ms": response_time,
+        "pipeline": pipeline,
+        "hint": hint
+    }
+
+# Latest-event-per-parcel strategies for the time series collections
+LATEST_STRATEGIES = ["sort_group", "group_top", "distinct_scan", "bucket_max"]
+DEFAULT_LATEST_STRATEGY = "group_top"
+STRATEGY_CHOICES_COLLECTION = "query_strategy_choices"
+
+def _split_time_series_match(match_stage: Dict) -> Tuple[Dict, Dict]:
+    """Split a match into (timestamp filter, remaining per-parcel filters)"""
+    time_filter = {"timestamp": match_stage["timestamp"]} if "timestamp" in match_stage else {}
+    other_filter = {k: v for k, v in match_stage.items() if k != "timestamp"}
+    return time_filter, other_filter
+
+def latest_events_pipeline(strategy: str, match_stage: Dict, collection_name: str = None) -> List[Dict]:
+    """Pipeline emitting one {_id: tracking_reference, tpid, edifact_code} document per parcel.
+
+    Strategies:
+    - sort_group: blocking $sort on timestamp then $group with $first of the whole document (baseline)
+    - group_top: $group with $top carrying only tpid and edifact_code, no blocking sort
+    - distinct_scan: $sort on (tracking_reference, timestamp desc) + $group/$first so the planner
+      can walk tracking_reference_1_timestamp_-1 with a DISTINCT_SCAN; tpid is filtered afterwards
+      because a non-index predicate before the sort disables the optimization
+    - bucket_max: enumerate parcels from the bucket metadata of system.buckets.<collection>
+      (one document per bucket instead of per event) and fetch each parcel's latest event with an
+      index lookup; must be run against the buckets collection
+    """
+    if strategy == "sort_group":
+        return [
+            {"$match": match_stage},
+            {"$sort": {"timestamp": -1}},
+            {"$group": {"_id": "$tracking_reference", "latest_event": {"$first": "$$ROOT"}}},
+            {"$project": {"tpid": "$latest_event.tpid", "edifact_code": "$latest_event.edifact_code"}}
+        ]
+
+    if strategy == "group_top":
+        return [
+            {"$match": match_stage},
+            {"$group": {
+                "_id": "$tracking_reference",
+                "latest": {"$top": {
+                    "sortBy": {"timestamp": -1},
+                    "output": {"tpid": "$tpid", "edifact_code": "$edifact_code"}
+                }}
+            }},
+            {"$project": {"tpid": "$latest.tpid", "edifact_code": "$latest.edifact_code"}}
+        ]
+
+    if strategy == "distinct_scan":
+        time_filter, other_filter = _split_time_series_match(match_stage)
+        # tracking_reference leads the index, so a range on it keeps the DISTINCT_SCAN
+        if "tracking_reference" in other_filter:
+            time_filter = {**time_filter, "tracking_reference": other_filter.pop("tracking_reference")}
+        pipeline = []
+        if time_filter:
+            pipeline.append({"$match": time_filter})
+        pipeline.extend([
+            {"$sort": {"tracking_reference": 1, "timestamp": -1}},
+            {"$group": {
+                "_id": "$tracking_reference",
+                "tpid": {"$first": "$tpid"},
+                "edifact_code": {"$first": "$edifact_code"}
+            }}
+        ])
+        if other_filter:
+            pipeline.append({"$match": other_filter})
+        return pipeline
+
+    if strategy == "bucket_max":
+        if not collection_name:
+            raise ValueError("bucket_max strategy needs the time series collection name")
+        time_filter, other_filter = _split_time_series_match(match_stage)
+        bucket_match = {}
+        # Every event in a bucket belongs to the same parcel, so control.min.tpid is the parcel's tpid
+        if "tpid" in other_filter:
+            bucket_match["control.min.tpid"] = other_filter["tpid"]
+        if is_tpid_or(other_filter.get("$or")):
+            bucket_match["$or"] = [{"control.min.tpid": branch["tpid"]} for branch in other_filter["$or"]]
+        if "tracking_reference" in other_filter:
+            bucket_match["meta"] = other_filter["tracking_reference"]
+        event_match = {"$expr": {"$eq": ["$tracking_reference", "$$ref"]}}
+        if time_filter:
+            bounds = time_filter["timestamp"]
+            if "$gte" in bounds or "$gt" in bounds:
+                bucket_match["control.max.timestamp"] = {"$gte": bounds.get("$gte", bounds.get("$gt"))}
+            if "$lte" in bounds or "$lt" in bounds:
+                bucket_match["control.min.timestamp"] = {"$lte": bounds.get("$lte", bounds.get("$lt"))}
+            event_match["timestamp"] = bounds
+        return [
+            {"$match": bucket_match},
+            {"$group": {"_id": "$meta"}},
+            {"$lookup": {
+                "from": collection_name,
+                "let": {"ref": "$_id"},
+                "pipeline": [
+                    {"$match": event_match},
+                    {"$sort": {"timestamp": -1}},
+                    {"$limit": 1},
+                    {"$project": {"_id": 0, "tpid": 1, "edifact_code": 1}}
+                ],
+                "as": "latest"
+            }},
+            {"$unwind": "$latest"},
+            {"$project": {"tpid": "$latest.tpid", "edifact_code": "$latest.edifact_code"}}
+        ]
+
+    raise ValueError(f"Unknown latest event strategy: {strategy}")
+
+def latest_strategy_target(collection, strategy: str):
+    """Collection a latest-event strategy must be run against"""
+    if strategy == "bucket_max":
+        return collection.database[f"system.buckets.{collection.name}"]
+    return collection
+
+def latest_strategy_hint(strategy: str, hint=None):
+    """Index hint for a latest-event strategy; only the sort-free strategies honour the caller's hint"""
+    if strategy == "distinct_scan":
+        return "tracking_reference_1_timestamp_-1"
+    if strategy == "bucket_max":
+        return None
+    return hint
+
+def latest_status_count_pipeline(strategy: str, match_stage: Dict, codes: List[int],
+                                 collection_name: str = None) -> List[Dict]:
+    """Count parcels whose latest event has one of the given edifact codes"""
+    return latest_events_pipeline(strategy, match_stage, collection_name) + [
+        {"$match": {"edifact_code": {"$in": codes}}},
+        {"$count": "total"}
+    ]
+
+def latest_status_summary_pipeline(strategy: str, match_stage: Dict, collection_name: str = None) -> List[Dict]:
+    """Count parcels per latest edifact code"""
+    return latest_events_pipeline(strategy, match_stage, collection_name) + [
+        {"$group": {"_id": "$edifact_code", "count": {"$sum": 1}}},
+        {"$project": {"_id": 0, "edifact_code": "$_id", "count": 1}},
+        {"$sort": {"edifact_code": 1}}
+    ]
+
+def run_latest_status_count(collection, strategy: str, match_stage: Dict, codes: List[int], hint=None,
+                            timeout_ms: int = DEFAULT_TIMEOUT_MS) -> Tuple[int, float, List[Dict]]:
+    """Run a latest-status count with the given strategy and return (count, ms, pipeline)"""
+    pipeline = latest_status_count_pipeline(strategy, match_stage, codes, collection.name)
+    result, response_time = run_aggregate(
+        latest_strategy_target(collection, strategy), pipeline,
+        hint=latest_strategy_hint(strategy, hint), timeout_ms=timeout_ms
+    )
+    return (result[0]["total"] if result else 0), response_time, pipeline
+
+def run_latest_status_summary(collection, strategy: str, match_stage: Dict, hint=None,
+                              timeout_ms: int = DEFAULT_TIMEOUT_MS) -> Tuple[List[Dict], float, List[Dict]]:
+    """Run a latest-status breakdown with the given strategy and return (rows, ms, pipeline)"""
+    pipeline = latest_status_summary_pipeline(strategy, match_stage, collection.name)
+    result, response_time = run_aggregate(
+        latest_strategy_target(collection, strategy), pipeline,
+        hint=latest_strategy_hint(strategy, hint), timeout_ms=timeout_ms
+    )
+    return result, response_time, pipeline
+
+def explain_aggregate(collection, pipeline: List[Dict], hint=None, timeout_ms: int = DEFAULT_TIMEOUT_MS) -> Dict:
+    """Return executionStats explain output for an aggregation"""
+    command = {"aggregate": collection.name, "pipeline": pipeline, "cursor": {}, "allowDiskUse": True}
+    if hint:
+        command["hint"] = hint
+    return collection.database.command(
+        {"explain": command, "verbosity": "executionStats", "maxTimeMS": timeout_ms}
+    )
+
+def explain_execution_stats(explain: Dict) -> Dict:
+    """executionStats of an explain; pipelines that are not pushed down (time series) report under $cursor"""
+    stats = explain.get("executionStats")
+    if stats is None:
+        stats = explain.get("stages", [{}])[0].get("$cursor", {}).get("executionStats", {})
+    return stats
+
+def collect_explain_metrics(explain: Dict) -> Dict:
+    """Walk an explain document and summarise plan stages, memory and spilling"""
+    metrics = {"stages": set(), "peak_memory_bytes": 0, "used_disk": False, "spills": 0, "spilled_bytes": 0}
+
+    def walk(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == "stage" and isinstance(value, str):
+                    metrics["stages"].add(value)
+                elif key.startswith("$") and isinstance(value, dict):
+                    metrics["stages"].add(key)
+                elif key in ("peakTrackedMemBytes", "maxAccumulatorMemoryUsageBytes", "maxMemoryUsageBytes"):
+                    if isinstance(value, dict):
+                        value = sum(v for v in value.values() if isinstance(v, (int, float)))
+                    if isinstance(value, (int, float)):
+                        metrics["peak_memory_bytes"] = max(metrics["peak_memory_bytes"], int(value))
+                elif key == "usedDisk" and value:
+                    metrics["used_disk"] = True
+                elif key == "spills" and isinstance(value, (int, float)):
+                    metrics["spills"] += int(value)
+                elif key == "spilledBytes" and isinstance(value, (int, float)):
+                    metrics["spilled_bytes"] += int(value)
+                walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    walk(explain)
+    metrics["stages"] = sorted(metrics["stages"])
+    return metrics
+
+def benchmark_latest_strategies(collection, match_stage: Dict, codes: List[int], strategies: List[str] = None,
+                                hint=None, timeout_ms: int = DEFAULT_TIMEOUT_MS, save: bool = True) -> Dict:
+    """Time every latest-event strategy on one collection and remember the fastest.
+
+    Returns {"collection", "best", "results": {strategy: {...}}}. Each result holds the count,
+    latency, peak memory, spill statistics and whether the plan used DISTINCT_SCAN.
+    """
+    results = {}
+    for strategy in strategies or LATEST_STRATEGIES:
+        try:
+            count, response_time, pipeline = run_latest_status_count(
+                collection, strategy, match_stage, codes, hint=hint, timeout_ms=timeout_ms
+            )
+            explain = explain_aggregate(
+                latest_strategy_target(collection, strategy), pipeline,
+                hint=latest_strategy_hint(strategy, hint), timeout_ms=timeout_ms
+            )
+            metrics = collect_explain_metrics(explain)
+            results[strategy] = {
+                "count": count,
+                "time_ms": response_time,
+                "peak_memory_bytes": metrics["peak_memory_bytes"],
+                "used_disk": metrics["used_disk"],
+                "spills": metrics["spills"],
+                "spilled_bytes": metrics["spilled_bytes"],
+                "distinct_scan": "DISTINCT_SCAN" in metrics["stages"],
+                "error": None
+            }
+        except Exception as e:
+            results[strategy] = {"count": None, "time_ms": None, "error": str(e)}
+        print(f"  {strategy}: {results[strategy]}")
+
+    successful = {s: r for s, r in results.items() if r["error"] is None}
+    if len({r["count"] for r in successful.values()}) > 1:
+        print("WARNING: strategies disagree on the parcel count - check the index set and bucket layout")
+    best = min(successful, key=lambda s: successful[s]["time_ms"]) if successful else None
+
+    if save and best:
+        collection.database[STRATEGY_CHOICES_COLLECTION].replace_one(
+            {"_id": collection.name},
+            {"_id": collection.name, "strategy": best, "benchmarked_at": datetime.now(), "results": results},
+            upsert=True
+        )
+    return {"collection": collection.name, "best": best, "results": results}
+
+def get_latest_strategy(collection) -> str:
+    """Fastest benchmarked latest-event strategy for a collection, or the default"""
+    choice = collection.database[STRATEGY_CHOICES_COLLECTION].find_one({"_id": collection.name})
+    return choice["strategy"] if choice else DEFAULT_LATEST_STRATEGY
+
+# Monthly parcel volumes of the named TPIDs; every other generated TPID has 50,000
+TPID_VOLUMES = {
+    1000011: 500000,
+    1000012: 300000,
+    1000013: 200000,
+    1000014: 100000,
+    1000015: 75000,
+    1000016: 50000,
+    1000017: 25000,
+    1000018: 10000,
+    1000019: 5000,
+    1000020: 2000
+}
+DEFAULT_TPID_VOLUME = 50000
+
+# TPID groups and ranges. The generators number the named merchants 1000011-1000020
+# and every other TPID sequentially from 2000011, so a selection of many TPIDs is a
+# few contiguous runs; each run compiles to one range predicate (one index interval)
+# instead of one $in element per TPID. A range's last TPID is None when open-ended.
+LONG_TAIL_FIRST_TPID = 2000011
+LONG_TAIL_TPID_ESTIMATE = 800
+TPID_GROUPS = {
+    "Named merchants": [(1000011, 1000020)],
+    "Top 3 merchants": [(1000011, 1000013)],
+    "Small named merchants": [(1000017, 1000020)],
+    "Long tail": [(LONG_TAIL_FIRST_TPID, None)],
+    "Long tail first 100": [(LONG_TAIL_FIRST_TPID, LONG_TAIL_FIRST_TPID + 99)],
+    "All merchants": [(1000011, 1000020), (LONG_TAIL_FIRST_TPID, None)]
+}
+
+def parse_tpid_ranges(text: str) -> List[Tuple[int, Optional[int]]]:
+    """Parse "1000011-1000015, 1000019, 2000011+" into merged (first, last) ranges"""
+    ranges = []
+    for part in text.replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if part.endswith("+"):
+                ranges.append((int(part[:-1]), None))
+            elif "-" in part:
+                first, last = (int(value) for value in part.split("-", 1))
+                if last < first:
+                    raise ValueError
+                ranges.append((first, last))
+            else:
+                ranges.append((int(part), int(part)))
+        except ValueError:
+            raise ValueError(f"Invalid TPID range: {part!r} (use 1000011, 1000011-1000015 or 2000011+)")
+    return merge_tpid_ranges(ranges)
+
+def merge_tpid_ranges(ranges: List[Tuple[int, Optional[int]]]) -> List[Tuple[int, Optional[int]]]:
+    """Sort ranges and merge the ones that overlap or touch"""
+    merged = []
+    for first, last in sorted(ranges, key=lambda r: r[0]):
+        if merged and (merged[-1][1] is None or first <= merged[-1][1] + 1):
+            previous_first, previous_last = merged[-1]
+            merged[-1] = (previous_first, None if previous_last is None or last is None else max(previous_last, last))
+        else:
+            merged.append((first, last))
+    return merged
+
+def tpid_ranges(tpids: List[int]) -> List[Tuple[int, Optional[int]]]:
+    """Contiguous runs of a list of TPIDs"""
+    return merge_tpid_ranges([(tpid, tpid) for tpid in tpids])
+
+def format_tpid_ranges(ranges: List[Tuple[int, Optional[int]]]) -> str:
+    return ", ".join(str(first) if first == last else f"{first}+" if last is None else f"{first}-{last}"
+                     for first, last in ranges)
+
+def _tpid_range_condition(first: int, last: Optional[int]):
+    if first == last:
+        return first
+    if last is None:
+        return {"$gte": first}
+    return {"$gte": first, "$lte": last}
+
+def tpid_filter(ranges: List[Tuple[int, Optional[int]]]) -> Dict:
+    """Match fields for a TPID selection.
+
+    Single TPIDs share one equality or $in on tpid, so scattered ticks stay a plain
+    tpid filter; only selections with several real ranges need an $or, which keeps
+    the single TPIDs together in one $in branch.
+    """
+    ranges = merge_tpid_ranges(ranges)
+    singles = [first for first, last in ranges if first == last]
+    spans = [(first, last) for first, last in ranges if first != last]
+    conditions = [_tpid_range_condition(first, last) for first, last in spans]
+    if singles:
+        conditions.insert(0, singles[0] if len(singles) == 1 else {"$in": singles})
+    if not conditions:
+        return {}
+    if len(conditions) == 1:
+        return {"tpid": conditions[0]}
+    return {"$or": [{"tpid": condition} for condition in conditions]}
+
+def split_tpid_filter(match_stage: Dict) -> Tuple[Dict, Dict]:
+    """Split a match into (TPID filter, remaining filters)"""
+    tpid_part, rest = {}, {}
+    for field, condition in match_stage.items():
+        if field == "tpid" or (field == "$or" and is_tpid_or(condition)):
+            tpid_part[field] = condition
+        else:
+            rest[field] = condition
+    return tpid_part, rest
+
+def match_tpid_ranges(match_stage: Dict) -> Optional[List[Tuple[int, Optional[int]]]]:
+    """TPID ranges a match selects, or None when it has no (understood) TPID filter"""
+    conditions = [match_stage["tpid"]] if "tpid" in match_stage else []
+    if is_tpid_or(match_stage.get("$or")):
+        conditions.extend(branch["tpid"] for branch in match_stage["$or"])
+    if not conditions:
+        return None
+    ranges = []
+    for condition in conditions:
+        values = _condition_values(condition)
+        if values is not None:
+            ranges.extend((value, value) for value in values)
+        elif isinstance(condition, dict) and set(condition) <= {"$gte", "$gt", "$lte", "$lt"}:
+            first = condition["$gte"] if "$gte" in condition else condition["$gt"] + 1 if "$gt" in condition else 0
+            last = condition["$lte"] if "$lte" in condition else condition["$lt"] - 1 if "$lt" in condition else None
+            ranges.append((first, last))
+        else:
+            return None
+    return merge_tpid_ranges(ranges)
+
+def tpids_in_ranges(tpids: List[int], ranges: List[Tuple[int, Optional[int]]]) -> List[int]:
+    """The TPIDs of a list that fall in any of the ranges"""
+    return [tpid for tpid in tpids
+            if any(first <= tpid and (last is None or tpid <= last) for first, last in ranges)]
+
+def tpid_ranges_volume(ranges: List[Tuple[int, Optional[int]]]) -> int:
+    """Estimated monthly parcels of the generated TPIDs in the ranges"""
+    last_long_tail = LONG_TAIL_FIRST_TPID + LONG_TAIL_TPID_ESTIMATE - 1
+    volume = 0
+    for first, last in ranges:
+        last = last_long_tail if last is None else last
+        volume += sum(tpid_volume for tpid, tpid_volume in TPID_VOLUMES.items() if first <= tpid <= last)
+        long_tail = min(last, last_long_tail) - max(first, LONG_TAIL_FIRST_TPID) + 1
+        volume += max(0, long_tail) * DEFAULT_TPID_VOLUME
+    return volume
+
+HINT_CHOICES_COLLECTION = "hint_choices"
+HINT_REVALIDATE_SECONDS = 3600
+HINT_TRIAL_MS = 5000
+
+def query_shape(match_stage: Dict) -> str:
+    """Describe which fields a match filters on and how, ignoring the values"""
+    parts = []
+    for field in sorted(match_stage):
+        condition = match_stage[field]
+        if isinstance(condition, dict):
+            ops = sorted(condition)
+            if "$in" in ops:
+                kind = "in"
+            elif any(op in ops for op in ("$gt", "$gte", "$lt", "$lte")):
+                kind = "range"
+            else:
+                kind = "+".join(op.lstrip("$") for op in ops)
+        elif isinstance(condition, list):
+            kind = "or"
+        else:
+            kind = "eq"
+        parts.append(f"{field}:{kind}")
+    return "|".join(parts) or "all"
+
+def selectivity_bucket(match_stage: Dict) -> str:
+    """Coarse selectivity class: decade of the selected TPID volume and power-of-two date span"""
+    parts = []
+    tpid_condition = match_stage.get("tpid")
+    ranges = match_tpid_ranges(match_stage)
+    if tpid_condition is not None or ranges:
+        if isinstance(tpid_condition, dict) and "$in" in tpid_condition:
+            volume = sum(TPID_VOLUMES.get(tpid, DEFAULT_TPID_VOLUME) for tpid in tpid_condition["$in"])
+        elif isinstance(tpid_condition, int):
+            volume = TPID_VOLUMES.get(tpid_condition, DEFAULT_TPID_VOLUME)
+        else:
+            volume = tpid_ranges_volume(ranges or [])
+        parts.append(f"tpid~1e{int(math.log10(volume)) if volume > 0 else 0}")
+
+    for field in ("event_datetime", "timestamp"):
+        bounds = match_stage.get(field)
+        if isinstance(bounds, dict):
+            lower = bounds.get("$gte", bounds.get("$gt"))
+            upper = bounds.get("$lte", bounds.get("$lt"))
+            if lower is not None and upper is not None:
+                days = max((upper - lower).total_seconds() / 86400, 1)
+                parts.append(f"days~2^{int(math.log2(days))}")
+    return "|".join(parts) or "all"
+
+def _condition_values(condition) -> Optional[List]:
+    """Values an equality or $in condition can take, or None for other operators"""
+    if isinstance(condition, dict):
+        if set(condition) == {"$in"}:
+            return list(condition["$in"])
+        if set(condition) == {"$eq"}:
+            return [condition["$eq"]]
+        return None
+    return [condition]
+
+def partial_filter_satisfied(match_stage: Dict, partial_filter: Dict) -> bool:
+    """Check whether every document the match selects is covered by a partial index filter.
+
+    Only equality and $in filters are understood; anything else is treated as not satisfied.
+    """
+    for field, index_condition in partial_filter.items():
+        allowed = _condition_values(index_condition)
+        wanted = _condition_values(match_stage.get(field)) if field in match_stage else None
+        if allowed is None or wanted is None or not set(wanted) <= set(allowed):
+            return False
+    return True
+
+def usable_partial_indexes(collection, match_stage: Dict) -> List[str]:
+    """Names of the visible partial indexes whose filter the match stage implies"""
+    return [name for name, info in collection.index_information().items()
+            if "partialFilterExpression" in info and not info.get("hidden")
+            and partial_filter_satisfied(match_stage, info["partialFilterExpression"])]
+
+class HintSelector:
+    """Cost-based index hint chooser.
+
+    For each (database, collection, query shape, selectivity bucket) it races the
+    candidate indexes with capped executionStats explains of a count, caches the
+    winner in memory and in the hint_choices collection, and re-races once the
+    choice is older than revalidate_seconds. Heavy and tiny TPIDs fall into
+    different selectivity buckets, so they can end up with different plans.
+    """
+
+    def __init__(self, trial_ms: int = HINT_TRIAL_MS, revalidate_seconds: int = HINT_REVALIDATE_SECONDS):
+        self.trial_ms = trial_ms
+        self.revalidate_seconds = revalidate_seconds
+        self.cache = {}
+
+    @staticmethod
+    def cache_key(collection, match_stage: Dict) -> str:
+        # Queries that can use a partial index race a different set of candidates
+        partial = "|partial" if usable_partial_indexes(collection, match_stage) else ""
+        return (f"{collection.database.name}|{collection.name}|{query_shape(match_stage)}|"
+                f"{selectivity_bucket(match_stage)}{partial}")
+
+    @staticmethod
+    def candidate_indexes(collection, match_stage: Dict) -> List[Optional[str]]:
+        """Indexes whose leading field is filtered on, plus None for the planner's own choice"""
+        candidates = [None]
+        for name, info in collection.index_information().items():
+            if name == "_id_" or info.get("hidden"):
+                continue
+            # A partial index can only be hinted when the match stays inside its filter
+            if "partialFilterExpression" in info and not partial_filter_satisfied(
+                    match_stage, info["partialFilterExpression"]):
+                continue
+            leading_field = info["key"][0][0]
+            if leading_field in match_stage or (leading_field == "tpid" and is_tpid_or(match_stage.get("$or"))):
+                candidates.append(name)
+        return candidates
+
+    def race(self, collection, match_stage: Dict) -> Dict:
+        """Explain a count with every candidate; later candidates are capped by the best time so far"""
+        trials = {}
+        cap_ms = self.trial_ms
+        for candidate in self.candidate_indexes(collection, match_stage):
+            command = {"count": collection.name, "query": match_stage}
+            if candidate:
+                command["hint"] = candidate
+            try:
+                explain = collection.database.command(
+                    {"explain": command, "verbosity": "executionStats", "maxTimeMS": cap_ms}
+                )
+                stats = explain_execution_stats(explain)
+                elapsed = stats.get("executionTimeMillis", cap_ms)
+                trials[candidate or "planner"] = {
+                    "time_ms": elapsed,
+                    "keys_examined": stats.get("totalKeysExamined", 0),
+                    "docs_examined": stats.get("totalDocsExamined", 0)
+                }
+                # Anything slower than 1.5x the current leader cannot win the race
+                cap_ms = max(1, min(cap_ms, int(elapsed * 1.5) + 1))
+            except Exception as e:
+                trials[candidate or "planner"] = {"time_ms": None, "error": str(e)}
+
+        finished = {name: t for name, t in trials.items() if t.get("time_ms") is not None}
+        if finished:
+            winner = min(finished, key=lambda n: (finished[n]["time_ms"],
+                                                  finished[n]["keys_examined"] + finished[n]["docs_examined"]))
+        else:
+            winner = "planner"
+        return {"hint": None if winner == "planner" else winner, "trials": trials}
+
+    def cached(self, collection, match_stage: Dict) -> Optional[Dict]:
+        """Return a cached choice that is still within its revalidation window"""
+        key = self.cache_key(collection, match_stage)
+        choice = self.cache.get(key)
+        if choice is None:
+            choice = collection.database[HINT_CHOICES_COLLECTION].find_one({"_id": key})
+            if choice is not None:
+                self.cache[key] = choice
+        if choice and (datetime.now() - choice["chosen_at"]).total_seconds() < self.revalidate_seconds:
+            return choice
+        return None
+
+    def choose(self, collection, match_stage: Dict):
+        """Return the cached winner, racing the candidates first when it is missing or stale"""
+        choice = self.cached(collection, match_stage)
+        if choice is not None:
+            return choice["hint"]
+
+        key = self.cache_key(collection, match_stage)
+        result = self.race(collection, match_stage)
+        choice = {"_id": key, "hint": result["hint"], "trials": result["trials"], "chosen_at": datetime.now()}
+        collection.database[HINT_CHOICES_COLLECTION].replace_one({"_id": key}, choice, upsert=True)
+        self.cache[key] = choice
+        print(f"Hint race for {key}: {result['trials']} -> {result['hint']}")
+        return result["hint"]
+
+# Standard benchmark workload, mirroring the GUI's performance test
+WORKLOAD_TPIDS = [1000011, 1000012, 1000013, 1000014, 1000015]
+WORKLOAD_CODES = [500, 600]
+WORKLOAD_DATE_RANGE = (datetime(2025, 3, 1), datetime(2025, 3, 7, 23, 59, 59, 999999))
+WORKLOAD_TRACKING_REFERENCE = "NZ100000001"
+
+def benchmark_workload(collection) -> List[Tuple[str, Callable[[], object]]]:
+    """Named queries replayed by the index experiments and what-if runs.
+
+    No hints are given, so each run measures what the planner can do with the
+    indexes that currently exist (or are visible) on the collection.
+    """
+    tpid_match = {"tpid": {"$in": WORKLOAD_TPIDS}}
+    from_date, to_date = WORKLOAD_DATE_RANGE
+
+    if is_time_series(collection):
+        ranged = {**tpid_match, "timestamp": {"$gte": from_date, "$lte": to_date}}
+        return [
+            ("total_parcels", lambda: count_distinct_parcels(collection, tpid_match, strategy="group")["count"]),
+            ("latest_status", lambda: run_latest_status_count(
+                collection, DEFAULT_LATEST_STRATEGY, tpid_match, WORKLOAD_CODES)[0]),
+            ("latest_status_date_range", lambda: run_latest_status_count(
+                collection, DEFAULT_LATEST_STRATEGY, ranged, WORKLOAD_CODES)[0]),
+            ("latest_status_tiny_tpid", lambda: run_latest_status_count(
+                collection, DEFAULT_LATEST_STRATEGY, {"tpid": 1000020}, [600])[0]),
+            ("all_events", lambda: run_latest_status_summary(collection, DEFAULT_LATEST_STRATEGY, ranged)[0]),
+            ("parcel_timeline", lambda: list(collection.find(
+                {"tracking_reference": WORKLOAD_TRACKING_REFERENCE}).sort("timestamp", 1)))
+        ]
+
+    status_match = {**tpid_match, "edifact_code": {"$in": WORKLOAD_CODES}}
+    ranged = {**status_match, "event_datetime": {"$gte": from_date, "$lte": to_date}}
+    count_pipeline = lambda match: [{"$match": match}, {"$count": "total"}]
+    return [
+        ("total_parcels", lambda: run_aggregate(collection, count_pipeline(tpid_match))[0]),
+        ("status_count", lambda: run_aggregate(collection, count_pipeline(status_match))[0]),
+        ("status_date_range", lambda: run_aggregate(collection, count_pipeline(ranged))[0]),
+        ("status_tiny_tpid", lambda: run_aggregate(
+            collection, count_pipeline({"tpid": 1000020, "edifact_code": 600}))[0]),
+        ("all_events", lambda: run_aggregate(collection, [
+            {"$match": tpid_match},
+            {"$group": {"_id": "$edifact_code", "count": {"$sum": 1}}}
+        ])[0]),
+        ("distinct_parcels", lambda: count_distinct_parcels(collection, tpid_match, strategy="group")["count"]),
+        ("parcel_lookup", lambda: collection.find_one({"tracking_reference": WORKLOAD_TRACKING_REFERENCE}))
+    ]
+
+def run_workload(collection, repeats: int = 3) -> Dict[str, Dict]:
+    """Replay the benchmark workload and return {query: {"median_ms", "runs_ms", "error"}}"""
+    results = {}
+    for name, query in benchmark_workload(collection):
+        runs = []
+        error = None
+        for _ in range(repeats):
+            start_time = time.time()
+            try:
+                query()
+            except Exception as e:
+                error = str(e)
+                break
+            runs.append((time.time() - start_time) * 1000)
+        results[name] = {
+            "median_ms": statistics.median(runs) if runs else None,
+            "runs_ms": runs,
+            "error": error
+        }
+    return results
+
+def collection_storage_stats(collection) -> Dict:
+    """Data and per-index storage sizes, plus bytes of each index currently in the WiredTiger cache"""
+    stats = list(collection.aggregate([{"$collStats": {"storageStats": {}}}]))[0]["storageStats"]
+    index_cache = {}
+    for name, details in stats.get("indexDetails", {}).items():
+        index_cache[name] = details.get("cache", {}).get("bytes currently in the cache", 0)
+    return {
+        "count": stats.get("count", 0),
+        "data_size": stats.get("size", 0),
+        "storage_size": stats.get("storageSize", 0),
+        "total_index_size": stats.get("totalIndexSize", 0),
+        "index_sizes": stats.get("indexSizes", {}),
+        "index_cache_bytes": index_cache
+    }
+
+def set_index_hidden(collection, index_name: str, hidden: bool):
+    """Hide an index from the query planner (or unhide it) without dropping it"""
+    collection.database.command("collMod", collection.name, index={"name": index_name, "hidden": hidden})
+
+def what_if_hidden(collection, index_name: str, repeats: int = 3) -> Dict:
+    """Replay the workload with and without an index visible to the planner.
+
+    The index keeps being maintained while hidden, so unhiding it is instant. It
+    is always unhidden again before returning unless it was already hidden.
+    """
+    info = collection.index_information()
+    if index_name not in info:
+        raise ValueError(f"Index {index_name} does not exist on {collection.name}")
+    was_hidden = bool(info[index_name].get("hidden"))
+
+    storage = collection_storage_stats(collection)
+    if was_hidden:
+        set_index_hidden(collection, index_name, False)
+    try:
+        baseline = run_workload(collection, repeats=repeats)
+        set_index_hidden(collection, index_name, True)
+        hidden = run_workload(collection, repeats=repeats)
+    finally:
+        set_index_hidden(collection, index_name, was_hidden)
+
+    queries = {}
+    for name in baseline:
+        before, after = baseline[name]["median_ms"], hidden[name]["median_ms"]
+        queries[name] = {
+            "visible_ms": before,
+            "hidden_ms": after,
+            "delta_ms": after - before if before is not None and after is not None else None,
+            "error": hidden[name]["error"] or baseline[name]["error"]
+        }
+    return {
+        "index": index_name,
+        "index_size": storage["index_sizes"].get(index_name, 0),
+        "index_cache_bytes": storage["index_cache_bytes"].get(index_name, 0),
+        "queries": queries
+    }
+
+# Count modes: "exact" always counts documents, "metadata" may answer unfiltered
+# totals from collection metadata (can drift after an unclean shutdown)
+COUNT_MODES = ["exact", "metadata"]
+
+# Plan stages that read only index keys, and stages that touch documents
+INDEX_ONLY_COUNT_STAGES = {"COUNT_SCAN", "IXSCAN"}
+DOCUMENT_STAGES = {"FETCH", "COLLSCAN", "RECORD_STORE_FAST_COUNT"}
+
+def _plan_stages(plan) -> List[str]:
+    """All stage names in an explain plan tree (classic and SBE layouts)"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+def is_index_only_count(collection, match_stage: Dict, hint=None) -> bool:
+    """Check with explain that a count command would be answered from index keys alone"""
+    command = {"count": collection.name, "query": match_stage}
+    if hint:
+        command["hint"] = hint
+    explain = collection.database.command({"explain": command, "verbosity": "queryPlanner"})
+    stages = set(_plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {})))
+    return bool(stages & INDEX_ONLY_COUNT_STAGES) and not stages & DOCUMENT_STAGES
+
+def fast_count(collection, match_stage: Dict, mode: str = "exact", hint=None,
+               timeout_ms: int = DEFAULT_TIMEOUT_MS) -> Optional[Dict]:
+    """Count documents without an aggregation pipeline when a fast path applies.
+
+    Unfiltered totals in metadata mode come from estimated_document_count; filtered
+    counts use the count command when explain shows a COUNT_SCAN or covered IXSCAN.
+    Returns {"count", "method", "time_ms"} or None when the caller should aggregate;
+    time_ms includes the explain that decides whether the fast path applies.
+    Time series collections count events rather than parcels, so they never qualify.
+    """
+    if is_time_series(collection):
+        return None
+
+    start_time = time.time()
+    if not match_stage:
+        if mode != "metadata":
+            return None
+        count, method = collection.estimated_document_count(), "metadata"
+    else:
+        if not is_index_only_count(collection, match_stage, hint):
+            return None
+        command = {"query": match_stage, "maxTimeMS": timeout_ms}
+        if hint:
+            command["hint"] = hint
+        count, method = collection.database.command("count", collection.name, **command)["n"], "count_scan"
+    return {"count": count, "method": method, "time_ms": (time.time() - start_time) * 1000}
+
+# Ways to split a count into disjoint sub-queries
+SCATTER_SPLITS = ["tpid", "reference", "day"]
+DEFAULT_SCATTER_PARTS = 8
+TRACKING_REFERENCE_PREFIX = "NZ"
+
+def _reference(number: int) -> str:
+    return f"{TRACKING_REFERENCE_PREFIX}{number:09d}"
+
+def _reference_bounds(collection) -> Optional[Tuple[int, int]]:
+    """Lowest and highest tracking reference number, read from the tracking_reference index"""
+    bounds = []
+    for direction in (1, -1):
+        first = list(collection.find({}, {"tracking_reference": 1, "_id": 0})
+                     .sort("tracking_reference", direction).limit(1))
+        if not first:
+            return None
+        bounds.append(int(first[0]["tracking_reference"][len(TRACKING_REFERENCE_PREFIX):]))
+    return bounds[0], bounds[1]
+
+def scatter_matches(collection, match_stage: Dict, split: str, parts: int = DEFAULT_SCATTER_PARTS) -> List[Dict]:
+    """Split a match stage into disjoint sub-matches whose results add up to the original.
+
+    - tpid: one sub-match per selected TPID (all TPIDs when the match has none); TPID
+      ranges are resolved to the TPIDs the collection has
+    - reference: equal ranges of the sequential tracking reference numbers
+    - day: groups of whole days of event_datetime; regular collections only, because
+      a parcel's latest status depends on events outside the day
+    """
+    if split == "tpid":
+        tpid_part, rest = split_tpid_filter(match_stage)
+        tpids = _condition_values(tpid_part["tpid"]) if set(tpid_part) == {"tpid"} else None
+        if tpids is None:
+            tpids = collection.distinct("tpid", tpid_part)
+        return [{**rest, "tpid": tpid} for tpid in sorted(tpids)]
+
+    if split == "reference":
+        if "tracking_reference" in match_stage:
+            raise ValueError("reference split cannot be combined with a tracking_reference filter")
+        bounds = _reference_bounds(collection)
+        if bounds is None:
+            return [match_stage]
+        low, high = bounds
+        step = math.ceil((high - low + 1) / parts)
+        matches = []
+        for start in range(low, high + 1, step):
+            end = start + step
+            condition = {"$gte": _reference(start)}
+            # Keep the last range inclusive so a 10-digit bound never breaks string ordering
+            condition.update({"$lte": _reference(high)} if end > high else {"$lt": _reference(end)})
+            matches.append({**match_stage, "tracking_reference": condition})
+        return matches
+
+    if split == "day":
+        if is_time_series(collection):
+            raise ValueError("latest status per parcel cannot be split by day")
+        date_filter = match_stage.get("event_datetime", {})
+        lower = date_filter.get("$gte", date_filter.get("$gt"))
+        upper = date_filter.get("$lte", date_filter.get("$lt"))
+        if lower is None or upper is None:
+            first = list(collection.find({}, {"event_datetime": 1}).sort("event_datetime", 1).limit(1))
+            last = list(collection.find({}, {"event_datetime": 1}).sort("event_datetime", -1).limit(1))
+            if not first:
+                return [match_stage]
+            lower = lower if lower is not None else first[0]["event_datetime"]
+            upper = upper if upper is not None else last[0]["event_datetime"]
+        first_day = datetime.combine(lower.date(), datetime.min.time())
+        days = (upper.date() - lower.date()).days + 1
+        step = max(1, math.ceil(days / parts))
+        others = {k: v for k, v in match_stage.items() if k != "event_datetime"}
+        matches = []
+        for offset in range(0, days, step):
+            day_range = {"event_datetime": {"$gte": first_day + timedelta(days=offset),
+                                            "$lt": first_day + timedelta(days=offset + step)}}
+            conditions = [day_range] + ([{"event_datetime": date_filter}] if date_filter else [])
+            matches.append({**others, "$and": conditions})
+        return matches
+
+    raise ValueError(f"Unknown scatter split: {split}")
+
+def scatter_gather_count(collection, match_stage: Dict, build_pipeline: Callable[[Dict], List[Dict]],
+                         split: str = "tpid", parts: int = DEFAULT_SCATTER_PARTS, target=None, hint=None,
+                         timeout_ms: int = DEFAULT_TIMEOUT_MS) -> Dict:
+    """Run a count pipeline over disjoint sub-matches concurrently and add up the partial totals.
+
+    build_pipeline turns a sub-match into a pipeline ending in {"$count": "total"};
+    target is the collection to run it on (defaults to collection).
+    """
+    target = collection if target is None else target
+    sub_matches = scatter_matches(collection, match_stage, split, parts)
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, min(parts, len(sub_matches)))) as executor:
+        futures = [executor.submit(run_aggregate, target, build_pipeline(sub_match), hint, timeout_ms)
+                   for sub_match in sub_matches]
+        partials = [future.result() for future in futures]
+    return {
+        "count": sum(result[0]["total"] if result else 0 for result, _ in partials),
+        "time_ms": (time.time() - start_time) * 1000,
+        "split": split,
+        "parts": len(sub_matches),
+        "part_ms": [part_ms for _, part_ms in partials]
+    }
+
+def benchmark_scatter_gather(collection, match_stage: Dict, build_pipeline: Callable[[Dict], List[Dict]],
+                             splits: List[str] = None, parts: int = DEFAULT_SCATTER_PARTS, target=None,
+                             timeout_ms: int = DEFAULT_TIMEOUT_MS) -> Dict:
+    """Compare the single-pipeline count with each scatter-gather split"""
+    target = collection if target is None else target
+    result, baseline_ms = run_aggregate(target, build_pipeline(match_stage), timeout_ms=timeout_ms)
+    baseline = result[0]["total"] if result else 0
+    runs = {}
+    for split in splits or SCATTER_SPLITS:
+        try:
+            run = scatter_gather_count(collection, match_stage, build_pipeline, split, parts,
+                                       target=target, timeout_ms=timeout_ms)
+            run["speedup"] = baseline_ms / run["time_ms"] if run["time_ms"] else None
+            run["matches_baseline"] = run["count"] == baseline
+            runs[split] = run
+        except ValueError as e:
+            runs[split] = {"error": str(e)}
+    return {"count": baseline, "baseline_ms": baseline_ms, "splits": runs}
+
+# Drill-down facets over parcel_details (nzpost_summary_item)
+ITEM_DATABASE = "nzpost_summary_item"
+ITEM_FACETS = {
+    "service_code": "parcel_details.product.service_code",
+    "receiver_city": "parcel_details.Receiver_details.address.city",
+    "receiver_postcode": "parcel_details.Receiver_details.address.postcode",
+    "is_rural": "parcel_details.product.is_rural",
+    "is_signature_required": "parcel_details.product.is_signature_required",
+    "is_dangerous_goods": "parcel_details.product.is_dangerous_goods"
+}
+
+def facet_match(match_stage: Dict, facet_filters: Dict[str, object]) -> Dict:
+    """Add facet filters ({facet name: value}) to a match stage; None values are ignored"""
+    match = dict(match_stage)
+    for facet, value in facet_filters.items():
+        if value is not None:
+            match[ITEM_FACETS[facet]] = value
+    return match
+
+def has_facet_filters(match_stage: Dict) -> bool:
+    return any(path in match_stage for path in ITEM_FACETS.values())
+
+def facet_index_hint(collection, match_stage: Dict) -> Optional[str]:
+    """Visible facet index with the longest key prefix filtered by the match, or None"""
+    facet_paths = set(ITEM_FACETS.values())
+    best, best_prefix = None, 0
+    for name, info in collection.index_information().items():
+        if info.get("hidden"):
+            continue
+        partial_filter = info.get("partialFilterExpression")
+        if partial_filter and not partial_filter_satisfied(match_stage, partial_filter):
+            continue
+        fields = [field for field, _ in info["key"]]
+        prefix = 0
+        while prefix < len(fields) and fields[prefix] in match_stage:
+            prefix += 1
+        filtered = set(fields[:prefix]) | set(partial_filter or {})
+        if prefix and facet_paths & filtered and prefix > best_prefix:
+            best, best_prefix = name, prefix
+    return best
+
+def _facet_value_counts(facet: str) -> List[Dict]:
+    return [
+        {"$group": {"_id": f"${ITEM_FACETS[facet]}", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}}
+    ]
+
+def facet_counts_pipeline(match_stage: Dict, facets: List[str] = None) -> List[Dict]:
+    """One $facet aggregation returning the value counts of every facet for the selection.
+
+    Only the leading $match can use an index; the sub-pipelines share its documents.
+    """
+    return [
+        {"$match": match_stage},
+        {"$facet": {facet: _facet_value_counts(facet) for facet in facets or ITEM_FACETS}}
+    ]
+
+def run_facet_counts(collection, match_stage: Dict, facets: List[str] = None, hint=None,
+                     timeout_ms: int = DEFAULT_TIMEOUT_MS) -> Tuple[Dict[str, Dict], float]:
+    """Return ({facet: {value: count}}, time_ms) from a single round trip"""
+    result, elapsed = run_aggregate(collection, facet_counts_pipeline(match_stage, facets), hint, timeout_ms)
+    rows_by_facet = result[0] if result else {}
+    counts = {facet: {row["_id"]: row["count"] for row in rows} for facet, rows in rows_by_facet.items()}
+    return counts, elapsed
+
+def benchmark_facets(collection, match_stage: Dict, facets: List[str] = None, hint=None,
+                     timeout_ms: int = DEFAULT_TIMEOUT_MS) -> Dict:
+    """Time the single $facet round trip and each facet as its own query"""
+    facets = facets or list(ITEM_FACETS)
+    counts, facet_ms = run_facet_counts(collection, match_stage, facets, hint, timeout_ms)
+    per_facet = {}
+    for facet in facets:
+        _, elapsed = run_aggregate(collection, [{"$match": match_stage}] + _facet_value_counts(facet),
+                                   hint, timeout_ms)
+        per_facet[facet] = {"time_ms": elapsed, "values": len(counts.get(facet, {}))}
+    return {
+        "counts": counts,
+        "facet_ms": facet_ms,
+        "per_facet": per_facet,
+        "separate_total_ms": sum(run["time_ms"] for run in per_facet.values())
+    }
+
+# Lateness analytics (nzpost_summary_item, typed sla_days and initial_edd)
+DELIVERED_CODE = 500
+INITIAL_EDD_FIELD = "parcel_details.product.initial_edd"
+SERVICE_CODE_FIELD = "parcel_details.product.service_code"
+LATENESS_INDEX_NAME = "lateness_edifact_code_1_initial_edd_1_tpid_1_service_code_1_event_datetime_1"
+LATENESS_INDEX_KEY = [("edifact_code", 1), (INITIAL_EDD_FIELD, 1), ("tpid", 1), (SERVICE_CODE_FIELD, 1),
+                      ("event_datetime", 1)]
+
+def overdue_pipeline(as_of: datetime, in_flight_codes: List[int], tpids: List[int] = None) -> List[Dict]:
+    """Undelivered parcels past their EDD per (tpid, service code); bounded and covered by the lateness index"""
+    match = {"edifact_code": {"$in": in_flight_codes}, INITIAL_EDD_FIELD: {"$lt": as_of}}
+    if tpids:
+        match["tpid"] = {"$in": tpids}
+    return [
+        {"$match": match},
+        {"$group": {"_id": {"tpid": "$tpid", "service_code": f"${SERVICE_CODE_FIELD}"}, "overdue": {"$sum": 1}}}
+    ]
+
+def delivered_lateness_pipeline(tpids: List[int] = None) -> List[Dict]:
+    """Delivered and delivered-after-EDD parcels per (tpid, service code).
+
+    The comparison is summed in $group rather than filtered with $expr, so the
+    scan of the delivered keys stays covered by the lateness index.
+    """
+    match = {"edifact_code": DELIVERED_CODE}
+    if tpids:
+        match["tpid"] = {"$in": tpids}
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {"tpid": "$tpid", "service_code": f"${SERVICE_CODE_FIELD}"},
+            "delivered": {"$sum": 1},
+            "delivered_late": {"$sum": {"$cond": [{"$gt": ["$event_datetime", f"${INITIAL_EDD_FIELD}"]}, 1, 0]}}
+        }}
+    ]
+
+def lateness_as_of(collection) -> Optional[datetime]:
+    """Latest event time in the collection, the default point in time for overdue parcels"""
+    latest = list(collection.find({}, {"event_datetime": 1, "_id": 0}).sort("event_datetime", -1).limit(1))
+    return latest[0]["event_datetime"] if latest else None
+
+def late_parcel_report(collection, in_flight_codes: List[int], as_of: datetime = None, tpids: List[int] = None,
+                       timeout_ms: int = DEFAULT_TIMEOUT_MS) -> Dict:
+    """Late parcels per TPID and service code.
+
+    Returns {"as_of", "rows": [{tpid, service_code, overdue, delivered, delivered_late, late_rate}], "time_ms"}.
+    """
+    as_of = as_of or lateness_as_of(collection)
+    hint = LATENESS_INDEX_NAME if LATENESS_INDEX_NAME in collection.index_information() else None
+    overdue, overdue_ms = run_aggregate(collection, overdue_pipeline(as_of, in_flight_codes, tpids), hint, timeout_ms)
+    delivered, delivered_ms = run_aggregate(collection, delivered_lateness_pipeline(tpids), hint, timeout_ms)
+
+    rows = {}
+    for row in overdue + delivered:
+        key = (row["_id"]["tpid"], row["_id"].get("service_code"))
+        entry = rows.setdefault(key, {"tpid": key[0], "service_code": key[1], "overdue": 0,
+                                      "delivered": 0, "delivered_late": 0})
+        for field in ("overdue", "delivered", "delivered_late"):
+            entry[field] += row.get(field, 0)
+    for entry in rows.values():
+        entry["late_rate"] = entry["delivered_late"] / entry["delivered"] if entry["delivered"] else None
+    return {
+        "as_of": as_of,
+        "hint": hint,
+        "rows": [rows[key] for key in sorted(rows, key=lambda k: (k[0], str(k[1])))],
+        "time_ms": {"overdue": overdue_ms, "delivered": delivered_ms}
+    }
+
+# Keyset-paginated parcel listing
+LISTING_PAGE_SIZE = 200
+LISTING_INDEX_NAME = "tpid_1_tracking_reference_1"
+LISTING_FIELDS = ["tracking_reference", "tpid", "edifact_code", "event_description", "event_datetime"]
+LATEST_LISTING_INDEX_NAME = "source_1_tpid_1_tracking_reference_1"
+LATEST_LISTING_FIELDS = ["tracking_reference", "tpid", "edifact_code", "timestamp"]
+
+def _listing_source(collection) -> Tuple[object, Dict, str, List[str]]:
+    """(collection to page, base filter, index, fields); time series parcels are read from latest_status"""
+    if is_time_series(collection):
+        return (collection.database[LATEST_STATUS_COLLECTION], {"source": collection.name},
+                LATEST_LISTING_INDEX_NAME, LATEST_LISTING_FIELDS)
+    return collection, {}, LISTING_INDEX_NAME, LISTING_FIELDS
+
+def listing_fields(collection) -> List[str]:
+    return _listing_source(collection)[3]
+
+def parcel_pages(collection, match_stage: Dict, page_size: int = LISTING_PAGE_SIZE,
+                 after: Optional[Tuple[int, str]] = None):
+    """Yield pages of parcels in (tpid, tracking_reference) order.
+
+    Each page is one bounded find on the (tpid, tracking_reference) index: an
+    equality on one TPID and tracking_reference greater than the last row seen,
+    so a page costs the same however deep it is and skip is never used. TPIDs
+    are paged one after the other; after=(tpid, tracking_reference) resumes
+    behind that row. Time series parcels are listed from latest_status, which is
+    as fresh as the last refresh_append_rollup.py run.
+    """
+    source, base_filter, hint, fields = _listing_source(collection)
+    tpid_part, rest = split_tpid_filter(match_stage)
+    tpids = _condition_values(tpid_part["tpid"]) if set(tpid_part) == {"tpid"} else None
+    if tpids is None:
+        tpids = source.distinct("tpid", {**base_filter, **tpid_part})
+    projection = {field: 1 for field in fields}
+    projection["_id"] = 0
+
+    for tpid in sorted(tpids):
+        if after and tpid < after[0]:
+            continue
+        last_reference = after[1] if after and tpid == after[0] else None
+        while True:
+            query = {**base_filter, **rest, "tpid": tpid}
+            if last_reference is not None:
+                query["tracking_reference"] = {"$gt": last_reference}
+            page = list(source.find(query, projection)
+                        .sort([("tpid", 1), ("tracking_reference", 1)])
+                        .hint(hint)
+                        .limit(page_size))
+            if page:
+                yield page
+                last_reference = page[-1]["tracking_reference"]
+            if len(page) < page_size:
+                break
+
+# Parcel timelines (ordered event history per tracking reference)
+TIMELINE_INDEX_NAME = "tracking_reference_1_timestamp_1"
+REFERENCE_INDEX_NAME = "tracking_reference_1"
+TIMELINE_MAX_BATCH = 5000
+
+def timeline_query(collection, references: List[str],
+                   time_series: Optional[bool] = None) -> Tuple[Dict, List[Tuple[str, int]], str]:
+    """(filter, sort, hint) returning the events of the references ordered by reference and time.
+
+    On time series collections tracking_reference_1_timestamp_1 returns the events
+    already in that order; regular collections hold one event per parcel. Pass
+    time_series when it is already known to skip the listCollections round trip.
+    """
+    if time_series is None:
+        time_series = is_time_series(collection)
+    if time_series:
+        return ({"tracking_reference": {"$in": references}},
+                [("tracking_reference", 1), ("timestamp", 1)], TIMELINE_INDEX_NAME)
+    return {"tracking_reference": {"$in": references}}, [("tracking_reference", 1)], REFERENCE_INDEX_NAME
+
+def parcel_timelines(collection, references: List[str], batch_size: int = TIMELINE_MAX_BATCH,
+                     time_series: Optional[bool] = None) -> Dict[str, List[Dict]]:
+    """Event history of each reference; up to batch_size references per $in round trip"""
+    timelines = {reference: [] for reference in references}
+    unique = list(timelines)
+    if time_series is None:
+        time_series = is_time_series(collection)
+    for offset in range(0, len(unique), batch_size):
+        filter_doc, sort, hint = timeline_query(collection, unique[offset:offset + batch_size], time_series)
+        for event in collection.find(filter_doc, {"_id": 0}).sort(sort).hint(hint):
+            timelines[event["tracking_reference"]].append(event)
+    return timelines
+
+def parcel_timeline(collection, tracking_reference: str) -> List[Dict]:
+    """Ordered event history of one parcel"""
+    return parcel_timelines(collection, [tracking_reference])[tracking_reference]
+
+# Suffix / partial tracking reference search
+REVERSED_REFERENCE_FIELD = "tracking_reference_reversed"
+REVERSED_REFERENCE_INDEX_NAME = "tracking_reference_reversed_1"
+REFERENCE_SEARCH_LIMIT = 100
+# Generated references zero-pad to at least nine digits; the append data runs to thirteen
+MIN_REFERENCE_DIGITS = 9
+
+def reference_search_match(text: str) -> Tuple[Dict, str, Optional[str]]:
+    """(match, method, hint) for a tracking number search.
+
+    - NZ100000001 or NZ1000000000123: exact reference (NZ and at least MIN_REFERENCE_DIGITS digits)
+    - NZ1000* or NZ1000: prefix, an anchored regex on tracking_reference_1
+    - 1234 or *1234: suffix, an anchored regex on the reversed reference
+    - *1234*: contains, an unanchored regex that still scans every key
+    """
+    text = text.strip().upper()
+    contains = text.startswith("*") and text.endswith("*") and len(text) > 1
+    term = text.strip("*")
+    if contains:
+        return {"tracking_reference": {"$regex": re.escape(term)}}, "contains", None
+    if term.startswith(TRACKING_REFERENCE_PREFIX) and not text.startswith("*"):
+        digits = term[len(TRACKING_REFERENCE_PREFIX):]
+        if digits.isdigit() and len(digits) >= MIN_REFERENCE_DIGITS and not text.endswith("*"):
+            return {"tracking_reference": term}, "exact", REFERENCE_INDEX_NAME
+        return {"tracking_reference": {"$regex": f"^{re.escape(term)}"}}, "prefix", REFERENCE_INDEX_NAME
+    return ({REVERSED_REFERENCE_FIELD: {"$regex": f"^{re.escape(term[::-1])}"}}, "suffix",
+            REVERSED_REFERENCE_INDEX_NAME)
+
+def plain_regex_match(text: str) -> Dict:
+    """The unindexed equivalent of a suffix search: an unanchored regex on tracking_reference"""
+    return {"tracking_reference": {"$regex": f"{re.escape(text.strip().strip('*').upper())}$"}}
+
+def search_references(collection, text: str, limit: int = REFERENCE_SEARCH_LIMIT) -> Dict:
+    """Parcels whose tracking reference matches the search; {"rows", "method", "time_ms"}.
+
+    An exact reference that matches nothing is retried as a prefix, since it may be
+    the start of a longer reference.
+    """
+    match, method, hint = reference_search_match(text)
+    start_time = time.time()
+    cursor = collection.find(match, {"_id": 0}).limit(limit)
+    if hint:
+        cursor = cursor.hint(hint)
+    rows = list(cursor)
+    if not rows and method == "exact":
+        match, method, hint = reference_search_match(text.strip() + "*")
+        rows = list(collection.find(match, {"_id": 0}).limit(limit).hint(hint))
+    return {"rows": rows, "method": method, "match": match, "time_ms": (time.time() - start_time) * 1000}
+
+# Status-by-TPID matrix: every count the GUI shows from one grouped pass
+STATUS_MATRIX_INDEX_NAME = "tpid_1_edifact_code_1_event_datetime_1"
+
+def _in_range_expression(field: str, bounds: Dict) -> Dict:
+    return {"$and": [{op: [f"${field}", bounds[op]]} for op in ("$gte", "$gt", "$lte", "$lt") if op in bounds]}
+
+def status_matrix_pipeline(match_stage: Dict, date_field: str = "event_datetime") -> List[Dict]:
+    """$group on (tpid, edifact_code) over the match without its status and date filters.
+
+    The Parcels total ignores the date range, so the range is evaluated as an
+    in_range flag of the group key rather than filtered on: one pass gives both the
+    totals and the in-range status counts. With only tpid, edifact_code and the date
+    referenced, tpid_1_edifact_code_1_event_datetime_1 answers it without fetching
+    documents.
+    """
+    rest = {field: condition for field, condition in match_stage.items()
+            if field not in (date_field, "edifact_code")}
+    group_id = {"tpid": "$tpid", "edifact_code": "$edifact_code"}
+    if isinstance(match_stage.get(date_field), dict):
+        group_id["in_range"] = _in_range_expression(date_field, match_stage[date_field])
+    return [{"$match": rest}, {"$group": {"_id": group_id, "count": {"$sum": 1}}}]
+
+def latest_status_matrix_pipeline(strategy: str, match_stage: Dict, collection_name: str = None) -> List[Dict]:
+    """Parcels per (tpid, latest edifact code) of a time series collection"""
+    latest_match = {field: condition for field, condition in match_stage.items() if field != "edifact_code"}
+    return latest_events_pipeline(strategy, latest_match, collection_name) + [
+        {"$group": {"_id": {"tpid": "$tpid", "edifact_code": "$edifact_code"}, "count": {"$sum": 1}}}
+    ]
+
+def status_matrix_hint(collection, match_stage: Dict) -> Optional[str]:
+    """The covering index when the matrix filters on TPIDs only, else None"""
+    tpid_part, rest = split_tpid_filter(match_stage)
+    if rest or STATUS_MATRIX_INDEX_NAME not in collection.index_information():
+        return None
+    return STATUS_MATRIX_INDEX_NAME
+
+def compute_status_matrix(collection, match_stage: Dict, strategy: str = None, distinct_strategy: str = "group",
+                          timeout_ms: int = DEFAULT_TIMEOUT_MS, time_series: Optional[bool] = None) -> Dict:
+    """Counts per (tpid, edifact_code) for the match with any status filter removed.
+
+    Returns {"cells": {(tpid, edifact_code): {"events", "in_range"}}, "total", "pipeline",
+    "hint", "time_ms"}. "total" is the Parcels figure (TPID filter only); time series
+    collections count each parcel once, under its latest event in the date range, and
+    count the total with distinct_strategy when a date range is set.
+    """
+    start_time = time.time()
+    if time_series is None:
+        time_series = is_time_series(collection)
+    if time_series:
+        strategy = strategy or get_latest_strategy(collection)
+        pipeline = latest_status_matrix_pipeline(strategy, match_stage, collection.name)
+        hint = latest_strategy_hint(strategy)
+        rows, _ = run_aggregate(latest_strategy_target(collection, strategy), pipeline, hint=hint,
+                                timeout_ms=timeout_ms)
+    else:
+        pipeline = status_matrix_pipeline(match_stage)
+        hint = status_matrix_hint(collection, pipeline[0]["$match"])
+        rows, _ = run_aggregate(collection, pipeline, hint=hint, timeout_ms=timeout_ms)
+
+    cells = {}
+    for row in rows:
+        cell = cells.setdefault((row["_id"]["tpid"], row["_id"]["edifact_code"]), {"events": 0, "in_range": 0})
+        cell["events"] += row["count"]
+        if row["_id"].get("in_range", True):
+            cell["in_range"] += row["count"]
+    total = sum(cell["events"] for cell in cells.values())
+    if time_series and "timestamp" in match_stage:
+        # With a date range the cells only hold parcels that have events in the range
+        tpid_part, _ = split_tpid_filter(match_stage)
+        total = count_distinct_parcels(collection, tpid_part, strategy=distinct_strategy,
+                                       timeout_ms=timeout_ms)["count"]
+    return {"cells": cells, "total": total, "pipeline": pipeline, "hint": hint,
+            "time_ms": (time.time() - start_time) * 1000}
+
+def matrix_status_count(matrix: Dict, codes: List[int], tpids: List[int] = None) -> int:
+    """In-range count of the given statuses, optionally for some of the matrix's TPIDs"""
+    return sum(cell["in_range"] for (tpid, code), cell in matrix["cells"].items()
+               if code in codes and (tpids is None or tpid in tpids))
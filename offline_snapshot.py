@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Offline Snapshot for NZ Post Databases
+
+Exports one row per parcel (tracking reference number, tpid, status code,
+timestamp) from a collection into memory-mapped NumPy files, so that any
+TPID x status x date range count can be answered in milliseconds without
+MongoDB:
+1. Rows are sorted by (tpid, timestamp), so each TPID is one contiguous row
+   range and a date range inside it is found with a binary search
+2. Each status has a bitmap (np.packbits, one bit per row) so status filters
+   are a bitwise OR over the selected range
+
+For time series collections a row is the parcel's latest event, and the date
+range applies to that event's timestamp (the same semantics as the
+status_daily_counts counters).
+
+A snapshot records the dataset manifest it was taken from and is only used
+while that manifest is unchanged and still matches the collection.
+"""
+
+import argparse
+import json
+import numpy as np
+import os
+import pymongo
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from columnar_fetch import fetch_columns, aggregate_columns
+from dataset_manifest import get_manifest, is_manifest_current
+
+# MongoDB connection parameters
+MONGO_URI = "mongodb://localhost:27017/"
+
+# Collection names
+COLLECTIONS = [
+    "summary_1_week",
+    "summary_2_weeks",
+    "summary_1_month",
+    "summary_3_months"
+]
+
+SNAPSHOT_DIR = "snapshots"
+TRACKING_REFERENCE_PREFIX = "NZ"
+
+def snapshot_path(db_name: str, collection_name: str, directory: str = SNAPSHOT_DIR) -> str:
+    return os.path.join(directory, db_name, collection_name)
+
+def _reference_numbers(references: np.ndarray) -> np.ndarray:
+    """Numeric part of the tracking references as int64"""
+    return np.char.lstrip(references.astype("S"), TRACKING_REFERENCE_PREFIX.encode()).astype(np.int64)
+
+def _parcel_columns(collection) -> Dict[str, np.ndarray]:
+    """One row per parcel with tracking_reference, tpid, edifact_code and timestamp columns"""
+    if "timeseries" in collection.options():
+        columns = aggregate_columns(collection, [
+            {"$group": {
+                "_id": "$tracking_reference",
+                "latest": {"$top": {"sortBy": {"timestamp": -1},
+                                    "output": {"tpid": "$tpid", "edifact_code": "$edifact_code",
+                                               "timestamp": "$timestamp"}}}
+            }},
+            {"$project": {"_id": 0, "tracking_reference": "$_id", "tpid": "$latest.tpid",
+                          "edifact_code": "$latest.edifact_code", "timestamp": "$latest.timestamp"}}
+        ], ["tracking_reference", "tpid", "edifact_code", "timestamp"])
+    else:
+        columns = fetch_columns(collection, {}, ["tracking_reference", "tpid", "edifact_code", "event_datetime"])
+        columns["timestamp"] = columns.pop("event_datetime")
+    return columns
+
+def export_snapshot(db, collection_name: str, directory: str = SNAPSHOT_DIR) -> Dict:
+    """Write the snapshot files of one collection and return its metadata"""
+    start_time = time.time()
+    manifest = get_manifest(db, collection_name)
+    columns = _parcel_columns(db[collection_name])
+
+    tpids = columns["tpid"].astype(np.int32)
+    timestamps = np.asarray(columns["timestamp"], dtype="datetime64[ms]").astype(np.int64)
+    order = np.lexsort((timestamps, tpids))
+    tpids, timestamps = tpids[order], timestamps[order]
+    codes = columns["edifact_code"].astype(np.int16)[order]
+    references = _reference_numbers(columns["tracking_reference"])[order]
+
+    path = snapshot_path(db.name, collection_name, directory)
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "reference.npy"), references)
+    np.save(os.path.join(path, "tpid.npy"), tpids)
+    np.save(os.path.join(path, "edifact_code.npy"), codes)
+    np.save(os.path.join(path, "timestamp.npy"), timestamps)
+
+    # Per-status bitmaps: one packed bit per row
+    status_codes = sorted(int(code) for code in np.unique(codes))
+    np.save(os.path.join(path, "status_bitmaps.npy"),
+            np.stack([np.packbits(codes == code) for code in status_codes]) if status_codes
+            else np.zeros((0, 0), dtype=np.uint8))
+
+    # Per-TPID row ranges: rows are sorted by tpid, so each TPID is one run
+    unique_tpids, starts, counts = np.unique(tpids, return_index=True, return_counts=True)
+    meta = {
+        "database": db.name,
+        "collection": collection_name,
+        "rows": int(len(tpids)),
+        "status_codes": status_codes,
+        "tpid_ranges": {str(int(tpid)): [int(start), int(start + count)]
+                        for tpid, start, count in zip(unique_tpids, starts, counts)},
+        "manifest_generated_at": manifest["generated_at"].isoformat() if manifest else None,
+        "exported_at": datetime.now().isoformat(),
+        "export_seconds": time.time() - start_time
+    }
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    print(f"  {db.name}.{collection_name}: {meta['rows']:,} parcels exported to {path} "
+          f"in {meta['export_seconds']:.2f}s")
+    return meta
+
+class OfflineSnapshot:
+    """Memory-mapped snapshot of one collection answering TPID x status x date range counts"""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.tpid = np.load(os.path.join(path, "tpid.npy"), mmap_mode="r")
+        self.timestamp = np.load(os.path.join(path, "timestamp.npy"), mmap_mode="r")
+        self.edifact_code = np.load(os.path.join(path, "edifact_code.npy"), mmap_mode="r")
+        self.reference = np.load(os.path.join(path, "reference.npy"), mmap_mode="r")
+        self.status_bitmaps = np.load(os.path.join(path, "status_bitmaps.npy"), mmap_mode="r")
+        self.status_rows = {code: i for i, code in enumerate(self.meta["status_codes"])}
+
+    @classmethod
+    def load(cls, db_name: str, collection_name: str, directory: str = SNAPSHOT_DIR) -> Optional["OfflineSnapshot"]:
+        """Open a snapshot, or return None when it has not been exported"""
+        path = snapshot_path(db_name, collection_name, directory)
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        return cls(path)
+
+    def is_fresh(self, db) -> bool:
+        """Check that the snapshot was taken from the current manifest and the manifest still holds"""
+        manifest = get_manifest(db, self.meta["collection"])
+        if not manifest or not is_manifest_current(db, manifest):
+            return False
+        return manifest["generated_at"].isoformat() == self.meta["manifest_generated_at"]
+
+    def _row_ranges(self, tpids: Optional[List[int]], date_from: Optional[datetime],
+                    date_to: Optional[datetime]) -> List[tuple]:
+        """Row ranges for the selected TPIDs narrowed to the date range by binary search"""
+        if tpids:
+            ranges = [self.meta["tpid_ranges"][str(tpid)] for tpid in tpids if str(tpid) in self.meta["tpid_ranges"]]
+        else:
+            ranges = list(self.meta["tpid_ranges"].values())
+        low = np.datetime64(date_from, "ms").astype(np.int64) if date_from else None
+        high = np.datetime64(date_to, "ms").astype(np.int64) if date_to else None
+
+        narrowed = []
+        for start, end in ranges:
+            times = self.timestamp[start:end]
+            if low is not None:
+                start = start + int(np.searchsorted(times, low, side="left"))
+            if high is not None:
+                end = (end - len(times)) + int(np.searchsorted(times, high, side="right"))
+            if end > start:
+                narrowed.append((start, end))
+        return narrowed
+
+    def _status_count(self, start: int, end: int, codes: List[int]) -> int:
+        """Rows in [start, end) whose status is one of codes, from the packed bitmaps"""
+        rows = [self.status_rows[code] for code in codes if code in self.status_rows]
+        if not rows:
+            return 0
+        first_byte, last_byte = start // 8, (end + 7) // 8
+        combined = np.bitwise_or.reduce(self.status_bitmaps[rows, first_byte:last_byte], axis=0)
+        bits = np.unpackbits(combined)[start - first_byte * 8:end - first_byte * 8]
+        return int(bits.sum())
+
+    def count(self, tpids: Optional[List[int]] = None, codes: Optional[List[int]] = None,
+              date_from: Optional[datetime] = None, date_to: Optional[datetime] = None) -> int:
+        """Parcels for the TPIDs (all when empty) with one of the codes (any when empty) in the date range"""
+        total = 0
+        for start, end in self._row_ranges(tpids, date_from, date_to):
+            total += self._status_count(start, end, codes) if codes else end - start
+        return total
+
+    def status_counts(self, tpids: Optional[List[int]] = None, date_from: Optional[datetime] = None,
+                      date_to: Optional[datetime] = None) -> Dict[int, int]:
+        """Parcels per status code"""
+        ranges = self._row_ranges(tpids, date_from, date_to)
+        return {code: sum(self._status_count(start, end, [code]) for start, end in ranges)
+                for code in self.meta["status_codes"]}
+
+def main():
+    parser = argparse.ArgumentParser(description="Export memory-mapped snapshots for offline counts")
+    parser.add_argument("--database", action="append",
+                        choices=["nzpost_summary", "nzpost_summary_item", "nzpost_summary_append"],
+                        help="Database to export (repeatable, default: all)")
+    parser.add_argument("--collection", action="append", choices=COLLECTIONS,
+                        help="Collection to export (repeatable, default: all)")
+    parser.add_argument("--directory", default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(MONGO_URI)
+    print(f"Connected to MongoDB at {MONGO_URI}")
+    try:
+        for db_name in args.database or ["nzpost_summary", "nzpost_summary_item", "nzpost_summary_append"]:
+            print(f"\nExporting snapshots for {db_name}...")
+            for collection_name in args.collection or COLLECTIONS:
+                export_snapshot(client[db_name], collection_name, args.directory)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Parcel Export for NZ Post Databases
+
+Writes the parcels behind a count (e.g. every Attempted Delivery parcel of TPID
+1000013) to a gzip-compressed CSV or a Parquet file. Rows are read page by page
+with keyset pagination on tpid_1_tracking_reference_1 (see
+mongo_query_engine.parcel_pages) and written as each page arrives, so memory
+stays bounded by one page whatever the size of the collection.
+
+Parquet output requires pyarrow.
+"""
+
+import argparse
+import csv
+import gzip
+import pymongo
+import time
+from datetime import datetime
+from typing import Dict, Optional
+from mongo_query_engine import (LISTING_PAGE_SIZE, is_time_series, listing_fields, parcel_pages, parse_tpid_ranges,
+                                tpid_filter, tpid_ranges)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# MongoDB connection parameters
+MONGO_URI = "mongodb://localhost:27017/"
+
+# Collection names
+COLLECTIONS = [
+    "summary_1_week",
+    "summary_2_weeks",
+    "summary_1_month",
+    "summary_3_months"
+]
+
+EXPORT_FORMATS = ["csv", "parquet"]
+
+# Status name -> edifact code
+STATUS_CODES = {
+    "picked_up": 100,
+    "in_transit": 200,
+    "in_depot": 300,
+    "out_for_delivery": 400,
+    "delivered": 500,
+    "attempted_delivery": 600
+}
+
+def export_parcels(collection, match_stage: Dict, path: str, export_format: str = "csv",
+                   page_size: int = LISTING_PAGE_SIZE, progress=None) -> Dict:
+    """Stream the matching parcels to path; returns {"rows", "first_page_ms", "seconds"}"""
+    fields = listing_fields(collection)
+    start_time = time.time()
+    stats = {"rows": 0, "first_page_ms": None, "seconds": 0.0}
+
+    if export_format == "parquet":
+        if pa is None:
+            raise ImportError("pyarrow is not installed - export as csv instead")
+        writer = None
+        try:
+            for page in parcel_pages(collection, match_stage, page_size):
+                if stats["first_page_ms"] is None:
+                    stats["first_page_ms"] = (time.time() - start_time) * 1000
+                table = pa.Table.from_pylist(page)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema, compression="zstd")
+                writer.write_table(table)
+                stats["rows"] += len(page)
+                if progress:
+                    progress(stats["rows"])
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        with gzip.open(path, "wt", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            for page in parcel_pages(collection, match_stage, page_size):
+                if stats["first_page_ms"] is None:
+                    stats["first_page_ms"] = (time.time() - start_time) * 1000
+                writer.writerows(page)
+                stats["rows"] += len(page)
+                if progress:
+                    progress(stats["rows"])
+
+    stats["seconds"] = time.time() - start_time
+    return stats
+
+def build_match(collection, tpids, status: Optional[str], date_from: Optional[datetime],
+                date_to: Optional[datetime], ranges=None) -> Dict:
+    """Match stage with the same fields the GUI uses; TPIDs and ranges compile to range predicates"""
+    match_stage = tpid_filter(tpid_ranges(tpids or []) + (ranges or []))
+    if status:
+        match_stage["edifact_code"] = STATUS_CODES[status]
+    if date_from or date_to:
+        date_field = "timestamp" if is_time_series(collection) else "event_datetime"
+        match_stage[date_field] = {}
+        if date_from:
+            match_stage[date_field]["$gte"] = date_from
+        if date_to:
+            match_stage[date_field]["$lte"] = date_to
+    return match_stage
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the parcels behind a count")
+    parser.add_argument("--database", default="nzpost_summary",
+                        choices=["nzpost_summary", "nzpost_summary_item", "nzpost_summary_append"])
+    parser.add_argument("--collection", default="summary_1_week", choices=COLLECTIONS)
+    parser.add_argument("--tpid", type=int, action="append", help="TPID to export (repeatable, default: all)")
+    parser.add_argument("--tpid-range", type=parse_tpid_ranges, action="append", default=[],
+                        help="TPID ranges to export, e.g. 2000011-2000110 or 2000011+ (repeatable)")
+    parser.add_argument("--status", choices=list(STATUS_CODES), help="Status to export (default: all)")
+    parser.add_argument("--from-date", type=datetime.fromisoformat)
+    parser.add_argument("--to-date", type=datetime.fromisoformat)
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--page-size", type=int, default=LISTING_PAGE_SIZE)
+    parser.add_argument("--output", help="Output file (default: parcels_<collection>.csv.gz or .parquet)")
+    args = parser.parse_args()
+
+    output = args.output or f"parcels_{args.collection}.{'csv.gz' if args.format == 'csv' else 'parquet'}"
+    client = pymongo.MongoClient(MONGO_URI)
+    print(f"Connected to MongoDB at {MONGO_URI}")
+    try:
+        collection = client[args.database][args.collection]
+        match_stage = build_match(collection, args.tpid, args.status, args.from_date, args.to_date,
+                                  [tpid_range for ranges in args.tpid_range for tpid_range in ranges])
+        print(f"Exporting {args.database}.{args.collection} {match_stage} to {output}...")
+        stats = export_parcels(collection, match_stage, output, args.format, args.page_size,
+                               progress=lambda rows: print(f"  {rows:,} rows", end="\r"))
+        first_page = f"{stats['first_page_ms']:.2f}ms" if stats["first_page_ms"] is not None else "-"
+        print(f"\n{stats['rows']:,} parcels written in {stats['seconds']:.2f}s (first page {first_page})")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Tracking Reference Search Benchmark for NZ Post Databases
+
+Customers and call-centre staff often know only the last few digits of a
+tracking number. An unanchored regex such as /4321$/ cannot use the bounds of
+tracking_reference_1, so it scans every key of the index. The generators also
+write tracking_reference_reversed, which turns a suffix search into an anchored
+prefix regex (/^1234/) on tracking_reference_reversed_1.
+
+For every database and collection size, this script times both forms for
+sampled 4- and 6-digit suffixes and checks they return the same parcels.
+"""
+
+import argparse
+import pymongo
+import random
+import statistics
+import time
+from datetime import datetime
+from typing import Dict, List
+from mongo_query_engine import REVERSED_REFERENCE_INDEX_NAME, plain_regex_match, reference_search_match
+
+# MongoDB connection parameters
+MONGO_URI = "mongodb://localhost:27017/"
+
+DATABASES = ["nzpost_summary", "nzpost_summary_item", "nzpost_summary_append"]
+
+# Collection names
+COLLECTIONS = [
+    "summary_1_week",
+    "summary_2_weeks",
+    "summary_1_month",
+    "summary_3_months"
+]
+
+DEFAULT_SUFFIX_LENGTHS = [4, 6]
+DEFAULT_SEARCHES = 20
+
+def sample_suffixes(collection, length: int, size: int) -> List[str]:
+    """Suffixes of randomly sampled tracking references"""
+    rows = collection.aggregate([{"$sample": {"size": size}},
+                                 {"$project": {"_id": 0, "tracking_reference": 1}}])
+    return [row["tracking_reference"][-length:] for row in rows]
+
+def time_search(collection, match: Dict, hint=None) -> Dict:
+    """Latency and matched references of one search"""
+    start_time = time.time()
+    cursor = collection.find(match, {"_id": 0, "tracking_reference": 1})
+    if hint:
+        cursor = cursor.hint(hint)
+    references = sorted(row["tracking_reference"] for row in cursor)
+    return {"time_ms": (time.time() - start_time) * 1000, "references": references}
+
+def benchmark_suffixes(collection, suffixes: List[str]) -> Dict:
+    """Median latency of indexed and plain regex suffix searches, and whether their results agree"""
+    indexed_ms, plain_ms, mismatches, matches = [], [], 0, 0
+    for suffix in suffixes:
+        match, _, hint = reference_search_match(suffix)
+        indexed = time_search(collection, match, hint)
+        plain = time_search(collection, plain_regex_match(suffix))
+        indexed_ms.append(indexed["time_ms"])
+        plain_ms.append(plain["time_ms"])
+        matches += len(indexed["references"])
+        if indexed["references"] != plain["references"]:
+            mismatches += 1
+    indexed_median = statistics.median(indexed_ms)
+    plain_median = statistics.median(plain_ms)
+    return {
+        "indexed_ms": indexed_median,
+        "plain_ms": plain_median,
+        "speedup": plain_median / indexed_median if indexed_median > 0 else None,
+        "avg_matches": matches / len(suffixes),
+        "mismatches": mismatches
+    }
+
+def print_report(db_name: str, results: Dict[str, Dict[int, Dict]]):
+    """Print suffix search latency per collection and suffix length"""
+    print(f"\n===== Suffix Search: {db_name} =====")
+    print(f"{'Collection':<20}{'Digits':>7}{'Matches':>10}{'Indexed (ms)':>14}{'Regex (ms)':>12}"
+          f"{'Speedup':>9}{'Mismatches':>12}")
+    for collection_name, by_length in results.items():
+        for length, result in by_length.items():
+            speedup = f"{result['speedup']:.1f}x" if result["speedup"] else "-"
+            print(f"{collection_name:<20}{length:>7}{result['avg_matches']:>10.1f}{result['indexed_ms']:>14.2f}"
+                  f"{result['plain_ms']:>12.2f}{speedup:>9}{result['mismatches']:>12}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare indexed suffix search with a plain regex")
+    parser.add_argument("--database", action="append", choices=DATABASES,
+                        help="Database to test (repeatable, default: all)")
+    parser.add_argument("--collection", action="append", choices=COLLECTIONS,
+                        help="Collection to test (repeatable, default: all)")
+    parser.add_argument("--digits", type=int, action="append",
+                        help="Suffix length to test (repeatable, default: 4 and 6)")
+    parser.add_argument("--searches", type=int, default=DEFAULT_SEARCHES, help="Searches per suffix length")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(MONGO_URI)
+    print(f"Connected to MongoDB at {MONGO_URI}")
+    print(f"Benchmark started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    try:
+        for db_name in args.database or DATABASES:
+            db = client[db_name]
+            existing = db.list_collection_names()
+            results = {}
+            for collection_name in args.collection or COLLECTIONS:
+                if collection_name not in existing:
+                    continue
+                collection = db[collection_name]
+                if REVERSED_REFERENCE_INDEX_NAME not in collection.index_information():
+                    print(f"  {db_name}.{collection_name} has no {REVERSED_REFERENCE_INDEX_NAME} - "
+                          f"regenerate it or run create_mongo_indexes.py")
+                    continue
+                print(f"  Testing {db_name}.{collection_name}...")
+                results[collection_name] = {}
+                for length in args.digits or DEFAULT_SUFFIX_LENGTHS:
+                    suffixes = sample_suffixes(collection, length, args.searches)
+                    random.shuffle(suffixes)
+                    results[collection_name][length] = benchmark_suffixes(collection, suffixes)
+            print_report(db_name, results)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Incremental Latest-Status Refresher for the NZ Post Append Database
+
+The time series collections in nzpost_summary_append only grow. Instead of
+recomputing the latest status of every parcel on each query, this script keeps
+two derived collections up to date:
+1. latest_status - one document per parcel holding its most recent event
+2. status_daily_counts - parcel counts per (tpid, latest edifact_code, day)
+
+Each refresh only reads events newer than the `timestamp` watermark stored in
+`rollup_watermarks`, folds them into both collections through `$merge` and then
+advances the watermark. Events that arrive with a timestamp older than the
+watermark are not picked up; run with --rebuild to recompute from scratch.
+
+Run once on demand, or with --interval to refresh on a schedule.
+"""
+
+import argparse
+import pymongo
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from build_daily_rollup import day_bounds, is_tpid_or
+
+# MongoDB connection parameters
+MONGO_URI = "mongodb://localhost:27017/"
+DATABASE = "nzpost_summary_append"
+
+# Collection names
+COLLECTIONS = [
+    "summary_1_week",
+    "summary_2_weeks",
+    "summary_1_month",
+    "summary_3_months"
+]
+
+# Derived collections
+LATEST_STATUS_COLLECTION = "latest_status"
+STATUS_COUNTS_COLLECTION = "status_daily_counts"
+WATERMARK_COLLECTION = "rollup_watermarks"
+STATUS_COUNTS_INDEX_NAME = "source_1_tpid_1_edifact_code_1_day_1_count_1"
+
+def ensure_rollup_indexes(db):
+    """Create the indexes used to read the derived collections"""
+    db[STATUS_COUNTS_COLLECTION].create_index(
+        [("source", 1), ("tpid", 1), ("edifact_code", 1), ("day", 1), ("count", 1)],
+        name=STATUS_COUNTS_INDEX_NAME
+    )
+    db[LATEST_STATUS_COLLECTION].create_index(
+        [("source", 1), ("tpid", 1), ("tracking_reference", 1)],
+        name="source_1_tpid_1_tracking_reference_1"
+    )
+    db[LATEST_STATUS_COLLECTION].create_index(
+        [("source", 1), ("tpid", 1), ("edifact_code", 1), ("day", 1)],
+        name="source_1_tpid_1_edifact_code_1_day_1"
+    )
+
+def get_watermark(db, collection_name: str) -> Optional[datetime]:
+    """Return the timestamp up to which events have been folded in"""
+    state = db[WATERMARK_COLLECTION].find_one({"_id": collection_name})
+    return state["timestamp"] if state else None
+
+def get_max_timestamp(collection) -> Optional[datetime]:
+    """Return the newest event timestamp using the timestamp index"""
+    latest = list(collection.find({}, {"timestamp": 1, "_id": 0}).sort("timestamp", -1).limit(1))
+    return latest[0]["timestamp"] if latest else None
+
+def reset_rollup(db, collection_name: str):
+    """Forget all derived state for a collection so the next refresh rebuilds it"""
+    db[LATEST_STATUS_COLLECTION].delete_many({"source": collection_name})
+    db[STATUS_COUNTS_COLLECTION].delete_many({"source": collection_name})
+    db[WATERMARK_COLLECTION].delete_one({"_id": collection_name})
+
+def refresh_collection(db, collection_name: str) -> Dict:
+    """Fold events newer than the watermark into the derived collections"""
+    start_time = time.time()
+    source = db[collection_name]
+    batch_name = f"_latest_status_batch_{collection_name}"
+    delta_name = f"_status_delta_batch_{collection_name}"
+
+    watermark = get_watermark(db, collection_name)
+    new_watermark = get_max_timestamp(source)
+    stats = {
+        "source": collection_name,
+        "previous_watermark": watermark,
+        "watermark": watermark,
+        "events_scanned": 0,
+        "parcels_updated": 0,
+        "counter_rows_touched": 0,
+        "seconds": 0.0
+    }
+
+    if new_watermark is None or (watermark is not None and new_watermark <= watermark):
+        stats["seconds"] = time.time() - start_time
+        return stats
+
+    time_filter = {"$lte": new_watermark}
+    if watermark is not None:
+        time_filter["$gt"] = watermark
+
+    # 1. Latest new event per parcel, carrying only the fields the counters need
+    source.aggregate([
+        {"$match": {"timestamp": time_filter}},
+        {"$group": {
+            "_id": "$tracking_reference",
+            "latest": {"$top": {
+                "sortBy": {"timestamp": -1},
+                "output": {"tpid": "$tpid", "edifact_code": "$edifact_code", "timestamp": "$timestamp"}
+            }},
+            "events": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": {"source": collection_name, "tracking_reference": "$_id"},
+            "source": collection_name,
+            "tracking_reference": "$_id",
+            "tpid": "$latest.tpid",
+            "edifact_code": "$latest.edifact_code",
+            "timestamp": "$latest.timestamp",
+            "day": {"$dateTrunc": {"date": "$latest.timestamp", "unit": "day"}},
+            "events": 1
+        }},
+        {"$out": batch_name}
+    ], allowDiskUse=True)
+
+    # 2. Counter deltas: -1 for the parcel's previous latest state, +1 for the new one
+    db[batch_name].aggregate([
+        {"$lookup": {
+            "from": LATEST_STATUS_COLLECTION,
+            "localField": "_id",
+            "foreignField": "_id",
+            "as": "prior"
+        }},
+        {"$set": {"prior": {"$first": "$prior"}}},
+        # Ignore parcels whose stored state is already newer than this batch
+        {"$match": {"$expr": {"$or": [
+            {"$eq": [{"$type": "$prior"}, "missing"]},
+            {"$gte": ["$timestamp", "$prior.timestamp"]}
+        ]}}},
+        {"$project": {
+            "_id": 0,
+            "deltas": {"$concatArrays": [
+                [{"tpid": "$tpid", "edifact_code": "$edifact_code", "day": "$day", "count": 1}],
+                {"$cond": [
+                    {"$eq": [{"$type": "$prior"}, "missing"]},
+                    [],
+                    [{"tpid": "$prior.tpid", "edifact_code": "$prior.edifact_code",
+                      "day": "$prior.day", "count": -1}]
+                ]}
+            ]}
+        }},
+        {"$unwind": "$deltas"},
+        {"$group": {
+            "_id": {
+                "source": collection_name,
+                "tpid": "$deltas.tpid",
+                "edifact_code": "$deltas.edifact_code",
+                "day": "$deltas.day"
+            },
+            "count": {"$sum": "$deltas.count"}
+        }},
+        {"$match": {"count": {"$ne": 0}}},
+        {"$out": delta_name}
+    ], allowDiskUse=True)
+
+    db[delta_name].aggregate([
+        {"$set": {
+            "source": "$_id.source",
+            "tpid": "$_id.tpid",
+            "edifact_code": "$_id.edifact_code",
+            "day": "$_id.day"
+        }},
+        {"$merge": {
+            "into": STATUS_COUNTS_COLLECTION,
+            "whenMatched": [{"$set": {"count": {"$add": ["$count", "$$new.count"]}}}],
+            "whenNotMatched": "insert"
+        }}
+    ])
+
+    # 3. Fold the batch into the per-parcel latest status, keeping whichever is newer
+    db[batch_name].aggregate([
+        {"$unset": "events"},
+        {"$merge": {
+            "into": LATEST_STATUS_COLLECTION,
+            "whenMatched": [{"$replaceWith": {"$cond": [
+                {"$gte": ["$$new.timestamp", "$timestamp"]}, "$$new", "$$ROOT"
+            ]}}],
+            "whenNotMatched": "insert"
+        }}
+    ])
+
+    events = list(db[batch_name].aggregate([{"$group": {"_id": None, "events": {"$sum": "$events"}}}]))
+    stats["events_scanned"] = events[0]["events"] if events else 0
+    stats["parcels_updated"] = db[batch_name].estimated_document_count()
+    stats["counter_rows_touched"] = db[delta_name].estimated_document_count()
+    db[batch_name].drop()
+    db[delta_name].drop()
+
+    # 4. Advance the watermark only once both collections include the batch
+    stats["watermark"] = new_watermark
+    stats["seconds"] = time.time() - start_time
+    db[WATERMARK_COLLECTION].replace_one(
+        {"_id": collection_name},
+        {"_id": collection_name, "timestamp": new_watermark, "refreshed_at": datetime.now(), "last_run": stats},
+        upsert=True
+    )
+    return stats
+
+def refresh_all(client, collection_names: List[str], rebuild: bool = False) -> List[Dict]:
+    """Refresh every requested collection and print the work each refresh did"""
+    db = client[DATABASE]
+    ensure_rollup_indexes(db)
+
+    results = []
+    for collection_name in collection_names:
+        if rebuild:
+            print(f"  Resetting derived state for {collection_name}")
+            reset_rollup(db, collection_name)
+        stats = refresh_collection(db, collection_name)
+        print(f"  {collection_name}: {stats['events_scanned']:,} events, "
+              f"{stats['parcels_updated']:,} parcels, {stats['counter_rows_touched']:,} counter rows "
+              f"in {stats['seconds']:.2f}s (watermark {stats['watermark']})")
+        results.append(stats)
+    return results
+
+def latest_rollup_match(db, collection_name: str, match_stage: Dict) -> Optional[Dict]:
+    """Translate a time series match stage into a status_daily_counts match stage.
+
+    The counters hold each parcel's latest event overall, which equals the latest
+    event within the date range only when the range reaches past the watermark.
+    Returns None when the counters are behind the source or cannot answer the filters.
+    """
+    watermark = get_watermark(db, collection_name)
+    if watermark is None or get_max_timestamp(db[collection_name]) != watermark:
+        return None
+
+    query = {"source": collection_name}
+    for field, condition in match_stage.items():
+        if field in ("tpid", "edifact_code") or (field == "$or" and is_tpid_or(condition)):
+            query[field] = condition
+        elif field == "timestamp":
+            upper = condition.get("$lte", condition.get("$lt"))
+            if upper is None or upper < watermark:
+                return None
+            day_filter = day_bounds(condition)
+            if day_filter is None:
+                return None
+            query["day"] = day_filter
+        else:
+            return None
+    return query
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally refresh latest-status counters for nzpost_summary_append")
+    parser.add_argument("--collection", action="append", choices=COLLECTIONS,
+                        help="Collection to refresh (repeatable, default: all)")
+    parser.add_argument("--interval", type=int, default=0,
+                        help="Refresh every N seconds instead of running once")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Discard derived state and recompute from the first event")
+    args = parser.parse_args()
+
+    collection_names = args.collection or COLLECTIONS
+    client = pymongo.MongoClient(MONGO_URI)
+    print(f"Connected to MongoDB at {MONGO_URI}")
+
+    try:
+        rebuild = args.rebuild
+        while True:
+            print(f"\nRefresh started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            refresh_all(client, collection_names, rebuild=rebuild)
+            rebuild = False
+            if args.interval <= 0:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print("\nRefresh loop stopped")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
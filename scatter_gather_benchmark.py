@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Scatter-Gather Count Benchmark for NZ Post Databases
+
+A single aggregation runs on one server thread. This script compares the
+single-pipeline status count with the same count split into disjoint
+sub-queries (by TPID, tracking reference range or day) that run concurrently
+over the connection pool, for every collection size in a database.
+
+Time series collections count each parcel's latest status, which cannot be
+split by day, so only the TPID and reference splits are run for them.
+"""
+
+import argparse
+import pymongo
+from datetime import datetime
+from mongo_query_engine import (SCATTER_SPLITS, DEFAULT_SCATTER_PARTS, WORKLOAD_TPIDS, WORKLOAD_CODES,
+                                is_time_series, get_latest_strategy, latest_status_count_pipeline,
+                                latest_strategy_target, benchmark_scatter_gather)
+
+# MongoDB connection parameters
+MONGO_URI = "mongodb://localhost:27017/"
+
+# Collection names
+COLLECTIONS = [
+    "summary_1_week",
+    "summary_2_weeks",
+    "summary_1_month",
+    "summary_3_months"
+]
+
+def benchmark_collection(collection, tpids, codes, splits, parts):
+    """Benchmark one collection and return the comparison"""
+    if is_time_series(collection):
+        strategy = get_latest_strategy(collection)
+        match_stage = {"tpid": {"$in": tpids}} if tpids else {}
+        build_pipeline = lambda m: latest_status_count_pipeline(strategy, m, codes, collection.name)
+        target = latest_strategy_target(collection, strategy)
+        splits = [split for split in splits if split != "day"]
+    else:
+        match_stage = {"edifact_code": {"$in": codes}}
+        if tpids:
+            match_stage["tpid"] = {"$in": tpids}
+        build_pipeline = lambda m: [{"$match": m}, {"$count": "total"}]
+        target = collection
+    return benchmark_scatter_gather(collection, match_stage, build_pipeline, splits, parts, target=target)
+
+def print_report(db_name: str, results: dict, parts: int):
+    """Print baseline and scatter-gather times per collection"""
+    print(f"\n===== Scatter-Gather Benchmark: {db_name} ({parts} parts) =====")
+    print(f"{'Collection':<20}{'Count':>14}{'Baseline (ms)':>16}{'Split':>12}{'Parts':>7}"
+          f"{'Time (ms)':>12}{'Speedup':>10}")
+    for collection_name, result in results.items():
+        first = True
+        for split, run in result["splits"].items():
+            prefix = (f"{collection_name:<20}{result['count']:>14,}{result['baseline_ms']:>16.2f}"
+                      if first else " " * 50)
+            first = False
+            if "error" in run:
+                print(f"{prefix}{split:>12}  {run['error']}")
+                continue
+            mismatch = "" if run["matches_baseline"] else f"  (count {run['count']:,} differs!)"
+            print(f"{prefix}{split:>12}{run['parts']:>7}{run['time_ms']:>12.2f}{run['speedup']:>9.2f}x{mismatch}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare single-pipeline and scatter-gather status counts")
+    parser.add_argument("--database", default="nzpost_summary",
+                        choices=["nzpost_summary", "nzpost_summary_item", "nzpost_summary_append"])
+    parser.add_argument("--collection", action="append", choices=COLLECTIONS,
+                        help="Collection to test (repeatable, default: all)")
+    parser.add_argument("--split", action="append", choices=SCATTER_SPLITS,
+                        help="Split to test (repeatable, default: all)")
+    parser.add_argument("--parts", type=int, default=DEFAULT_SCATTER_PARTS,
+                        help="Concurrent sub-queries (reference and day splits)")
+    parser.add_argument("--all-tpids", action="store_true",
+                        help="Count over every TPID instead of the five benchmark TPIDs")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(MONGO_URI, maxPoolSize=max(100, args.parts * 2))
+    print(f"Connected to MongoDB at {MONGO_URI}")
+    print(f"Benchmark started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    try:
+        db = client[args.database]
+        tpids = None if args.all_tpids else WORKLOAD_TPIDS
+        results = {}
+        for collection_name in args.collection or COLLECTIONS:
+            print(f"  Testing {collection_name}...")
+            results[collection_name] = benchmark_collection(
+                db[collection_name], tpids, WORKLOAD_CODES, args.split or SCATTER_SPLITS, args.parts
+            )
+        print_report(args.database, results, args.parts)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
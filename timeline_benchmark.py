@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Parcel Timeline Benchmark for NZ Post Databases
+
+Measures the customer-facing workload - the event history of one parcel, or
+of a batch of parcels in one $in round trip - on every dataset layout that
+has been generated:
+- point lookups: p50/p99 latency of single-parcel timelines
+- batched lookups: parcels per second for batches of increasing size
+
+References are sampled from each layout's own collection, because the
+append generator numbers its parcels differently from the others.
+"""
+
+import argparse
+import pymongo
+import random
+import statistics
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+from mongo_query_engine import TIMELINE_MAX_BATCH, parcel_timelines, is_time_series
+from compact_schema import COMPACT_DATABASE, reference_number, reference_string
+from clustered_layout import CLUSTERED_DATABASES
+from item_split import SPLIT_DATABASE
+
+# MongoDB connection parameters
+MONGO_URI = "mongodb://localhost:27017/"
+
+# Collection names
+COLLECTIONS = [
+    "summary_1_week",
+    "summary_2_weeks",
+    "summary_1_month",
+    "summary_3_months"
+]
+
+DEFAULT_POINT_LOOKUPS = 500
+DEFAULT_BATCH_SIZES = [100, 1000, 5000]
+
+def _percentile(values: List[float], percentile: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))]
+
+def _find_lookup(field: str, to_value: Callable = None):
+    """Timeline lookup for layouts read with a plain $in on one field"""
+    def lookup(collection, references: List[str], time_series: bool) -> int:
+        values = [to_value(reference) for reference in references] if to_value else references
+        return len(list(collection.find({field: {"$in": values}})))
+    return lookup
+
+def _engine_lookup(collection, references: List[str], time_series: bool) -> int:
+    return sum(len(events) for events in parcel_timelines(collection, references, time_series=time_series).values())
+
+# Layout -> (database, reference field to sample, sampled value -> reference, lookup)
+LAYOUTS = {
+    "standard": ("nzpost_summary", "tracking_reference", str, _engine_lookup),
+    "item": ("nzpost_summary_item", "tracking_reference", str, _engine_lookup),
+    "item_split": (SPLIT_DATABASE, "tracking_reference", str, _engine_lookup),
+    "append": ("nzpost_summary_append", "tracking_reference", str, _engine_lookup),
+    "compact": (COMPACT_DATABASE, "r", reference_string, _find_lookup("r", reference_number)),
+    "clustered": (CLUSTERED_DATABASES["reference"], "_id", str, _find_lookup("_id")),
+    "clustered_tpid": (CLUSTERED_DATABASES["tpid_reference"], "_id",
+                       lambda key: key["tracking_reference"], _find_lookup("_id.tracking_reference"))
+}
+
+def sample_references(collection, field: str, to_reference: Callable, size: int) -> List[str]:
+    """Distinct references of randomly sampled documents"""
+    rows = collection.aggregate([{"$sample": {"size": size}}, {"$project": {"_id": 0, "value": f"${field}"}}])
+    return list(dict.fromkeys(to_reference(row["value"]) for row in rows))
+
+def benchmark_layout(collection, references: List[str], lookup: Callable, point_lookups: int,
+                     batch_sizes: List[int]) -> Dict:
+    """Point-lookup percentiles and batched throughput for one collection"""
+    # Resolved once, outside the timings, rather than by a listCollections call per lookup
+    time_series = is_time_series(collection)
+    point_ms = []
+    for reference in references[:point_lookups]:
+        start_time = time.time()
+        lookup(collection, [reference], time_series)
+        point_ms.append((time.time() - start_time) * 1000)
+
+    batches = {}
+    for batch_size in batch_sizes:
+        batch = references[:batch_size]
+        start_time = time.time()
+        events = lookup(collection, batch, time_series)
+        elapsed = time.time() - start_time
+        batches[batch_size] = {"parcels": len(batch), "events": events, "time_ms": elapsed * 1000,
+                               "parcels_per_second": len(batch) / elapsed if elapsed > 0 else 0.0}
+    return {
+        "p50_ms": statistics.median(point_ms) if point_ms else None,
+        "p99_ms": _percentile(point_ms, 99) if point_ms else None,
+        "lookups": len(point_ms),
+        "batches": batches
+    }
+
+def print_report(collection_name: str, results: Dict[str, Dict], batch_sizes: List[int]):
+    """Print point-lookup latency and batch throughput per layout"""
+    print(f"\n===== Parcel Timelines: {collection_name} =====")
+    print(f"{'Layout':<16}{'p50 (ms)':>10}{'p99 (ms)':>10}" +
+          "".join(f"{f'{size} batch/s':>16}" for size in batch_sizes))
+    for layout, result in results.items():
+        throughput = "".join(
+            f"{result['batches'][size]['parcels_per_second']:>16,.0f}" if size in result["batches"] else f"{'-':>16}"
+            for size in batch_sizes)
+        print(f"{layout:<16}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}{throughput}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parcel timeline lookups on every dataset layout")
+    parser.add_argument("--collection", action="append", choices=COLLECTIONS,
+                        help="Collection to test (repeatable, default: all)")
+    parser.add_argument("--layout", action="append", choices=list(LAYOUTS),
+                        help="Layout to test (repeatable, default: every generated layout)")
+    parser.add_argument("--point-lookups", type=int, default=DEFAULT_POINT_LOOKUPS)
+    parser.add_argument("--batch-size", type=int, action="append",
+                        help=f"Batch size to test (repeatable, max {TIMELINE_MAX_BATCH})")
+    args = parser.parse_args()
+    batch_sizes = sorted(min(size, TIMELINE_MAX_BATCH) for size in args.batch_size or DEFAULT_BATCH_SIZES)
+
+    client = pymongo.MongoClient(MONGO_URI)
+    print(f"Connected to MongoDB at {MONGO_URI}")
+    print(f"Benchmark started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    try:
+        for collection_name in args.collection or COLLECTIONS:
+            results = {}
+            for layout in args.layout or LAYOUTS:
+                db_name, field, to_reference, lookup = LAYOUTS[layout]
+                if collection_name not in client[db_name].list_collection_names():
+                    continue
+                print(f"  Testing {layout} ({db_name}.{collection_name})...")
+                collection = client[db_name][collection_name]
+                references = sample_references(collection, field, to_reference,
+                                               max(args.point_lookups, batch_sizes[-1]))
+                random.shuffle(references)
+                results[layout] = benchmark_layout(collection, references, lookup, args.point_lookups, batch_sizes)
+            print_report(collection_name, results, batch_sizes)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+TPID Filter Benchmark for NZ Post Databases
+
+Selecting many TPIDs used to mean one long $in list: every value is a separate
+index interval the planner has to build bounds for and the scan has to seek to.
+The generated TPIDs are sequential, so the same selection compiles to a few
+range predicates (mongo_query_engine.tpid_filter).
+
+For 10, 100 and 500 TPIDs (capped at the TPIDs the collection has) this script
+compares both forms on a status count:
+- planning: round-trip time of a queryPlanner explain, and the size of the filter
+- execution: count time, keys examined and index seeks from executionStats
+"""
+
+import argparse
+import bson
+import pymongo
+import statistics
+import time
+from datetime import datetime
+from typing import Dict, List
+from mongo_query_engine import tpid_filter, tpid_ranges, format_tpid_ranges, explain_aggregate
+
+# MongoDB connection parameters
+MONGO_URI = "mongodb://localhost:27017/"
+
+DATABASES = ["nzpost_summary", "nzpost_summary_item", "nzpost_summary_append"]
+
+# Collection names
+COLLECTIONS = [
+    "summary_1_week",
+    "summary_2_weeks",
+    "summary_1_month",
+    "summary_3_months"
+]
+
+DEFAULT_TPID_COUNTS = [10, 100, 500]
+DEFAULT_STATUS_CODE = 500
+DEFAULT_REPEATS = 5
+
+def count_pipeline(match_stage: Dict) -> List[Dict]:
+    return [{"$match": match_stage}, {"$count": "total"}]
+
+def _index_scan_totals(node, totals: Dict):
+    """Sum seeks and count the index intervals of every IXSCAN in an explain tree"""
+    if isinstance(node, dict):
+        if node.get("stage") == "IXSCAN":
+            totals["seeks"] += node.get("seeks", 0)
+            totals["intervals"] += sum(len(bounds) for bounds in node.get("indexBounds", {}).values()
+                                       if isinstance(bounds, list))
+        for value in node.values():
+            _index_scan_totals(value, totals)
+    elif isinstance(node, list):
+        for item in node:
+            _index_scan_totals(item, totals)
+
+def measure_filter(collection, match_stage: Dict, hint, repeats: int) -> Dict:
+    """Planning and execution cost of a status count with the given filter"""
+    pipeline = count_pipeline(match_stage)
+    planner_command = {"aggregate": collection.name, "pipeline": pipeline, "cursor": {}}
+    if hint:
+        planner_command["hint"] = hint
+
+    planning_ms, execution_ms, count = [], [], 0
+    for _ in range(repeats):
+        start_time = time.time()
+        collection.database.command({"explain": planner_command, "verbosity": "queryPlanner"})
+        planning_ms.append((time.time() - start_time) * 1000)
+
+        start_time = time.time()
+        result = list(collection.aggregate(pipeline, hint=hint) if hint else collection.aggregate(pipeline))
+        execution_ms.append((time.time() - start_time) * 1000)
+        count = result[0]["total"] if result else 0
+
+    explain = explain_aggregate(collection, pipeline, hint)
+    totals = {"seeks": 0, "intervals": 0, "keys_examined": 0}
+    _index_scan_totals(explain, totals)
+    stats = explain.get("executionStats")
+    if stats is None:
+        # Pipelines that are not pushed down report under the $cursor stage
+        stats = explain.get("stages", [{}])[0].get("$cursor", {}).get("executionStats", {})
+    totals["keys_examined"] = stats.get("totalKeysExamined", 0)
+    return {
+        "filter_bytes": len(bson.encode(match_stage)),
+        "planning_ms": statistics.median(planning_ms),
+        "execution_ms": statistics.median(execution_ms),
+        "count": count,
+        **totals
+    }
+
+def benchmark_collection(collection, tpid_counts: List[int], status_code: int, hint, repeats: int) -> Dict:
+    """$in against range predicates for growing TPID selections"""
+    available = sorted(collection.distinct("tpid"))
+    results = {}
+    for tpid_count in tpid_counts:
+        tpids = available[:tpid_count]
+        in_match = {"tpid": {"$in": tpids}, "edifact_code": status_code}
+        range_match = {**tpid_filter(tpid_ranges(tpids)), "edifact_code": status_code}
+        results[tpid_count] = {
+            "tpids": len(tpids),
+            "ranges": format_tpid_ranges(tpid_ranges(tpids)),
+            "in": measure_filter(collection, in_match, hint, repeats),
+            "range": measure_filter(collection, range_match, hint, repeats)
+        }
+    return results
+
+def print_report(name: str, results: Dict):
+    """Print the $in and range figures side by side"""
+    print(f"\n===== TPID Filters: {name} =====")
+    print(f"{'TPIDs':>6}  {'Form':<6}{'Filter B':>10}{'Plan (ms)':>11}{'Exec (ms)':>11}{'Keys':>12}"
+          f"{'Seeks':>8}{'Intervals':>11}{'Count':>12}")
+    for result in results.values():
+        for form in ("in", "range"):
+            row = result[form]
+            print(f"{result['tpids']:>6}  {form:<6}{row['filter_bytes']:>10,}{row['planning_ms']:>11.2f}"
+                  f"{row['execution_ms']:>11.2f}{row['keys_examined']:>12,}{row['seeks']:>8,}"
+                  f"{row['intervals']:>11,}{row['count']:>12,}")
+        if result["in"]["count"] != result["range"]["count"]:
+            print(f"        WARNING: counts differ for {result['ranges']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare $in TPID lists with range predicates")
+    parser.add_argument("--database", action="append", choices=DATABASES,
+                        help="Database to test (repeatable, default: all)")
+    parser.add_argument("--collection", action="append", choices=COLLECTIONS,
+                        help="Collection to test (repeatable, default: all)")
+    parser.add_argument("--tpids", type=int, action="append",
+                        help="Number of TPIDs to select (repeatable, default: 10, 100 and 500)")
+    parser.add_argument("--status", type=int, default=DEFAULT_STATUS_CODE, help="Edifact code to count")
+    parser.add_argument("--hint", help="Index hint for both forms (default: let the planner choose)")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS, help="Runs per measurement")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(MONGO_URI)
+    print(f"Connected to MongoDB at {MONGO_URI}")
+    print(f"Benchmark started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    try:
+        for db_name in args.database or DATABASES:
+            existing = client[db_name].list_collection_names()
+            for collection_name in args.collection or COLLECTIONS:
+                if collection_name not in existing:
+                    continue
+                print(f"  Testing {db_name}.{collection_name}...")
+                results = benchmark_collection(client[db_name][collection_name], args.tpids or DEFAULT_TPID_COUNTS,
+                                               args.status, args.hint, args.repeats)
+                print_report(f"{db_name}.{collection_name}", results)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()